@@ -4,12 +4,14 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from flask_migrate import Migrate
 from app.config import DevConfig, TestConfig, ProdConfig
+from app.database import ReplicaRouter, RoutingSession, configure_engines
+
 try:
     from flasgger import Swagger
 except ImportError:
     Swagger = None
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 ma = Marshmallow()
 migrate = Migrate()
 
@@ -30,7 +32,9 @@ def create_app(config_name=None):
     else:
         app.config.from_object(DevConfig)
 
+    configure_engines(app.config)
     db.init_app(app)
+    ReplicaRouter(app, db)
     ma.init_app(app)
     migrate.init_app(app, db)
 
@@ -57,9 +61,30 @@ def create_app(config_name=None):
     if app.config.get("FLASK_PROFILER", {}).get("enabled"):
         from flask_profiler import Profiler
         Profiler(app)
-    from app.routes import receipts_bp, upload_bp
+    from app.group_commit import GroupCommitWriter
+    from app.jobs import JobQueue
+    from app.pipeline import ResultCache
+
+    JobQueue(app)
+    GroupCommitWriter(app)
+    app.extensions['ocr_cache'] = ResultCache(app.config.get('OCR_CACHE_SIZE', 1024))
+    from app.read_cache import ReadCache
+
+    app.extensions['read_cache'] = ReadCache.from_config(app.config)
+
+    from app.routes import receipts_bp, upload_bp, jobs_bp, metrics_bp, analytics_bp
+
     app.register_blueprint(upload_bp)
     app.register_blueprint(receipts_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(analytics_bp)
+
+    from app.commands import receipts_cli, rollups_cli, storage_cli
+
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(receipts_cli)
+    app.cli.add_command(storage_cli)
 
     # Register blueprints here
 
@@ -0,0 +1,568 @@
+import datetime
+import os
+import threading
+import time
+from collections import Counter
+import numpy as np
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.database import reading_replica
+from app.models import Receipt, SpendRollup, split_tags, upsert_insert
+
+ROLLUP_FIELDS = ('merchant', 'date', 'total', 'tags')
+TIME_BUCKETS = ('day', 'week', 'month')
+KEY_DIMENSIONS = ('merchant', 'tag')
+
+
+def period_start(day: datetime.date, grain: str) -> datetime.date:
+    if grain == 'month':
+        return day.replace(day=1)
+    if grain == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day
+
+
+def next_period(start: datetime.date, grain: str) -> datetime.date:
+    if grain == 'month':
+        return (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return start + datetime.timedelta(days=7 if grain == 'week' else 1)
+
+
+def _cells(merchant, day, total, tags):
+    """
+    The rollup cells one receipt contributes to, as
+    {(grain, dimension, period, key): cents}. Receipts without a date are
+    left out.
+    """
+    if day is None:
+        return {}
+    cents = round(total * 100) if total else 0
+    keys = [('all', ''), ('merchant', merchant or '')] + [
+        ('tag', tag) for tag in split_tags(tags)
+    ]
+    return {
+        (grain, dimension, period_start(day, grain), key): cents
+        for grain in TIME_BUCKETS
+        for dimension, key in keys
+    }
+
+
+def _add(counts, totals, cells, sign):
+    for cell, cents in cells.items():
+        counts[cell] += sign
+        totals[cell] += sign * cents
+
+
+def apply_deltas(connection, counts, totals) -> None:
+    """
+    Add receipt-count and spend deltas to their rollup cells with one
+    upsert per batch. Cells are upserted in key order: concurrent
+    transactions touching the same cells (every receipt touches the 'all'
+    ones) then lock them in the same order and cannot deadlock.
+    """
+    rows = [
+        {
+            'grain': cell[0],
+            'dimension': cell[1],
+            'period': cell[2],
+            'key': cell[3],
+            'receipts': counts[cell],
+            'total_cents': totals[cell],
+        }
+        for cell in sorted(counts.keys() | totals.keys())
+        if counts[cell] or totals[cell]
+    ]
+    if not rows:
+        return
+    table = SpendRollup.__table__
+    insert = upsert_insert(connection.dialect.name, table)
+    connection.execute(
+        insert.on_conflict_do_update(
+            index_elements=[
+                table.c.grain,
+                table.c.dimension,
+                table.c.period,
+                table.c.key,
+            ],
+            set_={
+                'receipts': table.c.receipts + insert.excluded.receipts,
+                'total_cents': table.c.total_cents + insert.excluded.total_cents,
+            },
+        ),
+        rows,
+    )
+
+
+def add_to_rollups(connection, receipts) -> None:
+    """
+    Add new receipts, as (merchant, date, total, tags) tuples, to the
+    rollups. For writers that insert receipts without the ORM, which the
+    flush hook below never sees.
+    """
+    counts, totals = Counter(), Counter()
+    for receipt in receipts:
+        _add(counts, totals, _cells(*receipt), 1)
+    apply_deltas(connection, counts, totals)
+
+
+@sa.event.listens_for(sa.orm.Session, 'before_flush')
+def _update_rollups(session, flush_context, instances):
+    """
+    Move a receipt's contribution from its stored values to its new ones
+    whenever merchant, date, total or tags change, in the flush's own
+    transaction.
+    """
+    changed = [obj for obj in session.new if isinstance(obj, Receipt)]
+    changed += [
+        obj
+        for obj in session.dirty
+        if isinstance(obj, Receipt)
+        and any(sa.inspect(obj).attrs[f].history.has_changes() for f in ROLLUP_FIELDS)
+    ]
+    deleted = [obj for obj in session.deleted if isinstance(obj, Receipt)]
+    if not changed and not deleted:
+        return
+    connection = session.connection()
+    # The rows still hold the values as of the last flush
+    stored_ids = [obj.id for obj in changed + deleted if obj.id is not None]
+    stored = {}
+    if stored_ids:
+        table = Receipt.__table__
+        query = sa.select(table.c.id, *(table.c[f] for f in ROLLUP_FIELDS)).where(
+            table.c.id.in_(stored_ids)
+        )
+        stored = {row.id: row[1:] for row in connection.execute(query)}
+    counts, totals = Counter(), Counter()
+    for obj in changed + deleted:
+        if obj.id in stored:
+            _add(counts, totals, _cells(*stored[obj.id]), -1)
+    for obj in changed:
+        _add(counts, totals, _cells(obj.merchant, obj.date, obj.total, obj.tags), 1)
+    apply_deltas(connection, counts, totals)
+
+
+def rebuild_rollups(batch_size: int = 5000) -> int:
+    """
+    Recompute every rollup from the receipts table, reading receipts in id
+    batches. Runs in one transaction so readers never see a partial
+    rollup. Returns the number of receipts read.
+    """
+    table = Receipt.__table__
+    connection = db.session.connection()
+    connection.execute(sa.delete(SpendRollup.__table__))
+    last_id, seen = 0, 0
+    while True:
+        rows = connection.execute(
+            sa.select(table.c.id, *(table.c[f] for f in ROLLUP_FIELDS))
+            .where(table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        counts, totals = Counter(), Counter()
+        for row in rows:
+            _add(counts, totals, _cells(*row[1:]), 1)
+        apply_deltas(connection, counts, totals)
+        last_id, seen = rows[-1].id, seen + len(rows)
+    db.session.commit()
+    return seen
+
+
+def _bucket(day: datetime.date, unit: str) -> str:
+    if unit == 'month':
+        return f'{day.year:04d}-{day.month:02d}'
+    if unit == 'week':
+        year, week, _ = day.isocalendar()
+        return f'{year:04d}-W{week:02d}'
+    return day.isoformat()
+
+
+def _plan(unit, date_from, date_to):
+    """
+    Split [date_from, date_to] into (grain, first period, end) ranges to
+    read: whole weeks or months from their own cells and the partial
+    periods at either end from day cells. ``end`` is exclusive; None
+    bounds are open.
+    """
+    grain = unit or 'month'
+    if grain == 'day':
+        return [('day', date_from, date_to and date_to + datetime.timedelta(days=1))]
+    low = date_from
+    if date_from is not None and period_start(date_from, grain) != date_from:
+        low = next_period(period_start(date_from, grain), grain)
+    high = None
+    if date_to is not None:
+        high = period_start(date_to, grain)
+        if next_period(high, grain) == date_to + datetime.timedelta(days=1):
+            high = next_period(high, grain)
+    if low is not None and high is not None and low >= high:
+        # Inside a single period: days only
+        return [('day', date_from, date_to + datetime.timedelta(days=1))]
+    ranges = [(grain, low, high)]
+    if low != date_from:
+        ranges.append(('day', date_from, low))
+    if date_to is not None and high != date_to + datetime.timedelta(days=1):
+        ranges.append(('day', high, date_to + datetime.timedelta(days=1)))
+    return ranges
+
+
+def summary(group_by, date_from=None, date_to=None) -> list:
+    """
+    Receipt counts and spend from the rollup table, grouped by at most one
+    time bucket (day, week, month) and at most one of merchant or tag.
+    Whole periods are read from week or month cells, so the cost depends
+    on the number of periods and keys in range, not on receipts.
+    """
+    unit = next((g for g in group_by if g in TIME_BUCKETS), None)
+    dimension = next((g for g in group_by if g in KEY_DIMENSIONS), 'all')
+    columns = ([SpendRollup.period] if unit else []) + (
+        [SpendRollup.key] if dimension != 'all' else []
+    )
+    counts, totals = Counter(), Counter()
+    for grain, low, high in _plan(unit, date_from, date_to):
+        query = sa.select(
+            *columns,
+            sa.func.sum(SpendRollup.receipts),
+            sa.func.sum(SpendRollup.total_cents),
+        ).where(SpendRollup.grain == grain, SpendRollup.dimension == dimension)
+        if low is not None:
+            query = query.where(SpendRollup.period >= low)
+        if high is not None:
+            query = query.where(SpendRollup.period < high)
+        if columns:
+            query = query.group_by(*columns)
+        for row in db.session.execute(query):
+            group = []
+            if unit:
+                group.append(_bucket(row[0], unit))
+            if dimension != 'all':
+                group.append(row[len(group)] or None)
+            counts[tuple(group)] += row[-2] or 0
+            totals[tuple(group)] += row[-1] or 0
+    names = ([unit] if unit else []) + ([dimension] if dimension != 'all' else [])
+    groups = [
+        dict(
+            zip(names, group),
+            receipts=counts[group],
+            total=round(totals[group] / 100, 2),
+        )
+        for group in counts
+        if counts[group]
+    ]
+    # Time buckets in order; within a bucket, biggest spend first
+    groups.sort(key=lambda g: (g.get(unit, ''), -g['total']))
+    return groups
+
+
+# --- Columnar snapshot -------------------------------------------------------
+
+# Rebuild at least this often even without local writes, to pick up
+# receipts written by other processes (seconds; 0 rebuilds every time)
+SNAPSHOT_TTL = float(os.getenv('ANALYTICS_SNAPSHOT_TTL', 300))
+SNAPSHOT_CHUNK = int(os.getenv('ANALYTICS_SNAPSHOT_CHUNK', 50_000))
+
+_snapshot_lock = threading.Lock()
+_generation = 0  # bumped by every commit that touched receipts
+_invalidated_at = float('-inf')  # time.monotonic() of the last bump
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_NAT = np.datetime64('NaT').astype(np.int64)
+
+
+class Snapshot:
+    """
+    Columnar copy of every receipt with a total, for vectorized statistics:
+    ``ids`` (int64), ``cents`` (int64), ``days`` (datetime64[D], NaT when
+    unknown) and ``merchant_codes`` (int32 index into ``merchants``, -1
+    when unknown). 28 bytes per receipt plus one string per merchant.
+    """
+
+    def __init__(self, ids, cents, days, merchant_codes, merchants, generation=0):
+        self.ids = ids
+        self.cents = cents
+        self.days = days
+        self.merchant_codes = merchant_codes
+        self.merchants = merchants
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.reload_at = None  # set when it may be missing recent writes
+
+    @classmethod
+    def load(cls, session, chunk_size: int = None, generation: int = 0) -> 'Snapshot':
+        """
+        Stream receipts in id order, ``chunk_size`` rows at a time, into
+        preallocated arrays. Only the arrays and one chunk of rows are held
+        in memory at once.
+        """
+        chunk_size = chunk_size or SNAPSHOT_CHUNK
+        table = Receipt.__table__
+        has_total = table.c.total.isnot(None)
+        size = session.execute(sa.select(sa.func.count()).where(has_total)).scalar()
+        ids = np.empty(size, np.int64)
+        cents = np.empty(size, np.int64)
+        days = np.empty(size, 'datetime64[D]')
+        codes = np.empty(size, np.int32)
+        merchants = {}
+        filled = 0
+        result = session.execute(
+            sa.select(table.c.id, table.c.total, table.c.date, table.c.merchant)
+            .where(has_total)
+            .order_by(table.c.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        for rows in result.partitions():
+            end = filled + len(rows)
+            if end > len(ids):
+                # Receipts added since the count
+                grow = max(end, len(ids) * 5 // 4)
+                ids, cents, days, codes = (
+                    np.resize(a, grow) for a in (ids, cents, days, codes)
+                )
+            chunk_ids, totals, dates, names = zip(*rows)
+            ids[filled:end] = chunk_ids
+            cents[filled:end] = np.rint(np.array(totals, np.float64) * 100)
+            # Via ordinals: NumPy converts date objects an order of magnitude slower
+            days[filled:end] = np.array(
+                [_NAT if d is None else d.toordinal() - _EPOCH_ORDINAL for d in dates],
+                np.int64,
+            ).view('datetime64[D]')
+            codes[filled:end] = [
+                -1 if n is None else merchants.setdefault(n, len(merchants))
+                for n in names
+            ]
+            filled = end
+        # Receipts deleted since the count leave spare room; drop it
+        ids, cents, days, codes = (
+            a if len(a) == filled else a[:filled].copy()
+            for a in (ids, cents, days, codes)
+        )
+        return cls(ids, cents, days, codes, list(merchants), generation)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.ids.nbytes
+            + self.cents.nbytes
+            + self.days.nbytes
+            + self.merchant_codes.nbytes
+        )
+
+    def stats(self) -> dict:
+        return {
+            'rows': len(self),
+            'merchants': len(self.merchants),
+            'bytes': self.nbytes,
+            'bytes_per_row': round(self.nbytes / len(self), 1) if len(self) else 0,
+            'age_seconds': round(time.monotonic() - self.built_at, 3),
+        }
+
+    def mask(self, date_from=None, date_to=None):
+        """
+        Boolean mask of receipts dated within the range; None when there is
+        no range, so callers can skip the copy.
+        """
+        if date_from is None and date_to is None:
+            return None
+        keep = ~np.isnat(self.days)
+        if date_from is not None:
+            keep &= self.days >= np.datetime64(date_from, 'D')
+        if date_to is not None:
+            keep &= self.days <= np.datetime64(date_to, 'D')
+        return keep
+
+    def percentiles(self, ps, date_from=None, date_to=None) -> dict:
+        keep = self.mask(date_from, date_to)
+        cents = self.cents if keep is None else self.cents[keep]
+        if not len(cents):
+            return {p: None for p in ps}
+        values = np.percentile(cents, ps) / 100
+        return {p: round(float(v), 2) for p, v in zip(ps, values)}
+
+    def moving_average(self, window: int, date_from=None, date_to=None) -> list:
+        """
+        Spend per day over the range and its trailing ``window``-day mean.
+        Days without receipts count as zero spend.
+        """
+        dated = ~np.isnat(self.days)
+        keep = self.mask(date_from, date_to)
+        keep = dated if keep is None else keep
+        if not keep.any():
+            return []
+        days = self.days[keep]
+        start = np.datetime64(date_from, 'D') if date_from else days.min()
+        end = np.datetime64(date_to, 'D') if date_to else days.max()
+        length = int((end - start).astype(np.int64)) + 1
+        offsets = (days - start).astype(np.int64)
+        daily = np.bincount(offsets, weights=self.cents[keep], minlength=length)[
+            :length
+        ]
+        sums = np.cumsum(daily)
+        trailing = sums - np.concatenate((np.zeros(window), sums[:-window]))[:length]
+        counts = np.minimum(np.arange(1, length + 1), window)
+        averages = trailing / counts
+        dates = np.arange(start, end + 1).astype(str)
+        return [
+            {
+                'date': d,
+                'total': round(float(t) / 100, 2),
+                'average': round(float(a) / 100, 2),
+            }
+            for d, t, a in zip(dates, daily, averages)
+        ]
+
+    def merchant_outliers(
+        self,
+        threshold: float = 3.0,
+        min_count: int = 5,
+        limit: int = 100,
+        date_from=None,
+        date_to=None,
+    ) -> list:
+        """
+        Receipts whose amount is at least ``threshold`` standard deviations
+        from their merchant's mean, among merchants with ``min_count`` or
+        more receipts. Largest deviations first.
+        """
+        keep = self.mask(date_from, date_to)
+        known = (
+            self.merchant_codes >= 0
+            if keep is None
+            else keep & (self.merchant_codes >= 0)
+        )
+        codes, cents, ids = (
+            self.merchant_codes[known],
+            self.cents[known].astype(np.float64),
+            self.ids[known],
+        )
+        n = len(self.merchants)
+        count = np.bincount(codes, minlength=n)
+        mean = np.bincount(codes, weights=cents, minlength=n) / np.maximum(count, 1)
+        var = (
+            np.bincount(codes, weights=cents * cents, minlength=n)
+            / np.maximum(count, 1)
+            - mean * mean
+        )
+        std = np.sqrt(np.maximum(var, 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (cents - mean[codes]) / std[codes]
+        flagged = np.flatnonzero(
+            (count[codes] >= min_count) & (std[codes] > 0) & (np.abs(z) >= threshold)
+        )
+        flagged = flagged[np.argsort(-np.abs(z[flagged]), kind='stable')][:limit]
+        return [
+            {
+                'id': int(ids[i]),
+                'merchant': self.merchants[codes[i]],
+                'total': cents[i] / 100,
+                'merchant_mean': round(float(mean[codes[i]]) / 100, 2),
+                'z': round(float(z[i]), 2),
+            }
+            for i in flagged
+        ]
+
+    def duplicate_amounts(
+        self, window_days: int = 0, limit: int = 100, date_from=None, date_to=None
+    ) -> list:
+        """
+        Groups of receipts from the same merchant with the same amount,
+        dated at most ``window_days`` apart (chained), e.g. a receipt
+        uploaded twice. Receipts without merchant or date are skipped.
+        """
+        keep = ~np.isnat(self.days) & (self.merchant_codes >= 0)
+        window = self.mask(date_from, date_to)
+        if window is not None:
+            keep &= window
+        idx = np.flatnonzero(keep)
+        if not len(idx):
+            return []
+        codes, cents, days = (
+            self.merchant_codes[idx],
+            self.cents[idx],
+            self.days[idx].astype(np.int64),
+        )
+        # (merchant, amount) packed into one sort key
+        low = cents.min()
+        pair = codes.astype(np.int64) * (int(cents.max() - low) + 1) + (cents - low)
+        order = np.lexsort((days, pair))
+        codes, cents, days, pair, idx = (
+            codes[order],
+            cents[order],
+            days[order],
+            pair[order],
+            idx[order],
+        )
+        # A row continues the previous one's group when merchant and amount
+        # match and the dates are close enough
+        joined = (pair[1:] == pair[:-1]) & (days[1:] - days[:-1] <= window_days)
+        starts = np.flatnonzero(np.concatenate(([True], ~joined)))
+        ends = np.append(starts[1:], len(idx))
+        groups = []
+        for s, e in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            groups.append(
+                {
+                    'merchant': self.merchants[codes[s]],
+                    'total': int(cents[s]) / 100,
+                    'ids': [int(self.ids[i]) for i in idx[s:e]],
+                    'dates': [str(d) for d in self.days[idx[s:e]]],
+                }
+            )
+            if len(groups) >= limit:
+                break
+        return groups
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_flush')
+def _note_receipt_writes(session, flush_context):
+    if any(
+        isinstance(obj, Receipt)
+        for obj in (*session.new, *session.dirty, *session.deleted)
+    ):
+        session.info['receipts_written'] = True
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('receipts_written', False):
+        invalidate_snapshot()
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_rollback')
+def _forget_rolled_back_writes(session):
+    session.info.pop('receipts_written', None)
+
+
+def invalidate_snapshot() -> None:
+    """
+    Mark the cached snapshot stale; the next get_snapshot() reloads it.
+    Called on commit of any receipt change made through the ORM.
+    """
+    global _generation, _invalidated_at
+    _generation += 1
+    _invalidated_at = time.monotonic()
+
+
+def get_snapshot() -> Snapshot:
+    """
+    The app's cached snapshot, reloaded after local writes or SNAPSHOT_TTL.
+    """
+    with _snapshot_lock:
+        current = current_app.extensions.get('analytics_snapshot')
+        now = time.monotonic()
+        if (
+            current is None
+            or current.generation != _generation
+            or now - current.built_at >= SNAPSHOT_TTL
+            or (current.reload_at is not None and now >= current.reload_at)
+        ):
+            current = Snapshot.load(db.session, generation=_generation)
+            settled = _invalidated_at + current_app.config.get('REPLICA_MAX_LAG', 0)
+            if reading_replica(db.session) and now < settled:
+                # The replica may not have the last local writes yet; load
+                # again once they have had time to arrive
+                current.reload_at = settled
+            current_app.extensions['analytics_snapshot'] = current
+        return current
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping with least-recently-used eviction and
+    hit/miss/eviction counters. A maxsize of 0 disables caching.
+    With ``ttl`` (seconds) set, entries older than that count as misses.
+    With ``sizeof`` set (e.g. ``len`` for bytes values), maxsize bounds the
+    total size of the values instead of their number.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _weigh(self, value) -> int:
+        return self.sizeof(value) if self.sizeof else 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.weight -= self._weigh(value)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        weight = self._weigh(value)
+        if weight > self.maxsize:
+            # Too big to ever fit; drop any older value instead of keeping it
+            self.pop(key)
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.weight -= self._weigh(old[0])
+            self._data[key] = (value, expires_at)
+            self.weight += weight
+            while self.weight > self.maxsize:
+                _, (evicted, _) = self._data.popitem(last=False)
+                self.weight -= self._weigh(evicted)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.weight -= self._weigh(entry[0])
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            **({'bytes': self.weight} if self.sizeof else {}),
+        }
+
+
+class FileCache:
+    """
+    Bytes values in files under ``directory``, so every worker process on a
+    host shares one cache. Same interface as LRUCache with sizeof=len.
+    Entries are written to a temp file and renamed into place, so readers
+    never see a partial value. Each file starts with its expiry time; hits
+    touch its mtime, and once about a tenth of ``maxsize`` bytes has been
+    written the directory is swept, removing expired files and then the
+    least recently used until the total is back under ``maxsize``. The
+    hit/miss counters are this process's.
+    """
+
+    _EXPIRES = struct.Struct('<d')
+
+    def __init__(self, directory: str, maxsize: int, ttl: float = None):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key) -> str:
+        return os.path.join(
+            self.directory, hashlib.sha1(repr(key).encode()).hexdigest()
+        )
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        (expires_at,) = self._EXPIRES.unpack_from(data)
+        if expires_at and expires_at <= time.time():
+            self._remove(path)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return data[self._EXPIRES.size :]
+
+    def set(self, key, value: bytes) -> None:
+        if len(value) > self.maxsize:
+            self.pop(key)
+            return
+        expires_at = time.time() + self.ttl if self.ttl else 0.0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as out:
+            out.write(self._EXPIRES.pack(expires_at))
+            out.write(value)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._written += len(value)
+            sweep = self._written > self.maxsize // 10
+            if sweep:
+                self._written = 0
+        if sweep:
+            self.sweep()
+
+    def pop(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()[self._EXPIRES.size :]
+        except FileNotFoundError:
+            return default
+        self._remove(path)
+        return value
+
+    def clear(self) -> None:
+        for entry in os.scandir(self.directory):
+            self._remove(entry.path)
+
+    def _remove(self, path) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.tmp-'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def sweep(self) -> None:
+        # Expired entries are never touched, so they are among the first to go
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.maxsize:
+                break
+            self._remove(path)
+            self.evictions += 1
+            total -= size
+
+    def __len__(self):
+        return len(self._entries())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        entries = self._entries()
+        return {
+            'size': len(entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'bytes': sum(size for _, size, _ in entries),
+        }
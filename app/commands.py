@@ -0,0 +1,130 @@
+import click
+from flask.cli import AppGroup
+from app import analytics, images, importer, storage
+
+rollups_cli = AppGroup(
+    'rollups', help='Maintain the spend rollups behind /analytics/summary.'
+)
+receipts_cli = AppGroup('receipts', help='Bulk receipt operations.')
+storage_cli = AppGroup('storage', help='Manage stored receipt files.')
+
+
+@rollups_cli.command('rebuild')
+@click.option(
+    '--batch-size', default=5000, show_default=True, help='Receipts read per batch.'
+)
+def rebuild(batch_size):
+    """
+    Recompute all rollups from the receipts table.
+    """
+    count = analytics.rebuild_rollups(batch_size)
+    click.echo(f'Rebuilt rollups from {count} receipts')
+
+
+@receipts_cli.command('import')
+@click.argument('source', type=click.File('rb'))
+@click.option(
+    '--format',
+    'fmt',
+    type=click.Choice(importer.FORMATS),
+    help='Input format; defaults to the file extension.',
+)
+@click.option(
+    '--chunk-size',
+    default=importer.IMPORT_CHUNK_ROWS,
+    show_default=True,
+    help='Rows validated and written per transaction.',
+)
+def import_receipts(source, fmt, chunk_size):
+    """
+    Import receipts from a CSV or NDJSON file (- for stdin). Safe to re-run:
+    rows whose import_key is already stored are skipped.
+    """
+    fmt = fmt or importer.format_for(getattr(source, 'name', ''))
+    if fmt is None:
+        raise click.UsageError(
+            'Cannot tell the format from the file name; pass --format'
+        )
+    try:
+        report = importer.import_receipts(source, fmt, chunk_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(
+        f'Imported {report.imported} receipts, {report.duplicates} duplicates, '
+        f'{report.failed} failed'
+    )
+    for error in report.errors:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    if report.failed:
+        raise click.exceptions.Exit(1)
+
+
+@receipts_cli.command('compact')
+@click.option(
+    '--workers',
+    default=4,
+    show_default=True,
+    help='Images decoded and encoded at once.',
+)
+@click.option(
+    '--batch-size',
+    default=images.IMAGE_COMPACT_BATCH,
+    show_default=True,
+    help='Uploads compacted per transaction.',
+)
+@click.option(
+    '--replace-originals',
+    is_flag=True,
+    help=(
+        'Delete uploads whose receipts were all OCR\'d successfully, '
+        'keeping the full-size copy.'
+    ),
+)
+def compact(workers, batch_size, replace_originals):
+    """
+    Make grayscale copies and thumbnails of stored uploads that have none.
+    Safe to interrupt and re-run: it carries on with the uploads not done yet.
+    """
+    report = images.compact_all(workers, batch_size, replace_originals).to_dict()
+    click.echo(
+        f"Compacted {report['files']} files for {report['receipts']} receipts: "
+        f"{report['original_bytes']} bytes of originals, "
+        f"{report['compact_bytes']} bytes of copies"
+    )
+    click.echo(
+        f"Replaced {report['replaced']} originals, "
+        f"{report['bytes_saved']} bytes saved, "
+        f"{report['failed']} failed"
+    )
+    for error in report['errors']:
+        click.echo(f"{error['key']}: {error['error']}", err=True)
+    if report['failed']:
+        raise click.exceptions.Exit(1)
+
+
+@storage_cli.command('rehome')
+@click.option(
+    '--workers', default=8, show_default=True, help='Files hashed and moved at once.'
+)
+@click.option(
+    '--batch-size',
+    default=storage.REHOME_BATCH,
+    show_default=True,
+    help='Files moved per transaction.',
+)
+@click.option(
+    '--keep', is_flag=True, help='Leave the original files in the upload folder.'
+)
+def rehome(workers, batch_size, keep):
+    """
+    Move uploads from the flat upload folder into content-addressed storage.
+    Safe to interrupt and re-run: it carries on with the receipts not moved yet.
+    """
+    report = storage.rehome(workers, batch_size, remove=not keep)
+    click.echo(
+        f'Moved {report.files} files ({report.bytes} bytes) '
+        f'for {report.receipts} receipts, '
+        f'{len(report.missing)} missing'
+    )
+    for filename in report.missing:
+        click.echo(f'missing: {filename}', err=True)
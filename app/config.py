@@ -1,10 +1,66 @@
 import os
+import tempfile
+
 
 class BaseConfig:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'change-me')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    # Where uploads are kept, by content hash: 'local' (STORAGE_ROOT, default
+    # UPLOAD_FOLDER), 'memory', or 'package.module:Class' for another backend
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    STORAGE_ROOT = os.environ.get('STORAGE_ROOT')
+    # Async uploads: /upload returns 202 and OCR runs on background workers
+    ASYNC_UPLOADS = os.environ.get('ASYNC_UPLOADS', '0') == '1'
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+    # A job still processing after JOB_LEASE_SECONDS is taken to have lost
+    # its worker and is queued again; workers look for such jobs (and
+    # queued ones from a restart) every JOB_RECOVER_INTERVAL seconds
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 900))
+    JOB_RECOVER_INTERVAL = float(os.environ.get('JOB_RECOVER_INTERVAL', 60))
+    # Batch uploads: OCR processes per batch (0 = CPU count) and files per request
+    BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 0))
+    MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 200))
+    # OCR/parse results cached by file hash (0 disables); duplicate upload policy
+    OCR_CACHE_SIZE = int(os.environ.get('OCR_CACHE_SIZE', 1024))
+    DEDUPE_POLICY = os.environ.get('DEDUPE_POLICY', 'allow')  # reject | link | allow
+    # Group commit: receipt writes from concurrent uploads and workers share
+    # a transaction, committed every GROUP_COMMIT_ROWS writes or
+    # GROUP_COMMIT_MS after the oldest pending one
+    GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '0') == '1'
+    GROUP_COMMIT_ROWS = int(os.environ.get('GROUP_COMMIT_ROWS', 100))
+    GROUP_COMMIT_MS = float(os.environ.get('GROUP_COMMIT_MS', 2))
+    # Read-through cache of serialized receipts and listing pages, off by
+    # default: 'memory' (per process, so only for single-process servers;
+    # other workers would serve stale copies for up to the TTL) or 'file'
+    # (READ_CACHE_DIR, shared by a host's workers)
+    READ_CACHE_BACKEND = os.environ.get('READ_CACHE_BACKEND', 'memory')
+    READ_CACHE_BYTES = int(os.environ.get('READ_CACHE_BYTES', 0))  # 0 disables
+    READ_CACHE_TTL = float(os.environ.get('READ_CACHE_TTL', 60))
+    READ_CACHE_DIR = os.environ.get(
+        'READ_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'receipts-read-cache')
+    )
+    # Connection pool per engine (primary and each replica); file-backed
+    # SQLite and server databases only. Statement timeout is Postgres only.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    DB_STATEMENT_TIMEOUT_MS = int(
+        os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    )  # 0 = none
+    # Read replicas (comma-separated URLs) serve GET and HEAD requests. A
+    # client that wrote reads from the primary for REPLICA_MAX_LAG seconds,
+    # how far the replicas may trail it.
+    DATABASE_REPLICA_URLS = [
+        url.strip()
+        for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if url.strip()
+    ]
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+
 
 class DevConfig(BaseConfig):
     """
@@ -34,6 +90,10 @@ class TestConfig(BaseConfig):
     TESTING = True
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # Jobs are drained explicitly with JobQueue.run_pending()
+    UPLOAD_WORKERS = 0
+    # Run batch OCR inline so monkeypatched OCR stubs apply
+    BATCH_WORKERS = 1
 
 class ProdConfig(BaseConfig):
     """
@@ -42,3 +102,9 @@ class ProdConfig(BaseConfig):
     """
     DEBUG = False
     TESTING = False
+    # Fail fast when the pool is exhausted rather than queue requests for 30s
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 300))
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30_000))
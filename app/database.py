@@ -0,0 +1,237 @@
+import collections
+import itertools
+import threading
+import time
+import sqlalchemy as sa
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+# Requests that only read, and may be served from a replica
+READ_METHODS = ('GET', 'HEAD')
+# Holds the time (epoch seconds) until which a client that wrote reads
+# from the primary
+STICKY_COOKIE = 'db_primary_until'
+
+
+class TimedQueuePool(sa.pool.QueuePool):
+    """
+    A QueuePool that records how long each checkout waited for a
+    connection, opening one included.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._recent = collections.deque(maxlen=1024)
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa.exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+                self._recent.append(waited)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            recent = sorted(self._recent)
+            checkouts, total, longest, timeouts = (
+                self.checkouts,
+                self.wait_total,
+                self.wait_max,
+                self.timeouts,
+            )
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'checkouts': checkouts,
+            'timeouts': timeouts,
+            'wait_ms_mean': total / checkouts * 1000 if checkouts else 0.0,
+            'wait_ms_p99': recent[int(len(recent) * 0.99)] * 1000 if recent else 0.0,
+            'wait_ms_max': longest * 1000,
+        }
+
+
+def engine_options(config, url) -> dict:
+    """
+    Engine options for ``url`` from the config's DB_POOL_* settings.
+    In-memory SQLite gets none: Flask-SQLAlchemy gives it one shared
+    connection. DB_STATEMENT_TIMEOUT_MS only applies to Postgres.
+    """
+    url = sa.engine.make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    timeout = config.get('DB_STATEMENT_TIMEOUT_MS')
+    if timeout and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={int(timeout)}'}
+    return options
+
+
+def configure_engines(config) -> None:
+    """
+    Fill in SQLALCHEMY_ENGINE_OPTIONS for the primary before
+    Flask-SQLAlchemy creates its engine. Options already in the config win.
+    """
+    url = config.get('SQLALCHEMY_DATABASE_URI')
+    if url:
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            **engine_options(config, url),
+            **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+        }
+
+
+def reading_replica(session) -> bool:
+    return session.info.get('replica') is not None
+
+
+class RoutingSession(Session):
+    """
+    Sends a request's reads to the replica engine picked for it
+    (``info['replica']``, set by ReplicaRouter). Flushes and
+    INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def flush(self, objects=None):
+        # Autoflush and commit flush through here too
+        self.info['flushing'] = self.info.get('flushing', 0) + 1
+        try:
+            super().flush(objects)
+        finally:
+            self.info['flushing'] -= 1
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if (
+            replica is not None
+            and bind is None
+            and not self.info.get('flushing')
+            and not getattr(clause, 'is_dml', False)
+        ):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def note_write() -> None:
+    """
+    Record that the current request wrote, so its client reads from the
+    primary for the next REPLICA_MAX_LAG seconds. Commits on the primary
+    engine in the request's thread do this themselves; writers that commit
+    elsewhere on the request's behalf call it.
+    """
+    if has_request_context():
+        g.db_wrote = True
+
+
+class ReplicaRouter:
+    """
+    Routes GET and HEAD requests to the DATABASE_REPLICA_URLS replicas,
+    round robin, and everything else to the primary.
+
+    Read-your-writes: a response to a request that committed on the primary
+    sets a cookie that keeps the client's reads on the primary for
+    REPLICA_MAX_LAG seconds, by which time the replicas have its write.
+
+    The replica engines are the router's, not Flask-SQLAlchemy binds: the
+    models belong to the primary, and db.create_all() must not touch them.
+    """
+
+    def __init__(self, app=None, db=None):
+        self.engines = {}
+        self.max_lag = 0.0
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.sticky_reads = 0
+        self._next = None
+        self._db = db
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self._db = db
+        urls = app.config.get('DATABASE_REPLICA_URLS') or ()
+        self.engines = {
+            f'replica-{i}': sa.create_engine(url, **engine_options(app.config, url))
+            for i, url in enumerate(urls)
+        }
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 5.0)
+        self._next = itertools.cycle(self.engines.values())
+        app.extensions['replica_router'] = self
+        with app.app_context():
+            sa.event.listen(db.engines[None], 'commit', lambda conn: note_write())
+        app.before_request(self._route)
+        app.after_request(self._stick)
+        app.teardown_request(self._unroute)
+
+    def _route(self):
+        if request.method not in READ_METHODS:
+            return
+        if not self.engines:
+            self.primary_reads += 1
+            return
+        try:
+            until = float(request.cookies.get(STICKY_COOKIE, 0))
+        except ValueError:
+            until = 0
+        now = time.time()
+        # Ignore stamps further out than a write could have set
+        if now < until <= now + self.max_lag:
+            self.sticky_reads += 1
+            return
+        self.replica_reads += 1
+        self._db.session.info['replica'] = next(self._next)
+
+    def _stick(self, response):
+        if g.get('db_wrote') and self.engines:
+            response.set_cookie(
+                STICKY_COOKIE,
+                f'{time.time() + self.max_lag:.3f}',
+                max_age=int(self.max_lag) + 1,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def _unroute(self, exc):
+        # The session outlives the request when a test holds an app context
+        self._db.session.info.pop('replica', None)
+
+    def stats(self) -> dict:
+        return {
+            'replicas': len(self.engines),
+            'replica_reads': self.replica_reads,
+            'primary_reads': self.primary_reads,
+            'sticky_reads': self.sticky_reads,
+        }
+
+
+def pool_stats(engines) -> dict:
+    """
+    Pool sizes and checkout waits per named engine, for engines with a
+    TimedQueuePool.
+    """
+    return {
+        name: engine.pool.stats()
+        for name, engine in engines.items()
+        if isinstance(engine.pool, TimedQueuePool)
+    }
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import os
+import zlib
+from app.models import Receipt, split_tags
+
+# Rows fetched per round trip, and per chunk written to the client
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', 2000))
+EXPORT_GZIP_LEVEL = int(os.getenv('EXPORT_GZIP_LEVEL', 6))
+
+# The fields of Receipt.to_dict(), in order
+COLUMNS = (
+    'id',
+    'filename',
+    'merchant',
+    'date',
+    'total',
+    'notes',
+    'tags',
+    'status',
+    'created_at',
+)
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def export_statement(query, column, descending):
+    """
+    SELECT of the exported columns for a filtered Receipt query, in listing
+    order. Tags come from the comma-separated copy on receipts, so each row
+    is a single plain tuple and no per-row join or ORM object is needed.
+    """
+    columns = [getattr(Receipt, name) for name in COLUMNS]
+    order = (
+        (column.desc(), Receipt.id.desc())
+        if descending
+        else (column.asc(), Receipt.id.asc())
+    )
+    return query.with_entities(*columns).order_by(*order).statement
+
+
+def _csv_chunks(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for rows in partitions:
+        # date, float and None already render as to_dict() would
+        writer.writerows(
+            (*row, created.isoformat() if created else None) for *row, created in rows
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(partitions):
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for rows in partitions:
+        yield ''.join(
+            dumps(
+                {
+                    'id': rid,
+                    'filename': filename,
+                    'merchant': merchant,
+                    'date': day.isoformat() if day else None,
+                    'total': total,
+                    'notes': notes,
+                    'tags': split_tags(tags),
+                    'status': status,
+                    'created_at': created.isoformat() if created else None,
+                }
+            )
+            + '\n'
+            for (
+                rid,
+                filename,
+                merchant,
+                day,
+                total,
+                notes,
+                tags,
+                status,
+                created,
+            ) in rows
+        )
+
+
+ENCODERS = {'csv': _csv_chunks, 'ndjson': _ndjson_chunks}
+
+
+def stream(engine, statement, fmt: str, compress: bool = False, batch_size: int = None):
+    """
+    Encoded chunks of an export, one per batch of rows. The rows come from a
+    single statement on a connection of its own (a server-side cursor where
+    the driver has one), so memory stays flat whatever the row count and the
+    export reflects one snapshot of the database even while writes go on.
+    The connection is released when the generator finishes or is closed.
+    ``compress`` gzips the output as it goes.
+    """
+    encode = ENCODERS[fmt]
+    gzip = (
+        zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        if compress
+        else None
+    )
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, yield_per=batch_size or EXPORT_BATCH_ROWS
+        ).execute(statement)
+        for chunk in encode(result.partitions()):
+            data = chunk.encode()
+            if gzip is not None:
+                data = gzip.compress(data)
+            if data:
+                yield data
+    if gzip is not None:
+        yield gzip.flush()
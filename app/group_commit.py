@@ -0,0 +1,198 @@
+import threading
+import time
+from app import db
+from app.database import note_write
+from app.models import Receipt
+
+
+class _Write:
+    """
+    One caller's pending insert (``receipt_id`` None) or field update,
+    and its outcome once the group it went out in has committed.
+    """
+
+    __slots__ = ('receipt_id', 'values', 'done', 'result', 'error')
+
+    def __init__(self, receipt_id, values):
+        self.receipt_id = receipt_id
+        self.values = values
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitWriter:
+    """
+    Coalesces receipt inserts and field updates from concurrent requests
+    and workers into shared transactions.
+
+    Callers hand over column values and block. A flusher thread applies
+    everything pending through one ORM session, so the flush hooks (tags,
+    rollups, search index, caches) run as for any other write. It commits
+    once GROUP_COMMIT_ROWS writes are pending or GROUP_COMMIT_MS after the
+    oldest one arrived, then wakes the callers. A caller therefore returns
+    only when its write is durable, and a group of N writes costs one
+    commit (one fsync, one round trip) instead of N. If a group fails, its
+    writes are retried one transaction each, so a bad write fails only its
+    own caller.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.max_rows = 1
+        self.max_wait = 0.0
+        self.commits = 0
+        self.writes = 0
+        self.retries = 0
+        self._pending = []
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('GROUP_COMMIT', False)
+        self.max_rows = max(1, app.config.get('GROUP_COMMIT_ROWS', 100))
+        self.max_wait = app.config.get('GROUP_COMMIT_MS', 2) / 1000
+        app.extensions['group_commit'] = self
+
+    def insert(self, **values) -> int:
+        """
+        Insert a receipt with the given column values; returns its id once
+        committed.
+        """
+        return self._submit(_Write(None, values))
+
+    def update(self, receipt_id: int, **values) -> None:
+        """
+        Set columns (or other Receipt attributes, e.g. ``ocr_text``) on a
+        receipt; returns once committed. Raises LookupError if the receipt
+        does not exist.
+        """
+        self._submit(_Write(receipt_id, values))
+
+    def shutdown(self) -> None:
+        """
+        Stop the flusher thread after it commits what is pending.
+        """
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join()
+        self._stopping = False
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'commits': self.commits,
+            'writes': self.writes,
+            'writes_per_commit': self.writes / self.commits if self.commits else 0.0,
+            'retries': self.retries,
+        }
+
+    def _submit(self, write):
+        with self._cond:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(write)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='group-commit', daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        # The commit ran on the flusher thread, outside the request
+        note_write()
+        return write.result
+
+    def _next_group(self):
+        """
+        Wait until a group is due and take it; None when shutting down with
+        nothing pending.
+        """
+        with self._cond:
+            while True:
+                if self._pending:
+                    wait = self._oldest + self.max_wait - time.monotonic()
+                    if (
+                        len(self._pending) >= self.max_rows
+                        or wait <= 0
+                        or self._stopping
+                    ):
+                        break
+                    self._cond.wait(wait)
+                elif self._stopping:
+                    return None
+                else:
+                    self._cond.wait()
+            group, self._pending = (
+                self._pending[: self.max_rows],
+                self._pending[self.max_rows :],
+            )
+            # What is left over was due already; flush it straight after
+            self._oldest = self._oldest if self._pending else None
+            return group
+
+    def _run(self):
+        while True:
+            group = self._next_group()
+            if group is None:
+                return
+            with self.app.app_context():
+                self._flush(group)
+
+    def _flush(self, group):
+        try:
+            self._apply(group)
+            db.session.commit()
+            self.commits += 1
+        except Exception:
+            db.session.rollback()
+            self.retries += 1
+            for write in group:
+                write.result = write.error = None
+                try:
+                    self._apply([write])
+                    db.session.commit()
+                    self.commits += 1
+                except Exception as e:
+                    db.session.rollback()
+                    write.error = e
+        self.writes += len(group)
+        for write in group:
+            write.done.set()
+
+    def _apply(self, group):
+        """
+        Stage a group's writes in the session and flush them, filling in the
+        ids of new receipts. The flush batches the inserts, and updates of
+        the same columns, into one statement each.
+        """
+        inserts = [
+            (write, Receipt(**write.values))
+            for write in group
+            if write.receipt_id is None
+        ]
+        db.session.add_all(receipt for _, receipt in inserts)
+        updates = [write for write in group if write.receipt_id is not None]
+        if updates:
+            ids = {write.receipt_id for write in updates}
+            found = {r.id: r for r in Receipt.query.filter(Receipt.id.in_(ids))}
+            missing = ids - found.keys()
+            if missing:
+                raise LookupError(f'No receipts with ids {sorted(missing)}')
+            for write in updates:
+                for name, value in write.values.items():
+                    setattr(found[write.receipt_id], name, value)
+        db.session.flush()
+        for write, receipt in inserts:
+            write.result = receipt.id
@@ -0,0 +1,289 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import cv2
+import numpy as np
+import sqlalchemy as sa
+from PIL import Image
+from app import db, ocr
+from app.models import Receipt, STATUS_DONE
+from app.storage import get_storage
+
+# Compact copies of uploads, for viewing: grayscale, 'webp' or 'jpeg'.
+# 'full' is scaled to IMAGE_FULL_SIDE on its long side, 'thumb' to
+# IMAGE_THUMB_SIDE; neither is ever scaled up.
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'webp')
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 75))
+IMAGE_FULL_SIDE = int(os.getenv('IMAGE_FULL_SIDE', 1600))
+IMAGE_THUMB_SIDE = int(os.getenv('IMAGE_THUMB_SIDE', 256))
+# Copies are named by the upload's hash and never change, so clients may
+# keep them this long (seconds)
+IMAGE_MAX_AGE = int(os.getenv('IMAGE_MAX_AGE', 365 * 24 * 3600))
+# Uploads compacted per batch: encoded in parallel, then one commit
+IMAGE_COMPACT_BATCH = int(os.getenv('IMAGE_COMPACT_BATCH', 200))
+
+SIZES = ('thumb', 'full')
+EXTENSIONS = {'webp': '.webp', 'jpeg': '.jpg'}
+MIMETYPES = {
+    '.webp': 'image/webp',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.pdf': 'application/pdf',
+}
+
+
+def mimetype_for(key: str) -> str:
+    return MIMETYPES.get(os.path.splitext(key)[1].lower(), 'application/octet-stream')
+
+
+def compact_mimetype() -> str:
+    return MIMETYPES[EXTENSIONS[IMAGE_FORMAT]]
+
+
+def derived_key(digest: str, size: str, fmt: str = None) -> str:
+    # Next to the upload's own key: ab/cd/<hash>.<size>.<ext>
+    return (
+        f'{digest[:2]}/{digest[2:4]}/{digest}.{size}{EXTENSIONS[fmt or IMAGE_FORMAT]}'
+    )
+
+
+def load(file_path: str, max_side: int) -> np.ndarray:
+    """
+    An upload as a grayscale array, decoded at reduced size where the
+    format allows. A PDF gives its first page.
+    """
+    if ocr.is_pdf(file_path):
+        with closing(ocr.iter_pdf_pages(file_path, text_layer=False)) as pages:
+            return next(pages)[1]
+    try:
+        return ocr.load_grayscale(file_path, max_side)
+    except ValueError:
+        # OpenCV cannot read GIFs
+        with Image.open(file_path) as im:
+            return np.asarray(im.convert('L'))
+
+
+def scale_to(img: np.ndarray, max_side: int) -> np.ndarray:
+    f = max_side / max(img.shape[:2])
+    return (
+        cv2.resize(img, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+        if f < 1
+        else img
+    )
+
+
+def encode(img: np.ndarray, fmt: str = None) -> bytes:
+    fmt = fmt or IMAGE_FORMAT
+    if fmt == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, IMAGE_QUALITY]
+    else:
+        params = [
+            cv2.IMWRITE_JPEG_QUALITY,
+            IMAGE_QUALITY,
+            cv2.IMWRITE_JPEG_OPTIMIZE,
+            1,
+            cv2.IMWRITE_JPEG_PROGRESSIVE,
+            1,
+        ]
+    ok, data = cv2.imencode(EXTENSIONS[fmt], img, params)
+    if not ok:
+        raise ValueError(f'Cannot encode {fmt}')
+    return data.tobytes()
+
+
+def derive(file_path: str, sizes=SIZES) -> dict:
+    """
+    Encoded compact copies of an upload, by size. The upload is decoded
+    once; the thumbnail is scaled from the full image.
+    """
+    full = scale_to(load(file_path, IMAGE_FULL_SIDE), IMAGE_FULL_SIDE)
+    images = {'full': full, 'thumb': scale_to(full, IMAGE_THUMB_SIDE)}
+    return {size: encode(images[size]) for size in sizes}
+
+
+class CompactReport:
+    def __init__(self):
+        self.files = 0
+        self.receipts = 0
+        self.original_bytes = 0
+        self.compact_bytes = 0
+        self.replaced = 0
+        self.freed_bytes = 0
+        self.errors = []
+
+    def to_dict(self) -> dict:
+        return {
+            'files': self.files,
+            'receipts': self.receipts,
+            'original_bytes': self.original_bytes,
+            'compact_bytes': self.compact_bytes,
+            'replaced': self.replaced,
+            'bytes_saved': self.freed_bytes - self.compact_bytes,
+            'failed': len(self.errors),
+            'errors': self.errors,
+        }
+
+
+def _put_bytes(storage, key, data):
+    fd, path = tempfile.mkstemp(prefix='.image-')
+    with os.fdopen(fd, 'wb') as out:
+        out.write(data)
+    try:
+        storage.put(key, path)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class _Compacted:
+    """
+    The outcome of compacting one upload: the keys of its copies by size
+    and the bytes before and after, or the error that stopped it.
+    """
+
+    __slots__ = ('key', 'keys', 'original_bytes', 'compact_bytes', 'is_pdf', 'error')
+
+    def __init__(
+        self,
+        key,
+        keys=None,
+        original_bytes=0,
+        compact_bytes=0,
+        is_pdf=False,
+        error=None,
+    ):
+        self.key = key
+        self.keys = keys
+        self.original_bytes = original_bytes
+        self.compact_bytes = compact_bytes
+        self.is_pdf = is_pdf
+        self.error = error
+
+
+def _compact_file(storage, key, digest) -> _Compacted:
+    try:
+        with storage.local_path(key) as path:
+            is_pdf = ocr.is_pdf(path)
+            images = derive(path)
+        keys = {size: derived_key(digest, size) for size in images}
+        for size, data in images.items():
+            _put_bytes(storage, keys[size], data)
+        return _Compacted(
+            key, keys, storage.size(key), sum(map(len, images.values())), is_pdf
+        )
+    except Exception as e:
+        return _Compacted(key, error=f'{type(e).__name__}: {e}')
+
+
+def compact_all(
+    workers: int = 4, batch_size: int = None, replace_originals: bool = False
+) -> CompactReport:
+    """
+    Give every stored upload that has none yet its compact copies,
+    ``workers`` uploads at a time (OpenCV releases the GIL while it decodes
+    and encodes).
+
+    Uploads are taken in storage-key order, ``batch_size`` at a time; a
+    batch's receipts are updated in one transaction. Receipts sharing an
+    upload share its copies. With ``replace_originals``, an upload whose
+    receipts have all been OCR'd successfully is replaced by its full-size
+    copy: the receipts point at the copy, and the original is deleted once
+    that is committed. PDFs get copies of their first page but are never
+    replaced. An interrupted run leaves every receipt readable; running it
+    again carries on with the uploads that have no copies yet.
+    """
+    storage = get_storage()
+    batch_size = batch_size or IMAGE_COMPACT_BATCH
+    report = CompactReport()
+    receipts = Receipt.__table__
+    # Core statements: the receipts' responses and validators do not change
+    set_images = (
+        receipts.update()
+        .where(receipts.c.storage_key == sa.bindparam('key'))
+        .values(
+            image_key=sa.bindparam('full'),
+            thumb_key=sa.bindparam('thumb'),
+            updated_at=receipts.c.updated_at,
+        )
+    )
+    replace = (
+        receipts.update()
+        .where(receipts.c.storage_key == sa.bindparam('key'))
+        .values(storage_key=sa.bindparam('full'), updated_at=receipts.c.updated_at)
+    )
+    after = None
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        while True:
+            q = db.session.query(
+                Receipt.storage_key, sa.func.min(Receipt.sha256)
+            ).filter(
+                Receipt.storage_key.isnot(None),
+                Receipt.sha256.isnot(None),
+                Receipt.image_key.is_(None),
+            )
+            if after is not None:
+                q = q.filter(Receipt.storage_key > after)
+            batch = (
+                q.group_by(Receipt.storage_key)
+                .order_by(Receipt.storage_key)
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                return report
+            after = batch[-1][0]
+            pending = set()
+            if replace_originals:
+                # Uploads that some receipt still has to be OCR'd from
+                pending = {
+                    key
+                    for (key,) in db.session.query(Receipt.storage_key)
+                    .filter(
+                        Receipt.storage_key.in_([key for key, _ in batch]),
+                        Receipt.status != STATUS_DONE,
+                    )
+                    .distinct()
+                }
+            connection = db.session.connection()
+            removed = []
+            for result in pool.map(lambda row: _compact_file(storage, *row), batch):
+                if result.error is not None:
+                    report.errors.append({'key': result.key, 'error': result.error})
+                    continue
+                report.files += 1
+                report.original_bytes += result.original_bytes
+                report.compact_bytes += result.compact_bytes
+                params = {
+                    'key': result.key,
+                    'full': result.keys['full'],
+                    'thumb': result.keys['thumb'],
+                }
+                report.receipts += connection.execute(set_images, params).rowcount
+                if (
+                    replace_originals
+                    and result.key not in pending
+                    and not result.is_pdf
+                ):
+                    connection.execute(replace, params)
+                    removed.append(result)
+            db.session.commit()
+            # An upload of the same bytes since may have brought a key back
+            reused = (
+                {
+                    key
+                    for (key,) in db.session.query(Receipt.storage_key)
+                    .filter(Receipt.storage_key.in_([result.key for result in removed]))
+                    .distinct()
+                }
+                if removed
+                else set()
+            )
+            for result in removed:
+                if result.key in reused:
+                    continue
+                storage.delete(result.key)
+                report.replaced += 1
+                report.freed_bytes += result.original_bytes
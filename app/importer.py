@@ -0,0 +1,323 @@
+import csv
+import datetime
+import io
+import json
+import math
+import os
+import sqlalchemy as sa
+from werkzeug.utils import secure_filename
+from app import analytics, db
+from app.models import (
+    STATUS_DONE,
+    Receipt,
+    ReceiptTag,
+    split_tags,
+    tag_ids,
+    upsert_insert,
+)
+from app.read_cache import invalidate_receipts
+
+# Rows validated and written per transaction, and row errors kept in a report
+IMPORT_CHUNK_ROWS = int(os.getenv('IMPORT_CHUNK_ROWS', 10_000))
+IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', 1000))
+
+# Fields read from each input row, in the order they are written; anything
+# else (an export's id, status or created_at) is ignored
+FIELDS = ('import_key', 'filename', 'merchant', 'date', 'total', 'notes', 'tags')
+FORMATS = ('csv', 'ndjson')
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+# What the insert hands back: enough to link tags and update the rollups
+RETURNED = ('id', 'import_key', 'merchant', 'date', 'total', 'tags')
+
+
+def format_for(filename: str):
+    """
+    The input format a file name's extension implies, or None.
+    """
+    return EXTENSIONS.get(os.path.splitext(filename or '')[1].lower())
+
+
+class ImportReport:
+    """
+    Counts of an import's outcome and the first ``max_errors`` row errors,
+    each with the line it was read from.
+    """
+
+    def __init__(self, max_errors: int = None):
+        self.max_errors = IMPORT_MAX_ERRORS if max_errors is None else max_errors
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, line: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self) -> dict:
+        return {
+            'imported': self.imported,
+            'duplicates': self.duplicates,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def _ndjson_records(stream):
+    for line, raw in enumerate(stream, 1):
+        if raw.strip():
+            yield line, raw
+
+
+def _csv_records(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    if reader.fieldnames is None:
+        return
+    if not set(reader.fieldnames) & set(FIELDS):
+        raise ValueError(f"CSV header has none of the columns {', '.join(FIELDS)}")
+    for record in reader:
+        # CSV cannot tell an empty value from a missing one
+        yield reader.line_num, {k: v for k, v in record.items() if v != ''}
+
+
+def _text(record, name, limit=None):
+    value = record.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f'{name} must be a string')
+    if limit is not None and len(value) > limit:
+        raise ValueError(f'{name} is longer than {limit} characters')
+    return value
+
+
+def _date(value):
+    if value is None:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError('date must be YYYY-MM-DD') from None
+
+
+def _total(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError('total must be a number')
+    try:
+        total = float(value)
+    except ValueError:
+        raise ValueError('total must be a number') from None
+    if not math.isfinite(total):
+        raise ValueError('total must be a number')
+    return total
+
+
+def _tags(value):
+    if value is None:
+        return None
+    if (
+        isinstance(value, list)
+        and all(isinstance(t, str) for t in value)
+        or isinstance(value, str)
+    ):
+        tags = ','.join(split_tags(value))
+        if len(tags) > 256:
+            raise ValueError('tags are longer than 256 characters')
+        return tags or None
+    raise ValueError('tags must be a list of strings or a comma-separated string')
+
+
+def _filename(value):
+    # Metadata only, like an upload's: a bare name, never a path
+    return secure_filename((value or '').replace('\\', '/').rsplit('/', 1)[-1])
+
+
+def validate(record) -> dict:
+    """
+    The receipt columns for one input row, or ValueError saying what is
+    wrong with it.
+    """
+    if isinstance(record, (str, bytes)):
+        try:
+            record = json.loads(record)
+        except ValueError:
+            raise ValueError('invalid JSON') from None
+    if not isinstance(record, dict):
+        raise ValueError('row must be an object')
+    return {
+        'import_key': _text(record, 'import_key', 64),
+        'filename': _filename(_text(record, 'filename', 256)),
+        'merchant': _text(record, 'merchant', 128),
+        'date': _date(record.get('date')),
+        'total': _total(record.get('total')),
+        'notes': _text(record, 'notes'),
+        'tags': _tags(record.get('tags')),
+    }
+
+
+def _insert_rows(connection, rows):
+    """
+    One executemany of the chunk, which SQLAlchemy batches into multi-row
+    INSERTs; receipts whose key is already stored are skipped.
+    """
+    table = Receipt.__table__
+    insert = upsert_insert(connection.dialect.name, table)
+    if insert is not None:
+        insert = insert.on_conflict_do_nothing(index_elements=[table.c.import_key])
+    else:
+        keys = [row['import_key'] for row in rows if row['import_key'] is not None]
+        stored = (
+            {
+                key
+                for (key,) in connection.execute(
+                    sa.select(table.c.import_key).where(table.c.import_key.in_(keys))
+                )
+            }
+            if keys
+            else set()
+        )
+        rows = [row for row in rows if row['import_key'] not in stored]
+        insert = sa.insert(table)
+    if not rows:
+        return []
+    return connection.execute(
+        insert.returning(*(table.c[name] for name in RETURNED)), rows
+    ).all()
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def _copy_rows(connection, rows):
+    """
+    COPY the chunk into a temporary table, then move it into receipts with
+    one INSERT ... SELECT that skips keys already stored.
+    """
+    columns = ', '.join(FIELDS)
+    connection.execute(
+        sa.text(
+            'CREATE TEMPORARY TABLE receipt_import (import_key varchar(64), '
+            'filename varchar(256), merchant varchar(128), date date, '
+            'total double precision, notes text, tags varchar(256)) '
+            'ON COMMIT DROP'
+        )
+    )
+    data = io.StringIO()
+    for row in rows:
+        data.write('\t'.join(_copy_value(row[name]) for name in FIELDS))
+        data.write('\n')
+    data.seek(0)
+    with connection.connection.dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY receipt_import ({columns}) FROM STDIN', data)
+    now = datetime.datetime.utcnow()
+    return connection.execute(
+        sa.text(
+            f'INSERT INTO receipts ({columns}, status, created_at, updated_at) '
+            f'SELECT {columns}, :status, :now, :now FROM receipt_import '
+            f"ON CONFLICT (import_key) DO NOTHING RETURNING {', '.join(RETURNED)}"
+        ),
+        {'status': STATUS_DONE, 'now': now},
+    ).all()
+
+
+def _link_tags(session, receipts) -> None:
+    names = {
+        receipt.id: split_tags(receipt.tags) for receipt in receipts if receipt.tags
+    }
+    if not names:
+        return
+    ids = tag_ids(session, dict.fromkeys(n for tags in names.values() for n in tags))
+    session.execute(
+        sa.insert(ReceiptTag.__table__),
+        [
+            {'receipt_id': receipt_id, 'tag_id': ids[name], 'position': position}
+            for receipt_id, tags in names.items()
+            for position, name in enumerate(tags)
+        ],
+    )
+
+
+def _write_chunk(rows, report) -> None:
+    """
+    Insert one chunk of valid rows in its own transaction, with the tag
+    links and rollup deltas that the ORM flush hooks write for other
+    receipts.
+    """
+    keys = set()
+    fresh = []
+    for row in rows:
+        key = row['import_key']
+        if key is not None:
+            if key in keys:
+                report.duplicates += 1
+                continue
+            keys.add(key)
+        fresh.append(row)
+    session = db.session
+    connection = session.connection()
+    insert = _copy_rows if connection.dialect.name == 'postgresql' else _insert_rows
+    written = insert(connection, fresh)
+    report.imported += len(written)
+    report.duplicates += len(fresh) - len(written)
+    _link_tags(session, written)
+    analytics.add_to_rollups(
+        connection, [(r.merchant, r.date, r.total, r.tags) for r in written]
+    )
+    session.commit()
+    if written:
+        # Statements on the session's connection go around its commit hooks
+        invalidate_receipts()
+        analytics.invalidate_snapshot()
+
+
+def import_receipts(
+    stream, fmt: str, chunk_size: int = None, max_errors: int = None
+) -> ImportReport:
+    """
+    Import receipts from a binary stream of NDJSON objects or CSV rows (with
+    a header) having the fields import_key, filename, merchant, date, total,
+    notes and tags, all optional. Rows are validated and written a chunk at
+    a time, each chunk in its own transaction, so memory stays flat however
+    long the stream is. Invalid rows are reported and skipped. A row whose
+    import_key is already stored is counted as a duplicate and left alone,
+    which makes re-running an interrupted import safe.
+
+    Raises ValueError for an unknown format or a CSV header without any of
+    the fields, before anything is written.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    chunk_size = chunk_size or IMPORT_CHUNK_ROWS
+    report = ImportReport(max_errors)
+    records = _csv_records(stream) if fmt == 'csv' else _ndjson_records(stream)
+    chunk = []
+    line = 0
+    try:
+        for line, record in records:
+            try:
+                chunk.append(validate(record))
+            except ValueError as e:
+                report.fail(line, str(e))
+            if len(chunk) >= chunk_size:
+                _write_chunk(chunk, report)
+                chunk = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        # CSV that is not UTF-8 or is malformed stops the import; the rows
+        # before it still count
+        report.fail(line + 1, f'unreadable input: {e}')
+    if chunk:
+        _write_chunk(chunk, report)
+    return report
@@ -0,0 +1,234 @@
+import datetime
+import queue
+import threading
+from app import db
+from app.models import Receipt, STATUS_FAILED, STATUS_QUEUED, STATUS_PROCESSING
+from app.pipeline import apply_result, process_receipt, result_values
+from app.storage import receipt_file
+
+
+class JobQueue:
+    """
+    Background OCR worker pool for asynchronous uploads.
+
+    The receipts table is the durable queue: a job is a receipt row in
+    ``queued`` status, and workers claim it with a conditional UPDATE so
+    several processes can share the table without double-processing.
+    The in-process queue only wakes idle workers. With ASYNC_UPLOADS on,
+    the workers start with the app's first request; otherwise with the
+    first job submitted. A single recovery thread starts alongside them
+    and calls ``recover()`` then and every JOB_RECOVER_INTERVAL seconds, so
+    rows left queued by a restart, or claimed by a worker that died, are
+    picked up again.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = queue.Queue()
+        self._threads = []
+        self._recovery = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # Ids put on the in-process queue and not taken off it yet
+        self._enqueued = set()
+        self._started = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['job_queue'] = self
+        app.before_request(self._start_once)
+
+    def _start_once(self):
+        if not self._started and self.app.config.get('ASYNC_UPLOADS', False):
+            self.start()
+
+    def start(self) -> None:
+        """
+        Start the UPLOAD_WORKERS worker threads and the recovery thread,
+        which first requeues jobs left over by earlier processes.
+        """
+        self._started = True
+        self._ensure_started()
+
+    def submit(self, receipt_id: int) -> None:
+        """
+        Schedule a queued receipt for processing.
+        """
+        self._put(receipt_id)
+        self._ensure_started()
+
+    def _put(self, receipt_id: int) -> None:
+        with self._lock:
+            self._enqueued.add(receipt_id)
+        self._queue.put(receipt_id)
+
+    def recover(self) -> int:
+        """
+        Re-enqueue receipts still in ``queued`` status, e.g. after a restart.
+        Receipts ``processing`` for longer than JOB_LEASE_SECONDS are taken
+        back first: the worker that claimed them died (a crash, an OOM kill,
+        a deploy) before finishing. Returns the number of jobs scheduled.
+        """
+        lease = datetime.timedelta(
+            seconds=self.app.config.get('JOB_LEASE_SECONDS', 900)
+        )
+        with self.app.app_context():
+            (
+                Receipt.query.filter(
+                    Receipt.status == STATUS_PROCESSING,
+                    Receipt.updated_at < datetime.datetime.utcnow() - lease,
+                ).update({'status': STATUS_QUEUED}, synchronize_session=False)
+            )
+            db.session.commit()
+            ids = [
+                rid
+                for (rid,) in db.session.query(Receipt.id).filter_by(
+                    status=STATUS_QUEUED
+                )
+            ]
+        with self._lock:
+            ids = [rid for rid in ids if rid not in self._enqueued]
+        for rid in ids:
+            self._put(rid)
+        return len(ids)
+
+    def run_pending(self) -> int:
+        """
+        Drain the queue in the calling thread. Used when no worker threads
+        are configured (UPLOAD_WORKERS=0), e.g. in tests and CLI scripts.
+        """
+        count = 0
+        while True:
+            try:
+                receipt_id = self._queue.get_nowait()
+            except queue.Empty:
+                return count
+            self._taken(receipt_id)
+            try:
+                with self.app.app_context():
+                    count += self.process(receipt_id)
+            finally:
+                self._queue.task_done()
+
+    def join(self) -> None:
+        """
+        Block until every submitted job has been processed.
+        """
+        self._queue.join()
+
+    def shutdown(self) -> None:
+        """
+        Stop worker threads after they finish the jobs already queued.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+            recovery, self._recovery = self._recovery, None
+            self._stop.set()
+        if recovery is not None:
+            recovery.join()
+        for _ in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join()
+
+    def process(self, receipt_id: int) -> bool:
+        """
+        Claim and process one receipt. Returns False if another worker
+        already claimed it. Claiming bumps updated_at, which starts the
+        receipt's lease (see recover()).
+        """
+        claimed = Receipt.query.filter_by(id=receipt_id, status=STATUS_QUEUED).update(
+            {'status': STATUS_PROCESSING, 'updated_at': datetime.datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if not claimed:
+            return False
+        receipt = db.session.get(Receipt, receipt_id)
+        try:
+            with receipt_file(receipt) as file_path:
+                process_receipt(
+                    receipt,
+                    file_path,
+                    logger=self.app.logger,
+                    cache=self.app.extensions.get('ocr_cache'),
+                )
+        except FileNotFoundError as e:
+            apply_result(receipt, None, f'File not found: {e}', logger=self.app.logger)
+        writer = self.app.extensions.get('group_commit')
+        if writer is not None and writer.enabled:
+            # Hand the result to the writer and drop it from this session
+            values = result_values(receipt)
+            db.session.rollback()
+            writer.update(receipt_id, **values)
+        else:
+            db.session.commit()
+        return True
+
+    def _ensure_started(self):
+        size = self.app.config.get('UPLOAD_WORKERS', 0)
+        with self._lock:
+            while len(self._threads) < size:
+                t = threading.Thread(
+                    target=self._worker,
+                    name=f'ocr-worker-{len(self._threads)}',
+                    daemon=True,
+                )
+                t.start()
+                self._threads.append(t)
+            if size and self._recovery is None:
+                self._stop = threading.Event()
+                self._recovery = threading.Thread(
+                    target=self._recover_loop,
+                    args=(self._stop,),
+                    name='ocr-recovery',
+                    daemon=True,
+                )
+                self._recovery.start()
+
+    def _taken(self, receipt_id):
+        with self._lock:
+            self._enqueued.discard(receipt_id)
+
+    def _recover_loop(self, stop):
+        # Sweeps for jobs other processes left, so the workers only wait
+        # on the queue
+        interval = self.app.config.get('JOB_RECOVER_INTERVAL', 60)
+        while True:
+            try:
+                self.recover()
+            except Exception as e:
+                self.app.logger.error(f"Job recovery failed: {e}")
+            if stop.wait(interval):
+                return
+
+    def _fail(self, receipt_id, error):
+        # A job that raised would otherwise stay claimed until its lease
+        # ran out, and then fail again
+        with self.app.app_context():
+            try:
+                Receipt.query.filter_by(id=receipt_id, status=STATUS_PROCESSING).update(
+                    {'status': STATUS_FAILED, 'error': error}, synchronize_session=False
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+    def _worker(self):
+        while True:
+            receipt_id = self._queue.get()
+            self._taken(receipt_id)
+            try:
+                if receipt_id is None:
+                    return
+                with self.app.app_context():
+                    try:
+                        self.process(receipt_id)
+                    except Exception as e:
+                        db.session.rollback()
+                        self.app.logger.error(f"Job {receipt_id} failed: {e}")
+                        self._fail(receipt_id, str(e) or type(e).__name__)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,280 @@
+import os
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+import openai
+from app.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('merchant', 'date', 'total')
+
+# Per-call deadline (seconds), including time spent waiting for a slot
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 20))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+LLM_RETRIES = int(os.getenv('LLM_RETRIES', 1))
+# First delay before a retry (seconds), doubled for each further one
+LLM_RETRY_BACKOFF = float(os.getenv('LLM_RETRY_BACKOFF', 0.5))
+# OpenAI-compatible endpoint (e.g. Gemini's); the client's default if unset
+LLM_BASE_URL = os.getenv('LLM_BASE_URL')
+LLM_API_KEY = os.getenv('GEMINI_API_KEY')
+# Receipts packed into one prompt, and how long single calls wait to be
+# coalesced with concurrent ones (0 sends each call immediately)
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', 8))
+LLM_BATCH_WINDOW_MS = float(os.getenv('LLM_BATCH_WINDOW_MS', 0))
+# Memo cache keyed by normalized OCR text (0 disables)
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', 0))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 3600))
+
+SYSTEM_PROMPT = "You are a receipt parsing assistant with high accuracy."
+
+
+class LLMTimeout(TimeoutError):
+    pass
+
+
+memo = LRUCache(LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+_limiter = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    The shared openai>=1.0 client, created on first use. Retries are left
+    to chat(), which keeps them within the call's deadline.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = openai.OpenAI(
+                api_key=LLM_API_KEY, base_url=LLM_BASE_URL, max_retries=0
+            )
+        return _client
+
+
+def _retryable(e: Exception) -> bool:
+    # Errors the API answered with are final, except rate limits and 5xx
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return not isinstance(e, openai.OpenAIError) or isinstance(
+        e, openai.APIConnectionError
+    )
+
+
+def empty_fields() -> dict:
+    return dict.fromkeys(FIELDS)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form of OCR text for memoization: OCR output for the same
+    receipt often differs only in whitespace.
+    """
+    return ' '.join(text.split())
+
+
+def chat(prompt: str, model: str, timeout: float = None) -> str:
+    """
+    Send one chat completion, bounded by the concurrency limiter and a
+    deadline. Raises LLMTimeout when the deadline passes, or the last error
+    once retries are used up.
+    """
+    deadline = time.monotonic() + (timeout or LLM_TIMEOUT)
+    if not _limiter.acquire(timeout=max(deadline - time.monotonic(), 0)):
+        raise LLMTimeout('Timed out waiting for an LLM slot')
+    try:
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeout('LLM deadline exceeded')
+            try:
+                response = get_client().chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=0.0,
+                    timeout=remaining,
+                )
+                return response.choices[0].message.content
+            except Exception as e:
+                attempt += 1
+                if attempt > LLM_RETRIES or not _retryable(e):
+                    raise
+                # Exponential backoff with jitter, so callers that failed
+                # together do not retry together
+                delay = (
+                    LLM_RETRY_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.0)
+                )
+                if time.monotonic() + delay >= deadline:
+                    raise
+                time.sleep(delay)
+    finally:
+        _limiter.release()
+
+
+def _loads(content: str):
+    content = content.strip()
+    # Models often wrap JSON in a ```json fence
+    if content.startswith('```'):
+        content = content.strip('`')
+        if content.startswith('json'):
+            content = content[4:]
+    return json.loads(content)
+
+
+def parse_one(ocr_text: str, model: str) -> dict:
+    prompt = (
+        "Extract merchant name, date (YYYY-MM-DD), and total amount as JSON "
+        "from the receipt text. "
+        f"Text:\n```{ocr_text}```"
+    )
+    try:
+        data = _loads(chat(prompt, model))
+    except json.JSONDecodeError:
+        return empty_fields()
+    except Exception as e:
+        # Timeouts, API, auth and network errors: the regex fields stand
+        logger.warning(f"LLM parse skipped: {type(e).__name__}: {e}")
+        return empty_fields()
+    return data if isinstance(data, dict) else empty_fields()
+
+
+def parse_batch(ocr_texts: list, model: str) -> list:
+    """
+    Parse several receipts with one prompt that asks for a JSON array.
+    Falls back to one call per receipt if the array does not line up.
+    """
+    if len(ocr_texts) == 1:
+        return [parse_one(ocr_texts[0], model)]
+    receipts = '\n'.join(
+        f"Receipt {i + 1}:\n```{text}```" for i, text in enumerate(ocr_texts)
+    )
+    prompt = (
+        "Extract merchant name, date (YYYY-MM-DD), and total amount from each of "
+        f"the {len(ocr_texts)} receipt texts below. Respond with a JSON array "
+        "containing one object per receipt, "
+        "in the same order, each with keys merchant, date, and total.\n" + receipts
+    )
+    try:
+        data = _loads(chat(prompt, model))
+    except json.JSONDecodeError:
+        data = None
+    except Exception as e:
+        logger.warning(f"LLM batch parse skipped: {type(e).__name__}: {e}")
+        return [empty_fields() for _ in ocr_texts]
+    if (
+        not isinstance(data, list)
+        or len(data) != len(ocr_texts)
+        or not all(isinstance(d, dict) for d in data)
+    ):
+        return [parse_one(text, model) for text in ocr_texts]
+    return data
+
+
+def _parse_uncached(ocr_texts: list, model: str) -> list:
+    results = []
+    for start in range(0, len(ocr_texts), max(LLM_BATCH_SIZE, 1)):
+        results.extend(parse_batch(ocr_texts[start : start + LLM_BATCH_SIZE], model))
+    return results
+
+
+def _remember(key, fields):
+    # Only cache useful answers; an empty parse may be a transient failure
+    if any(fields.get(k) for k in FIELDS):
+        memo.set(key, dict(fields))
+
+
+def extract(ocr_text: str, model: str) -> dict:
+    """
+    Parse one receipt, using the memo cache and, when a batch window is
+    configured, coalescing with concurrent callers.
+    """
+    key = (normalize_text(ocr_text), model)
+    cached = memo.get(key)
+    if cached is not None:
+        return dict(cached)
+    if LLM_BATCH_WINDOW_MS > 0:
+        fields = _batcher.submit(ocr_text, model)
+    else:
+        fields = parse_one(ocr_text, model)
+    _remember(key, fields)
+    return fields
+
+
+def extract_many(ocr_texts: list, model: str) -> list:
+    """
+    Parse many receipts, packing cache misses LLM_BATCH_SIZE per prompt.
+    Identical texts are only sent once.
+    """
+    keys = [(normalize_text(text), model) for text in ocr_texts]
+    results = [memo.get(key) for key in keys]
+    misses = {}
+    for i, (key, cached) in enumerate(zip(keys, results)):
+        if cached is None:
+            misses.setdefault(key, []).append(i)
+    if misses:
+        indexes = list(misses.values())
+        parsed = _parse_uncached([ocr_texts[ix[0]] for ix in indexes], model)
+        for ix, fields in zip(indexes, parsed):
+            _remember(keys[ix[0]], fields)
+            for i in ix:
+                results[i] = fields
+    return [dict(r) for r in results]
+
+
+class MicroBatcher:
+    """
+    Collects single-receipt calls that arrive within ``window`` seconds of
+    each other and sends them as one batched prompt. The first caller of a
+    window waits it out and dispatches for everyone.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = []
+        self._leader = False
+
+    def submit(self, ocr_text: str, model: str) -> dict:
+        future = Future()
+        with self._lock:
+            self._pending.append((ocr_text, model, future))
+            lead, self._leader = not self._leader, True
+        if lead:
+            time.sleep(self.window)
+            with self._lock:
+                pending, self._pending, self._leader = self._pending, [], False
+            self._dispatch(pending)
+        return future.result()
+
+    def _dispatch(self, pending):
+        by_model = {}
+        for item in pending:
+            by_model.setdefault(item[1], []).append(item)
+        for model, items in by_model.items():
+            try:
+                parsed = _parse_uncached([text for text, _, _ in items], model)
+            except Exception as e:
+                for _, _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), fields in zip(items, parsed):
+                future.set_result(fields)
+
+
+_batcher = MicroBatcher(LLM_BATCH_WINDOW_MS / 1000)
+
+
+def stats() -> dict:
+    return {
+        'cache': memo.stats(),
+        'max_concurrency': LLM_MAX_CONCURRENCY,
+        'batch_size': LLM_BATCH_SIZE,
+    }
@@ -1,9 +1,25 @@
+import zlib
 from datetime import datetime
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
 from app import db
 
+# Processing states for a receipt's OCR/parse job
+STATUS_QUEUED = 'queued'
+STATUS_PROCESSING = 'processing'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
 
 class Receipt(db.Model):
     __tablename__ = 'receipts'
+    __table_args__ = (
+        # Back keyset pagination and the sort/range filters on GET /receipts;
+        # id is the tiebreaker of every sort order
+        db.Index('ix_receipts_created_at_id', 'created_at', 'id'),
+        db.Index('ix_receipts_date_id', 'date', 'id'),
+        db.Index('ix_receipts_total_id', 'total', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(256), nullable=False)
@@ -11,8 +27,63 @@ class Receipt(db.Model):
     date = db.Column(db.Date, nullable=True)
     total = db.Column(db.Float, nullable=True)
     notes = db.Column(db.Text, nullable=True)
-    tags = db.Column(db.String(256), nullable=True)  # comma-separated
+    # Comma-separated copy of the tag names, kept in sync for readers that
+    # predate the tags table. Assigning it (a string or a list) relinks the
+    # receipt's tags on the next flush.
+    tags = db.Column(db.String(256), nullable=True)
+    field_sources = db.Column(
+        db.JSON, nullable=True
+    )  # extraction tier per field, e.g. {"total": "regex"}
+    sha256 = db.Column(
+        db.String(64), nullable=True, index=True
+    )  # content hash of the upload
+    # The upload's key in storage (ab/cd/<sha256>.<ext>); NULL for uploads
+    # still at UPLOAD_FOLDER/filename from before content-addressed storage.
+    # filename is the name it was uploaded under.
+    storage_key = db.Column(db.String(80), nullable=True, index=True)
+    # Grayscale copies for viewing (app.images), once compacted
+    image_key = db.Column(db.String(96), nullable=True)
+    thumb_key = db.Column(db.String(96), nullable=True)
+    # Client-chosen key of an imported receipt; importing it again is a no-op
+    import_key = db.Column(db.String(64), nullable=True, unique=True, index=True)
+    status = db.Column(
+        db.String(16),
+        nullable=False,
+        default=STATUS_DONE,
+        server_default=STATUS_DONE,
+        index=True,
+    )
+    error = db.Column(db.Text, nullable=True)
+    # zlib-compressed OCR output; deferred so listings never load it
+    raw_text = db.deferred(db.Column(db.LargeBinary, nullable=True))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped by every insert and update; the validator behind ETag and
+    # Last-Modified on receipt reads
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+    tag_links = db.relationship(
+        'ReceiptTag',
+        order_by='ReceiptTag.position',
+        lazy='selectin',
+        cascade='all, delete-orphan',
+    )
+
+    @property
+    def ocr_text(self):
+        return (
+            zlib.decompress(self.raw_text).decode()
+            if self.raw_text is not None
+            else None
+        )
+
+    @ocr_text.setter
+    def ocr_text(self, text):
+        self.raw_text = zlib.compress(text.encode(), 6) if text is not None else None
+
+    @property
+    def tag_names(self) -> list:
+        return [link.tag.name for link in self.tag_links]
 
     def to_dict(self):
         return {
@@ -22,6 +93,125 @@ class Receipt(db.Model):
             'date': self.date.isoformat() if self.date else None,
             'total': self.total,
             'notes': self.notes,
-            'tags': self.tags.split(',') if self.tags else [],
+            'tags': self.tag_names,
+            'status': self.status,
             'created_at': self.created_at.isoformat(),
         }
+
+
+# Case-insensitive merchant match and prefix filters
+db.Index('ix_receipts_merchant_lower', db.func.lower(Receipt.merchant))
+
+
+class Tag(db.Model):
+    __tablename__ = 'tags'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(256), nullable=False, unique=True)
+
+
+class ReceiptTag(db.Model):
+    """
+    A tag on a receipt. ``position`` keeps tags in the order they were given.
+    """
+
+    __tablename__ = 'receipt_tags'
+    __table_args__ = (
+        # "Receipts tagged X" and per-tag counts read only this index
+        db.Index('ix_receipt_tags_tag_id_receipt_id', 'tag_id', 'receipt_id'),
+    )
+
+    receipt_id = db.Column(
+        db.Integer, db.ForeignKey('receipts.id', ondelete='CASCADE'), primary_key=True
+    )
+    tag_id = db.Column(
+        db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True
+    )
+    position = db.Column(db.SmallInteger, nullable=False, default=0)
+    tag = db.relationship(Tag, lazy='joined', innerjoin=True)
+
+
+class SpendRollup(db.Model):
+    """
+    Receipt count and spend per day, ISO week and month, overall ('all',
+    key '') and per merchant or tag. Maintained incrementally by
+    app.analytics.
+    """
+
+    __tablename__ = 'spend_rollups'
+
+    grain = db.Column(db.String(5), primary_key=True)  # day | week | month
+    dimension = db.Column(db.String(8), primary_key=True)  # all | merchant | tag
+    period = db.Column(db.Date, primary_key=True)  # first day of the period
+    key = db.Column(db.String(256), primary_key=True)
+    receipts = db.Column(db.Integer, nullable=False, default=0)
+    total_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+def split_tags(value) -> list:
+    """
+    Tag names from a comma-separated string or a list: stripped, without
+    blanks or repeats, in their original order.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return list(dict.fromkeys(t.strip() for t in value if t and t.strip()))
+
+
+_UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def upsert_insert(dialect_name: str, table):
+    """
+    INSERT for ``table`` that supports ON CONFLICT clauses (Postgres and
+    SQLite), or None on other databases.
+    """
+    insert = _UPSERT_INSERTS.get(dialect_name)
+    return insert(table) if insert else None
+
+
+def tag_ids(session, names) -> dict:
+    """
+    Map tag names to ids, creating the tags that do not exist yet. Inserts
+    skip names another writer created in the meantime.
+    """
+    names = list(names)
+    if not names:
+        return {}
+    query = sa.select(Tag.name, Tag.id)
+    found = dict(session.execute(query.where(Tag.name.in_(names))).all())
+    missing = [n for n in names if n not in found]
+    if missing:
+        insert = upsert_insert(session.get_bind().dialect.name, Tag)
+        insert = (
+            insert.on_conflict_do_nothing() if insert is not None else sa.insert(Tag)
+        )
+        session.execute(insert, [{'name': n} for n in missing])
+        found.update(session.execute(query.where(Tag.name.in_(missing))).all())
+    return found
+
+
+@sa.event.listens_for(sa.orm.Session, 'before_flush')
+def _sync_tag_links(session, flush_context, instances):
+    """
+    Dual-write: rebuild tag_links for receipts whose ``tags`` changed.
+    """
+    changed = [
+        obj
+        for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, Receipt) and sa.inspect(obj).attrs.tags.history.added
+    ]
+    if not changed:
+        return
+    with session.no_autoflush:
+        names = {receipt: split_tags(receipt.tags) for receipt in changed}
+        ids = tag_ids(
+            session, dict.fromkeys(n for tags in names.values() for n in tags)
+        )
+        for receipt, tags in names.items():
+            receipt.tags = ','.join(tags) or None
+            receipt.tag_links = [
+                ReceiptTag(tag_id=ids[name], position=i) for i, name in enumerate(tags)
+            ]
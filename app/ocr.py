@@ -1,68 +1,493 @@
 import os
-import json
+import threading
+import time
+from contextlib import closing, contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from PIL import Image
-import pytesseract
 import cv2
 import numpy as np
-import openai
+import pypdfium2 as pdfium
+from app import llm
+from app.ocr_engines import PytesseractEngine, create_engine
 
-# Configure OpenAI (Gemini) API
-openai.api_key = os.getenv('GEMINI_API_KEY')
+# Gemini model, through its OpenAI-compatible API (see app.llm)
 MODEL = os.getenv('GEMINI_PRO_MODEL')
 
 # Supported languages: English (eng) and Japanese (jpn)
 TESS_LANG = 'eng+jpn'
+TESS_CONFIG = '--oem 1 --psm 6'
 
+# OCR engine: 'pytesseract' (one tesseract process per image) or 'pool'
+# (persistent workers that keep the language data loaded)
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'pytesseract')
+OCR_POOL_SIZE = int(os.getenv('OCR_POOL_SIZE', 0)) or None
+OCR_TASK_TIMEOUT = float(os.getenv('OCR_TASK_TIMEOUT', 30))
+OCR_MAX_TASKS_PER_WORKER = int(os.getenv('OCR_MAX_TASKS_PER_WORKER', 200))
 
-def preprocess_image(file_path: str) -> np.ndarray:
+# Image preprocessing parameters; part of the pipeline version used to key
+# cached OCR results, so changing them invalidates the cache
+PREPROCESS_PARAMS = {
+    # Scale so that a typical glyph is about this many pixels tall
+    'target_text_height': 32,
+    'min_scale': 0.25,
+    'max_scale': 2.0,
+    # Longest side of the working image; caps peak memory per request
+    'max_side': 3500,
+    'bilateral': (9, 75, 75),
+    # Larger images get a median blur instead of the (slow) bilateral filter
+    'fast_denoise_pixels': 4_000_000,
+    # Denoise in horizontal strips of this many rows
+    'tile_rows': 1024,
+    # Find the receipt in a photo, crop it, undo perspective, and deskew
+    'detect_receipt': os.getenv('OCR_DETECT_RECEIPT', '1') == '1',
+    # Largest bright region must cover this fraction of the frame to be
+    # taken as the receipt; above the upper bound the frame is already tight
+    'receipt_area': (0.1, 0.9),
+    'max_skew': 15,
+}
+
+# PDFs: pages are rasterized one at a time at PDF_DPI (capped by max_side)
+# and OCR'd PDF_PAGE_WORKERS at a time (0 = OCR pool size or CPU count).
+# With PDF_TEXT_LAYER=1, pages that carry embedded text skip OCR.
+PDF_DPI = int(os.getenv('PDF_DPI', 300))
+PDF_PAGE_WORKERS = int(os.getenv('PDF_PAGE_WORKERS', 0))
+PDF_TEXT_LAYER = os.getenv('PDF_TEXT_LAYER', '1') == '1'
+# Fewer non-blank characters than this means the page is a scan
+PDF_MIN_TEXT_CHARS = 16
+
+_REDUCED_READS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# PDFium is not thread-safe; every call into it goes through this lock
+_pdfium_lock = threading.Lock()
+
+# Cumulative wall time per preprocessing/OCR stage in this process
+stage_timings = {}
+_timings_lock = threading.Lock()
+
+_engine = None
+_engine_lock = threading.Lock()
+_fallback_engine = PytesseractEngine(TESS_LANG, TESS_CONFIG)
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _timings_lock:
+            entry = stage_timings.setdefault(stage, {'count': 0, 'seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += elapsed
+
+
+def stage_stats() -> dict:
+    """
+    Call count and average milliseconds per stage.
+    """
+    with _timings_lock:
+        return {
+            stage: {
+                'count': e['count'],
+                'avg_ms': round(e['seconds'] * 1000 / e['count'], 2),
+            }
+            for stage, e in stage_timings.items()
+        }
+
+
+def get_engine():
     """
-    Load image, convert to grayscale, upscale, denoise, and threshold.
+    Return the configured OCR engine, creating it on first use.
+    Falls back to pytesseract if the pool cannot be started.
     """
-    img = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
-    # Upscale for better recognition
-    img = cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-    # Reduce noise while preserving edges
-    img = cv2.bilateralFilter(img, 9, 75, 75)
+    global _engine
+    engine = _engine
+    if engine is not None:
+        return engine
+    # Job workers and request threads may get here together; only one of
+    # them may start a pool
+    with _engine_lock:
+        if _engine is None:
+            try:
+                _engine = create_engine(
+                    OCR_ENGINE,
+                    TESS_LANG,
+                    TESS_CONFIG,
+                    size=OCR_POOL_SIZE,
+                    timeout=OCR_TASK_TIMEOUT,
+                    max_tasks=OCR_MAX_TASKS_PER_WORKER,
+                )
+            except Exception:
+                _engine = _fallback_engine
+        return _engine
+
+
+def set_engine(engine) -> None:
+    """
+    Replace the active OCR engine, closing the previous one.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None and _engine is not engine:
+            _engine.close()
+        _engine = engine
+
+
+def load_grayscale(file_path: str, max_side: int = None) -> np.ndarray:
+    """
+    Decode an image as grayscale. Large photos are decoded at a reduced
+    size (JPEG DCT scaling) when they would exceed ``max_side`` (default
+    the preprocessing max_side) anyway, so the full-resolution bitmap is
+    never materialised. The result may still be larger than ``max_side``.
+    """
+    max_side = max_side or PREPROCESS_PARAMS['max_side']
+    try:
+        with Image.open(file_path) as im:
+            long_side = max(im.size)  # reads the header only
+    except Exception:
+        long_side = 0
+    factor = 1
+    while factor < 8 and long_side / (factor * 2) >= max_side:
+        factor *= 2
+    img = cv2.imread(file_path, _REDUCED_READS[factor])
+    if img is None:
+        raise ValueError(f'Cannot decode image: {file_path}')
+    return img
+
+
+def estimate_text_height(img: np.ndarray):
+    """
+    Median height in pixels of glyph-sized connected components, measured
+    on a thumbnail. Returns None when there is too little text to tell.
+    """
+    h, w = img.shape[:2]
+    f = min(1.0, 1000 / max(h, w))
+    small = (
+        cv2.resize(img, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+        if f < 1
+        else img
+    )
+    _, bw = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(bw, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    keep = (
+        (heights >= 2) & (heights < small.shape[0] / 8) & (widths < small.shape[1] / 4)
+    )
+    if keep.sum() < 10:
+        return None
+    return float(np.median(heights[keep])) / f
+
+
+def choose_scale(img: np.ndarray) -> float:
+    """
+    Pick the resize factor from the estimated text height: large photos are
+    downscaled and only small scans are upscaled, within max_side.
+    """
+    p = PREPROCESS_PARAMS
+    long_side = max(img.shape[:2])
+    text_height = estimate_text_height(img)
+    if text_height:
+        scale = p['target_text_height'] / text_height
+    else:
+        scale = p['max_scale'] if long_side < 1000 else 1.0
+    return min(max(scale, p['min_scale']), p['max_scale'], p['max_side'] / long_side)
+
+
+def _apply_tiled(img: np.ndarray, fn, overlap: int) -> np.ndarray:
+    """
+    Run a neighbourhood filter strip by strip into one output buffer, so
+    filter temporaries are bounded by the strip size, not the image.
+    """
+    rows = PREPROCESS_PARAMS['tile_rows']
+    h = img.shape[0]
+    if h <= rows:
+        return fn(img)
+    out = np.empty_like(img)
+    for top in range(0, h, rows):
+        bottom = min(top + rows, h)
+        a, b = max(top - overlap, 0), min(bottom + overlap, h)
+        out[top:bottom] = fn(img[a:b])[top - a : bottom - a]
+    return out
+
+
+def _thumbnail(img: np.ndarray, long_side: int):
+    f = min(1.0, long_side / max(img.shape[:2]))
+    if f < 1:
+        img = cv2.resize(img, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+    return img, f
+
+
+def _order_corners(pts: np.ndarray) -> np.ndarray:
+    # top-left, top-right, bottom-right, bottom-left
+    pts = np.asarray(pts, dtype=np.float32).reshape(4, 2)
+    s, d = pts.sum(axis=1), np.diff(pts, axis=1).ravel()
+    return np.array(
+        [pts[s.argmin()], pts[d.argmin()], pts[s.argmax()], pts[d.argmax()]],
+        dtype=np.float32,
+    )
+
+
+def detect_receipt(img: np.ndarray):
+    """
+    Find the receipt in a photo as the largest bright quadrilateral.
+    Returns its corners (tl, tr, br, bl) in image coordinates, or None when
+    no plausible receipt is found or it already fills the frame.
+    """
+    small, f = _thumbnail(img, 500)
+    small = cv2.GaussianBlur(small, (5, 5), 0)
+    _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((7, 7), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+    low, high = PREPROCESS_PARAMS['receipt_area']
+    if not low <= cv2.contourArea(contour) / mask.size <= high:
+        return None
+    approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+    # Torn or curled receipts rarely give a clean quad; fall back to the min-area box
+    quad = approx if len(approx) == 4 else cv2.boxPoints(cv2.minAreaRect(contour))
+    return _order_corners(quad) / f
+
+
+def crop_receipt(img: np.ndarray, corners: np.ndarray) -> np.ndarray:
+    """
+    Cut out the quadrilateral and warp it to an upright rectangle.
+    """
+    tl, tr, br, bl = corners
+    width = int(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl)))
+    height = int(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr)))
+    dst = np.array(
+        [[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]],
+        dtype=np.float32,
+    )
+    matrix = cv2.getPerspectiveTransform(corners.astype(np.float32), dst)
+    return cv2.warpPerspective(
+        img,
+        matrix,
+        (width, height),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def _rotate(
+    img: np.ndarray, angle: float, interpolation=cv2.INTER_LINEAR
+) -> np.ndarray:
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(
+        img, matrix, (w, h), flags=interpolation, borderMode=cv2.BORDER_REPLICATE
+    )
+
+
+def estimate_skew(img: np.ndarray) -> float:
+    """
+    Angle in degrees that makes text lines horizontal, found by maximising
+    the variance of the row profile over rotations of a thumbnail.
+    """
+    small, _ = _thumbnail(img, 600)
+    _, bw = cv2.threshold(small, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    def sharpness(angle):
+        rows = _rotate(bw, angle, cv2.INTER_NEAREST).sum(axis=1, dtype=np.float64)
+        return rows.var()
+
+    limit = PREPROCESS_PARAMS['max_skew']
+    best = max(np.arange(-limit, limit + 0.1, 1.5), key=sharpness)
+    return float(max(np.arange(best - 0.75, best + 0.76, 0.25), key=sharpness))
+
+
+def deskew(img: np.ndarray) -> np.ndarray:
+    angle = estimate_skew(img)
+    # Tesseract tolerates small skew; not worth a resample
+    if abs(angle) < 0.5:
+        return img
+    return _rotate(img, angle)
+
+
+def preprocess_array(img: np.ndarray) -> np.ndarray:
+    """
+    Crop and straighten the receipt (when detect_receipt is on), rescale
+    to a text size Tesseract reads well, denoise, and threshold.
+    """
+    p = PREPROCESS_PARAMS
+    if p['detect_receipt']:
+        with timed('detect'):
+            corners = detect_receipt(img)
+        if corners is not None:
+            with timed('crop'):
+                img = crop_receipt(img, corners)
+        with timed('deskew'):
+            img = deskew(img)
+    with timed('scale'):
+        scale = choose_scale(img)
+        if abs(scale - 1.0) > 0.05:
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=interpolation)
+    # Reduce noise; the edge-preserving bilateral filter is too slow for big images
+    with timed('denoise'):
+        if img.size > p['fast_denoise_pixels']:
+            img = _apply_tiled(img, lambda t: cv2.medianBlur(t, 3), 1)
+        else:
+            d = p['bilateral'][0]
+            img = _apply_tiled(
+                img, lambda t: cv2.bilateralFilter(t, *p['bilateral']), d // 2 + 1
+            )
     # Binarize image
-    _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    with timed('threshold'):
+        _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     return img
 
 
+def preprocess_image(file_path: str) -> np.ndarray:
+    """
+    Load image as grayscale and prepare it for OCR (see preprocess_array).
+    Peak memory is bounded by max_side.
+    """
+    with timed('load'):
+        img = load_grayscale(file_path)
+    return preprocess_array(img)
+
+
+def is_pdf(file_path: str) -> bool:
+    # Sniff the header; upload extensions are not trusted
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(5) == b'%PDF-'
+    except OSError:
+        return False
+
+
+def iter_pdf_pages(file_path: str, text_layer: bool = None):
+    """
+    Yield (page_index, page) for each page of a PDF, rendering lazily so
+    only the page being consumed is in memory. ``page`` is the embedded
+    text (str) when the text layer is used, otherwise a grayscale array
+    rendered at PDF_DPI, with the long side capped at max_side.
+    """
+    if text_layer is None:
+        text_layer = PDF_TEXT_LAYER
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(file_path)
+        count = len(pdf)
+    try:
+        for index in range(count):
+            with _pdfium_lock:
+                page = pdf[index]
+                try:
+                    text = None
+                    if text_layer:
+                        textpage = page.get_textpage()
+                        text = textpage.get_text_range()
+                        textpage.close()
+                        if len(''.join(text.split())) < PDF_MIN_TEXT_CHARS:
+                            text = None
+                    if text is not None:
+                        result = text.replace('\r\n', '\n')
+                    else:
+                        scale = min(
+                            PDF_DPI / 72,
+                            PREPROCESS_PARAMS['max_side'] / max(page.get_size()),
+                        )
+                        bitmap = page.render(scale=scale, grayscale=True)
+                        result = bitmap.to_numpy().copy()
+                        bitmap.close()
+                finally:
+                    page.close()
+            yield index, result
+    finally:
+        with _pdfium_lock:
+            pdf.close()
+
+
+def _page_workers() -> int:
+    return (
+        PDF_PAGE_WORKERS or getattr(get_engine(), 'size', None) or os.cpu_count() or 1
+    )
+
+
+def ocr_pdf(file_path: str, workers: int = None) -> str:
+    """
+    OCR a PDF page by page and return the text in page order. Pages are
+    recognized in parallel, but at most ``workers`` rendered pages are
+    held at once, so long documents never sit fully in memory.
+    """
+    workers = workers or _page_workers()
+    texts = {}
+    pending = {}
+
+    def collect(futures):
+        for future in futures:
+            texts[pending.pop(future)] = future.result()
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix='pdf-page'
+    ) as pool, closing(iter_pdf_pages(file_path)) as pages:
+        for index, page in pages:
+            if isinstance(page, str):
+                texts[index] = page
+                continue
+            pending[
+                pool.submit(lambda img: _recognize(preprocess_array(img)), page)
+            ] = index
+            if len(pending) >= workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(list(pending))
+    return '\n'.join(texts[i].strip('\n\f') for i in sorted(texts))
+
+
+def _recognize(img) -> str:
+    engine = get_engine()
+    with timed('recognize'):
+        try:
+            return engine.recognize(img)
+        except TimeoutError:
+            raise
+        except Exception:
+            if engine is _fallback_engine:
+                raise
+            # Pool worker crashed; the pytesseract path still works
+            return _fallback_engine.recognize(img)
+
+
 def ocr_extract(file_path: str) -> str:
     """
     Run Tesseract OCR on the given file and return raw text.
-    Supports English and Japanese.
+    Supports English and Japanese. PDFs are read page by page (see ocr_pdf).
     """
+    if is_pdf(file_path):
+        return ocr_pdf(file_path)
     # Preprocess and extract text
     try:
         img = preprocess_image(file_path)
     except Exception:
         # Fallback to PIL
         img = Image.open(file_path)
-    text = pytesseract.image_to_string(img, lang=TESS_LANG, config='--oem 1 --psm 6')
-    return text
+    return _recognize(img)
 
 
 def parse_receipt_fields(ocr_text: str) -> dict:
     """
     Use LLM to parse merchant, date, and total from OCR text.
     Returns a dict: {merchant, date, total}.
+    Calls are memoized, concurrency-limited, and bounded by LLM_TIMEOUT
+    (see app.llm); a call that times out or fails returns empty fields.
     """
-    prompt = (
-        "Extract merchant name, date (YYYY-MM-DD), and total amount as JSON from the receipt text. "
-        f"Text:\n```{ocr_text}```"
-    )
-    response = openai.ChatCompletion.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": "You are a receipt parsing assistant with high accuracy."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.0,
-    )
-    content = response.choices[0].message.content
-    try:
-        data = json.loads(content)
-    except json.JSONDecodeError:
-        data = {"merchant": None, "date": None, "total": None}
-    return data
+    return llm.extract(ocr_text, MODEL)
+
+
+def parse_receipt_fields_many(ocr_texts: list) -> list:
+    """
+    Parse several OCR texts, packing them into batched LLM prompts.
+    Returns one {merchant, date, total} dict per text, in order.
+    """
+    return llm.extract_many(list(ocr_texts), MODEL)
@@ -0,0 +1,268 @@
+import atexit
+import logging
+import multiprocessing
+import queue
+import threading
+import numpy as np
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+
+def _as_array(img) -> np.ndarray:
+    """
+    Normalise a PIL image or array to a contiguous 8-bit grayscale array.
+    """
+    if isinstance(img, Image.Image):
+        img = np.asarray(img.convert('L'))
+    return np.ascontiguousarray(img, dtype=np.uint8)
+
+
+class PytesseractEngine:
+    """
+    Runs the tesseract CLI through pytesseract: one process per image.
+    """
+
+    name = 'pytesseract'
+
+    def __init__(self, lang: str, config: str = ''):
+        self.lang = lang
+        self.config = config
+
+    def recognize(self, img) -> str:
+        return pytesseract.image_to_string(img, lang=self.lang, config=self.config)
+
+    def close(self):
+        pass
+
+
+def tesseract_recognizer(lang: str, config: str):
+    """
+    Build a recognize(array) callable for a pool worker.
+    With tesserocr the Tesseract API and its traineddata are loaded once per
+    worker; without it each call still shells out through pytesseract.
+    """
+    if tesserocr is None:
+        engine = PytesseractEngine(lang, config)
+        return engine.recognize
+    psm = tesserocr.PSM.SINGLE_BLOCK if '--psm 6' in config else tesserocr.PSM.AUTO
+    api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm, oem=tesserocr.OEM.LSTM_ONLY)
+
+    def recognize(arr):
+        api.SetImage(Image.fromarray(arr))
+        return api.GetUTF8Text()
+
+    return recognize
+
+
+def _worker_main(conn, factory, lang, config):
+    """
+    Pool worker loop: initialise the recognizer once, then serve images sent
+    over the pipe as (shape header, raw bytes) until told to stop.
+    """
+    recognize = factory(lang, config)
+    conn.send(('ready', None))
+    while True:
+        try:
+            shape = conn.recv()
+        except EOFError:
+            return
+        if shape is None:
+            return
+        arr = np.frombuffer(conn.recv_bytes(), dtype=np.uint8).reshape(shape)
+        try:
+            conn.send(('ok', recognize(arr)))
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}'))
+
+
+class _Worker:
+    def __init__(self, ctx, factory, lang, config, start_timeout):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child, factory, lang, config), daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.tasks = 0
+        if not self.conn.poll(start_timeout):
+            self.kill()
+            raise TimeoutError('OCR worker did not start in time')
+        try:
+            self.conn.recv()
+        except EOFError:
+            self.kill()
+            raise RuntimeError('OCR worker failed to initialise')
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+
+
+class TesseractPoolEngine:
+    """
+    Pool of long-lived OCR worker processes.
+
+    Each worker loads the language data once and then receives preprocessed
+    images over a pipe, so the per-receipt cost is recognition only.
+    A task that exceeds ``timeout`` seconds kills its worker (a replacement
+    is started) and raises TimeoutError, as does waiting longer than
+    ``timeout`` for a free worker. Workers are recycled after ``max_tasks``
+    jobs to bound memory growth in the Tesseract process. A replacement
+    that fails to start is retried on the next task.
+    """
+
+    name = 'pool'
+
+    def __init__(
+        self,
+        lang: str,
+        config: str = '',
+        size: int = None,
+        timeout: float = 30.0,
+        max_tasks: int = 200,
+        factory=tesseract_recognizer,
+        start_method: str = None,
+    ):
+        self.lang = lang
+        self.config = config
+        self.size = size or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self.factory = factory
+        self._ctx = multiprocessing.get_context(start_method)
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._starting = threading.Lock()
+        self._closed = False
+        try:
+            for _ in range(self.size):
+                self._add_worker()
+        except Exception:
+            self.close()
+            raise
+
+    def _start_worker(self):
+        return _Worker(self._ctx, self.factory, self.lang, self.config, self.timeout)
+
+    def _add_worker(self):
+        worker = self._start_worker()
+        with self._lock:
+            self._workers.add(worker)
+        self._idle.put(worker)
+
+    def _replenish(self):
+        """
+        Start workers until the pool is back to full size. Failures are logged
+        and left for the next task to retry.
+        """
+        if not self._starting.acquire(blocking=False):
+            return
+        try:
+            while not self._closed and len(self._workers) < self.size:
+                self._add_worker()
+        except Exception:
+            logger.exception('Could not start an OCR worker')
+        finally:
+            self._starting.release()
+
+    def _retire(self, worker, kill=False):
+        if not kill and not self._closed:
+            # Recycle: the old worker keeps serving if its replacement won't start
+            try:
+                replacement = self._start_worker()
+            except Exception:
+                logger.exception('Could not recycle an OCR worker')
+                self._idle.put(worker)
+                return
+            with self._lock:
+                self._workers.discard(worker)
+                self._workers.add(replacement)
+            self._idle.put(replacement)
+            worker.stop()
+            return
+        with self._lock:
+            self._workers.discard(worker)
+        if kill:
+            worker.kill()
+            worker.conn.close()
+        else:
+            worker.stop()
+        self._replenish()
+
+    def recognize(self, img) -> str:
+        if self._closed:
+            raise RuntimeError('OCR pool is closed')
+        arr = _as_array(img)
+        if len(self._workers) < self.size:
+            self._replenish()
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f'No OCR worker free within {self.timeout}s') from None
+        try:
+            worker.conn.send(arr.shape)
+            worker.conn.send_bytes(memoryview(arr).cast('B'))
+            if not worker.conn.poll(self.timeout):
+                self._retire(worker, kill=True)
+                raise TimeoutError(f'OCR task exceeded {self.timeout}s')
+            status, payload = worker.conn.recv()
+        except (EOFError, BrokenPipeError, ConnectionResetError) as e:
+            # Worker died mid-task; replace it and surface the failure
+            self._retire(worker, kill=True)
+            raise RuntimeError(f'OCR worker crashed: {e}') from e
+        worker.tasks += 1
+        if worker.tasks >= self.max_tasks:
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+        if status == 'error':
+            raise RuntimeError(payload)
+        return payload
+
+    def worker_pids(self):
+        with self._lock:
+            return sorted(w.process.pid for w in self._workers)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            workers, self._workers = list(self._workers), set()
+        for worker in workers:
+            worker.stop()
+
+
+def create_engine(name: str, lang: str, config: str, **pool_options):
+    """
+    Build an OCR engine by name ('pytesseract' or 'pool').
+    Pool options are ignored by the pytesseract engine. Without tesserocr the
+    default pool workers would still run the CLI per image, so 'pool' falls
+    back to pytesseract unless a custom factory is given.
+    """
+    if name == 'pool' and tesserocr is None and 'factory' not in pool_options:
+        logger.warning('tesserocr is not installed; using the pytesseract OCR engine')
+        name = 'pytesseract'
+    if name == 'pool':
+        engine = TesseractPoolEngine(lang, config, **pool_options)
+        atexit.register(engine.close)
+        return engine
+    if name == 'pytesseract':
+        return PytesseractEngine(lang, config)
+    raise ValueError(f'Unknown OCR engine: {name}')
@@ -0,0 +1,111 @@
+import base64
+import json
+from datetime import date, datetime
+import sqlalchemy as sa
+from app import db
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _parse_value(column, value):
+    if value is None:
+        raise InvalidCursor('Invalid cursor')
+    python_type = column.type.python_type
+    if python_type in (datetime, date):
+        return python_type.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(value, row_id: int, key: str = 'created_at') -> str:
+    """
+    Opaque cursor for the row after which the next page starts: the sort
+    key's name and value, and the row id as tiebreaker.
+    """
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    raw = json.dumps([key, value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, key: str = 'created_at', parse=datetime.fromisoformat):
+    """
+    Inverse of encode_cursor. Raises InvalidCursor for anything it did not
+    produce, or for a cursor issued under a different sort key.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_key, value, row_id = json.loads(raw)
+        if cursor_key != key:
+            raise ValueError(f'cursor is for sort key {cursor_key!r}')
+        return parse(value), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+
+
+def keyset_page(
+    query, column, id_column, per_page: int, cursor: str = None, descending: bool = True
+):
+    """
+    One page of ``query`` ordered by (column, id), starting after ``cursor``.
+    Seeks with a row-value comparison on a (column, id) index instead of
+    OFFSET, so every page costs the same. Rows whose sort value is NULL
+    cannot be seeked past; callers filter them out.
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    if descending:
+        query = query.order_by(column.desc(), id_column.desc())
+    else:
+        query = query.order_by(column.asc(), id_column.asc())
+    if cursor:
+        value, last_id = decode_cursor(
+            cursor, column.key, lambda v: _parse_value(column, v)
+        )
+        position = sa.tuple_(column, id_column)
+        bound = sa.tuple_(value, last_id)
+        query = query.filter(position < bound if descending else position > bound)
+    # One extra row tells us whether there is a next page without a COUNT
+    rows = query.limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id, column.key)
+    return items, next_cursor
+
+
+def estimate_count(model) -> int:
+    """
+    Approximate row count from planner statistics, without scanning the
+    table: pg_class.reltuples on PostgreSQL, sqlite_stat1 (after ANALYZE)
+    on SQLite, falling back to the id range.
+    """
+    table = model.__tablename__
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        estimate = db.session.execute(
+            sa.text(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"
+            ),
+            {'t': table},
+        ).scalar()
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+    elif dialect == 'sqlite':
+        has_stats = db.session.execute(
+            sa.text(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE type = 'table' AND name = 'sqlite_stat1'"
+            )
+        ).scalar()
+        if has_stats:
+            # The first number of every stat row is the table's row count
+            stat = db.session.execute(
+                sa.text("SELECT stat FROM sqlite_stat1 WHERE tbl = :t LIMIT 1"),
+                {'t': table},
+            ).scalar()
+            if stat:
+                return int(stat.split()[0])
+    low, high = db.session.query(sa.func.min(model.id), sa.func.max(model.id)).one()
+    return high - low + 1 if high is not None else 0
@@ -1,23 +1,239 @@
+import datetime
 import re
 
+MONTHS = {
+    m: i
+    for i, m in enumerate(
+        (
+            'jan',
+            'feb',
+            'mar',
+            'apr',
+            'may',
+            'jun',
+            'jul',
+            'aug',
+            'sep',
+            'oct',
+            'nov',
+            'dec',
+        ),
+        1,
+    )
+}
+
+# Patterns are compiled once and run over the lowercased text. Each starts
+# with a literal or a character class so the regex engine can skip ahead to
+# candidates; word boundaries before a match are checked in Python because
+# a leading "\b" or lookbehind would disable that fast scan.
+#
+# Numeric dates are anchored on their separators: 2025-04-24, 2025/4/24,
+# 2025.04.24, 24/04/2025, 24.04.2025 (the leading number is read back).
+_NUMERIC_DATE = re.compile(
+    r"(?P<sep>[/.-])(?P<mid>\d{1,2})(?P=sep)(?P<last>\d{1,4})(?!\d)"
+)
+_KANJI_DATE = re.compile(
+    r"(?P<year>\d{4})\s*年\s*(?P<month>\d{1,2})\s*月\s*(?P<day>\d{1,2})\s*日"
+)
+# Apr 24 2025, April 24, 2025, and the "24 Apr 2025" form with the day read back
+_WORD_DATE = re.compile(
+    r"(?P<mon>jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+"
+    r"(?:(?P<day>\d{1,2}),?\s+)?(?P<year>\d{4})(?!\d)"
+)
+# Labels that beat a bare "total" (e.g. a later "grand total" line)
+_STRONG_TOTAL = re.compile(
+    r"(?:grand\s+total|amount\s+due|balance\s+due|total\s+due|合計)"
+)
+_STRONG_HINTS = ('grand', 'due', '合計')
+# Matched right after a label: thousands separators, a decimal comma (13,50),
+# or plain digits; decimals are optional so zero-decimal currencies (¥540) parse
+_AMOUNT = re.compile(
+    r"[:：\s]*(?:[\$¥￥€£]|(?:usd|eur|gbp|jpy)\b)?\s*"
+    r"(?P<amount>\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?"
+    r"|\d+,\d{2}(?!\d)"
+    r"|\d+(?:\.\d{1,2})?)(?!\d)"
+)
+_FIRST_LINE = re.compile(r"^[ \t]*(\S[^\n]*?)[ \t\r]*$", re.M)
+_NOISE_WORDS = re.compile(r"welcome|receipt|invoice|thank")
+
+
+def _first_line(text: str):
+    match = _FIRST_LINE.search(text)
+    return match.group(1) if match else None
+
+
+def _word_start(low: str, index: int) -> bool:
+    return index == 0 or not (low[index - 1].isalnum() or low[index - 1] == '_')
+
+
+def _number_before(low: str, end: int, max_digits: int):
+    """
+    The whole number ending at ``end``, or None if there is none or it is
+    longer than ``max_digits``.
+    """
+    start = end
+    while start > 0 and low[start - 1].isdigit():
+        start -= 1
+        if end - start > max_digits:
+            return None
+    if start == end or not _word_start(low, start):
+        return None
+    return start
+
+
+def _valid(year, month, day):
+    try:
+        return datetime.date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def _find_date(text: str, low: str):
+    """
+    First real date in the text as (raw text, ISO date, confidence), or
+    None. Numeric D/M/Y dates are read day-first; when both parts could be
+    the month the confidence is lowered.
+    """
+    for m in _NUMERIC_DATE.finditer(low):
+        start = _number_before(low, m.start(), 4)
+        if start is None:
+            continue
+        first, mid, last = low[start : m.start()], int(m.group('mid')), m.group('last')
+        confidence = 0.95
+        if len(first) == 4:
+            iso = _valid(int(first), mid, int(last))
+        elif len(first) <= 2 and len(last) == 4:
+            iso = _valid(int(last), mid, int(first))
+            if int(first) <= 12 and int(first) != mid:
+                confidence = 0.5
+        else:
+            iso = None
+        if iso:
+            return text[start : m.end()], iso, confidence
+    if '年' in low:
+        for m in _KANJI_DATE.finditer(low):
+            iso = _valid(
+                int(m.group('year')), int(m.group('month')), int(m.group('day'))
+            )
+            if iso:
+                return m.group(), iso, 0.95
+    for m in _WORD_DATE.finditer(low):
+        if not _word_start(low, m.start()):
+            continue
+        start, day = m.start(), m.group('day')
+        if day is None:
+            # "24 Apr 2025": the day comes first
+            gap = len(low[:start]) - len(low[:start].rstrip())
+            start = _number_before(low, start - gap, 2) if gap else None
+            if start is None:
+                continue
+            day = low[start : m.start()].strip()
+        iso = _valid(int(m.group('year')), MONTHS[m.group('mon')], int(day))
+        if iso:
+            return text[start : m.end()], iso, 0.95
+    return None
+
+
+def _amount_at(low: str, index: int):
+    m = _AMOUNT.match(low, index)
+    if m is None:
+        return None
+    raw = m.group('amount')
+    if ',' in raw and len(raw) - raw.rindex(',') == 3:
+        return raw.replace(',', '.')  # decimal comma
+    return raw.replace(',', '')
+
+
+def _find_total(low: str):
+    """
+    Amount after the first strong label, else after the first "total".
+    """
+    if any(hint in low for hint in _STRONG_HINTS):
+        for m in _STRONG_TOTAL.finditer(low):
+            amount = _amount_at(low, m.end())
+            if amount is not None and (
+                m.group() == '合計' or _word_start(low, m.start())
+            ):
+                return amount
+    index = low.find('total')
+    while index >= 0:
+        if _word_start(low, index):  # skips "subtotal"
+            amount = _amount_at(low, index + 5)
+            if amount is not None:
+                return amount
+        index = low.find('total', index + 5)
+    return None
+
+
+def _scan(text: str) -> dict:
+    low = text.lower()
+    if len(low) != len(text):
+        # A few characters change length when lowercased; keep offsets aligned
+        low = ''.join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+    return {
+        'merchant': _first_line(text),
+        'date': _find_date(text, low),
+        'total': _find_total(low),
+    }
+
+
 def parse_with_regex(text: str) -> dict:
     """
     Simple regex-based extraction of merchant, date, and total fields from OCR text.
     Merchant: first non-empty line.
-    Date: ISO or YYYY/MM/DD patterns.
-    Total: 'Total' label followed by amount.
+    Date: the date as written (YYYY-MM-DD, YYYY/MM/DD, DD/MM/YYYY, 2025年4月2日,
+    14 Mar 2025, ...).
+    Total: amount after a Total / Grand total / Amount due / 合計 label, without
+    thousands separators.
     """
-    # Merchant: first non-empty line
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    merchant = lines[0] if lines else None
+    scanned = _scan(text)
+    date = scanned['date']
+    return {
+        "merchant": scanned['merchant'],
+        "date": date[0] if date else None,
+        "total": scanned['total'],
+    }
 
-    # Date pattern YYYY-MM-DD or YYYY/MM/DD
-    date_match = re.search(r"\b(\d{4}[/-]\d{2}[/-]\d{2})\b", text)
-    date = date_match.group(1) if date_match else None
 
-    # Total amount pattern after 'Total'
-    # Allow $ or ¥ currency symbols
-    total_match = re.search(r"\b[Tt]otal[:\s]*[\$\u00A5]?\s*([0-9]+(?:\.[0-9]{2}))\b", text)
-    total = total_match.group(1) if total_match else None
+def _merchant_confidence(line):
+    """
+    Heuristic: a short line that is mostly letters is likely the store name;
+    banners, separators and number-heavy lines are not.
+    """
+    if not line:
+        return 0.0
+    letters = sum(ch.isalpha() for ch in line)
+    if len(line) > 40 or letters < 2 or letters / len(line) < 0.5:
+        return 0.3
+    if _NOISE_WORDS.search(line.lower()):
+        return 0.3
+    return 0.8
+
+
+def parse_with_confidence(text: str):
+    """
+    Regex extraction with a 0..1 confidence score per field.
+    Returns (fields, confidence); dates are normalised to YYYY-MM-DD and
+    impossible dates are dropped.
+    """
+    scanned = _scan(text)
+    date = scanned['date']
+    fields = {
+        'merchant': scanned['merchant'],
+        'date': date[1] if date else None,
+        'total': scanned['total'],
+    }
+    confidence = {
+        'merchant': _merchant_confidence(fields['merchant']),
+        'date': date[2] if date else 0.0,
+        'total': 0.9 if fields['total'] else 0.0,
+    }
+    return fields, confidence
+
 
-    return {"merchant": merchant, "date": date, "total": total}
+def parse_many(texts) -> list:
+    """
+    parse_with_confidence over many texts, for bulk reprocessing.
+    Returns one (fields, confidence) pair per text, in order.
+    """
+    return [parse_with_confidence(text) for text in texts]
@@ -0,0 +1,348 @@
+import datetime
+import hashlib
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app import ocr
+from app.cache import LRUCache
+from app.models import STATUS_DONE, STATUS_FAILED
+from app.parser import parse_with_confidence
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('merchant', 'date', 'total')
+
+# Regex fields scoring below this confidence are re-extracted by the LLM
+CONFIDENCE_THRESHOLD = float(os.getenv('EXTRACTION_CONFIDENCE_THRESHOLD', 0.6))
+
+# Receipts parsed, and how many needed no LLM call at all
+tier_stats = {'receipts': 0, 'llm_calls_avoided': 0}
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def pipeline_version() -> str:
+    """
+    Fingerprint of everything that affects extraction output: preprocessing
+    parameters, Tesseract language/config, the LLM model, the tier threshold,
+    and how PDFs are read.
+    """
+    params = repr(
+        (
+            sorted(ocr.PREPROCESS_PARAMS.items()),
+            ocr.TESS_LANG,
+            ocr.TESS_CONFIG,
+            ocr.MODEL,
+            CONFIDENCE_THRESHOLD,
+            ocr.PDF_DPI,
+            ocr.PDF_TEXT_LAYER,
+        )
+    )
+    return hashlib.sha256(params.encode()).hexdigest()[:16]
+
+
+class ResultCache(LRUCache):
+    """
+    Extraction results keyed by (file SHA-256, pipeline version).
+    Tracks the OCR/parse time avoided by cache hits.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__(maxsize)
+        self.saved_seconds = 0.0
+
+    def lookup(self, digest: str):
+        if not digest:
+            return None
+        entry = self.get((digest, pipeline_version()))
+        if entry is None:
+            return None
+        fields, elapsed = entry
+        self.saved_seconds += elapsed
+        return dict(fields)
+
+    def store(self, digest: str, fields: dict, elapsed: float) -> None:
+        if digest:
+            self.set((digest, pipeline_version()), (dict(fields), elapsed))
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['saved_seconds'] = round(self.saved_seconds, 3)
+        return stats
+
+
+def extract_fields(file_path: str) -> dict:
+    """
+    Run OCR on the file and parse merchant, date, and total.
+    """
+    return parse_text(ocr.ocr_extract(file_path))
+
+
+def parse_text(raw_text: str) -> dict:
+    """
+    Tiered extraction: the regex parser runs first and the LLM is only
+    asked when some field scores below CONFIDENCE_THRESHOLD.
+    """
+    regexed, needed = regex_tier(raw_text)
+    llm_fields = ocr.parse_receipt_fields(raw_text) if needed else {}
+    parsed = merge_tiers(regexed, needed, llm_fields)
+    parsed['text'] = raw_text
+    return parsed
+
+
+def regex_tier(raw_text: str):
+    """
+    Returns (regex fields, names of fields that need the LLM tier).
+    """
+    fields, confidence = parse_with_confidence(raw_text)
+    needed = [k for k in FIELDS if confidence[k] < CONFIDENCE_THRESHOLD]
+    tier_stats['receipts'] += 1
+    if not needed:
+        tier_stats['llm_calls_avoided'] += 1
+    return fields, needed
+
+
+def _converts(field: str, value) -> bool:
+    # Whether an LLM value fits its column (see apply_fields); the model
+    # may answer "24/04/2025" or "4,50" however it is asked
+    try:
+        if field == 'merchant':
+            return isinstance(value, str)
+        if field == 'date':
+            datetime.date.fromisoformat(value)
+            return True
+        return math.isfinite(float(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def merge_tiers(regexed: dict, needed: list, llm_fields: dict) -> dict:
+    """
+    Combine tier outputs. Low-confidence regex values are kept only when
+    the LLM has nothing better: an LLM value that does not convert to its
+    column type is ignored. ``sources`` records the tier of each field.
+    """
+    parsed = {}
+    sources = {}
+    for k in FIELDS:
+        if k in needed and llm_fields.get(k) and _converts(k, llm_fields[k]):
+            parsed[k], sources[k] = llm_fields[k], 'llm'
+        elif regexed.get(k):
+            parsed[k], sources[k] = regexed[k], 'regex'
+        else:
+            parsed[k] = None
+    parsed['sources'] = sources
+    return parsed
+
+
+def apply_fields(receipt, parsed: dict) -> None:
+    """
+    Copy parsed fields onto the receipt, converting to column types. The
+    OCR text, when present, is stored for search and later re-parsing.
+    """
+    if parsed.get('merchant'):
+        receipt.merchant = parsed['merchant']
+    if parsed.get('date'):
+        receipt.date = datetime.date.fromisoformat(parsed['date'])
+    if parsed.get('total'):
+        receipt.total = float(parsed['total'])
+    if parsed.get('sources') is not None:
+        receipt.field_sources = parsed['sources']
+    if parsed.get('text') is not None:
+        receipt.ocr_text = parsed['text']
+
+
+def process_receipt(receipt, file_path: str, logger=None, cache=None) -> bool:
+    """
+    Extract and apply fields for a receipt, recording the outcome in its status.
+    Results are served from / stored in ``cache`` keyed by ``receipt.sha256``.
+    Returns True on success. The caller is responsible for committing.
+    """
+    parsed = cache.lookup(receipt.sha256) if cache is not None else None
+    if parsed is not None:
+        return apply_result(receipt, parsed)
+    parsed, error, elapsed = _safe_extract(file_path)
+    if error is None and cache is not None:
+        cache.store(receipt.sha256, parsed, elapsed)
+    return apply_result(receipt, parsed, error, logger=logger)
+
+
+# The Receipt columns apply_result() sets
+RESULT_FIELDS = (
+    'merchant',
+    'date',
+    'total',
+    'field_sources',
+    'raw_text',
+    'status',
+    'error',
+)
+
+
+def result_values(receipt) -> dict:
+    """
+    The values apply_result() left on a receipt, for writers that store
+    them elsewhere than the receipt's own session.
+    """
+    return {name: getattr(receipt, name) for name in RESULT_FIELDS}
+
+
+def apply_result(receipt, parsed, error=None, logger=None) -> bool:
+    """
+    Record an extraction result (as returned by extract_many) on the receipt.
+    """
+    if error is None:
+        try:
+            apply_fields(receipt, parsed)
+        except Exception as e:
+            error = str(e)
+    if error is not None:
+        if logger:
+            logger.error(f"OCR parsing failed: {error}")
+        receipt.status = STATUS_FAILED
+        receipt.error = error
+        return False
+    receipt.status = STATUS_DONE
+    receipt.error = None
+    return True
+
+
+def _safe_extract(file_path: str):
+    start = time.perf_counter()
+    try:
+        parsed, error = extract_fields(file_path), None
+    except Exception as e:
+        parsed, error = None, str(e) or type(e).__name__
+    return parsed, error, time.perf_counter() - start
+
+
+def _safe_ocr(file_path: str):
+    # Runs in pool workers; errors travel back as strings since arbitrary
+    # exceptions may not pickle
+    start = time.perf_counter()
+    try:
+        text, error = ocr.ocr_extract(file_path), None
+    except Exception as e:
+        text, error = None, str(e) or type(e).__name__
+    return text, error, time.perf_counter() - start
+
+
+def _init_worker():
+    # The batch pool is already one process per CPU: each worker runs
+    # Tesseract itself rather than starting an OCR pool of its own
+    ocr._engine = ocr._fallback_engine
+
+
+def _get_executor(max_workers: int) -> ProcessPoolExecutor:
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            # Spawned, not forked: this process runs job workers, the
+            # group-commit flusher and pooled DB connections, and may own
+            # an OCR pool whose pipes a forked child would share
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+            _executor_workers = max_workers
+        return _executor
+
+
+def _discard_executor(executor) -> None:
+    # A pool with a dead worker is broken for good; the next batch starts
+    # a fresh one
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is executor:
+            _executor = _executor_workers = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _ocr_in_pool(file_paths, max_workers: int) -> list:
+    """
+    _safe_ocr over the process pool. Files whose worker process died (a
+    crash, an OOM kill) get an error; the others keep their results.
+    """
+    executor = _get_executor(max_workers)
+    try:
+        futures = [executor.submit(_safe_ocr, p) for p in file_paths]
+    except BrokenProcessPool:
+        # Broken since the last batch
+        _discard_executor(executor)
+        executor = _get_executor(max_workers)
+        futures = [executor.submit(_safe_ocr, p) for p in file_paths]
+    results = []
+    broken = False
+    for future in futures:
+        try:
+            results.append(future.result())
+        except BrokenProcessPool:
+            broken = True
+            results.append((None, 'OCR worker process died', 0.0))
+    if broken:
+        _discard_executor(executor)
+    return results
+
+
+def shutdown_executor() -> None:
+    """
+    Stop the batch process pool; the next batch starts a fresh one.
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = _executor_workers = None
+
+
+def extract_many(file_paths, max_workers: int = None) -> list:
+    """
+    Extract fields for many files. OCR fans out over a process pool sized to
+    the CPU count; the resulting texts are parsed together so the LLM sees
+    batched prompts. Returns (parsed, error, elapsed) tuples in input order;
+    a failure on one file does not affect the others.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    file_paths = list(file_paths)
+    if max_workers == 1 or len(file_paths) <= 1:
+        ocr_results = [_safe_ocr(p) for p in file_paths]
+    else:
+        ocr_results = _ocr_in_pool(file_paths, max_workers)
+
+    results = [(None, error, elapsed) for _, error, elapsed in ocr_results]
+    tiers = {
+        i: regex_tier(text)
+        for i, (text, error, _) in enumerate(ocr_results)
+        if error is None
+    }
+    # Only receipts with low-confidence fields go to the (batched) LLM
+    ask = [i for i, (_, needed) in tiers.items() if needed]
+    start = time.perf_counter()
+    try:
+        llm_many = (
+            ocr.parse_receipt_fields_many([ocr_results[i][0] for i in ask])
+            if ask
+            else []
+        )
+    except Exception as e:
+        # As with one receipt: without the LLM, the regex fields stand
+        logger.warning(f"LLM batch parse failed: {type(e).__name__}: {e}")
+        llm_many = [{}] * len(ask)
+    llm_share = (time.perf_counter() - start) / len(ask) if ask else 0.0
+    llm_fields = dict(zip(ask, llm_many))
+    for i, (regexed, needed) in tiers.items():
+        elapsed = ocr_results[i][2] + (llm_share if needed else 0.0)
+        parsed = merge_tiers(regexed, needed, llm_fields.get(i) or {})
+        parsed['text'] = ocr_results[i][0]
+        results[i] = (parsed, None, elapsed)
+    return results
@@ -0,0 +1,202 @@
+import datetime
+import os
+import struct
+import threading
+import time
+import sqlalchemy as sa
+from flask import current_app, has_app_context
+from app.cache import FileCache, LRUCache
+from app.models import Receipt
+
+# Namespace of listing pages; each receipt has its own, receipt_namespace()
+LISTINGS = 'receipts'
+
+
+def receipt_namespace(receipt_id: int) -> str:
+    return f'receipt:{receipt_id}'
+
+
+class CachedResponse:
+    """
+    A serialized JSON body with its validators. Stored as bytes: a header
+    line with the ETag and Last-Modified, then the body.
+    """
+
+    __slots__ = ('etag', 'last_modified', 'body')
+
+    def __init__(self, etag: str, last_modified, body: bytes):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+
+    def encode(self) -> bytes:
+        stamp = self.last_modified.isoformat() if self.last_modified else '-'
+        return f'{self.etag} {stamp}\n'.encode() + self.body
+
+    @classmethod
+    def decode(cls, data: bytes):
+        header, _, body = data.partition(b'\n')
+        etag, stamp = header.decode().split(' ')
+        return cls(
+            etag, None if stamp == '-' else datetime.datetime.fromisoformat(stamp), body
+        )
+
+
+class ReadCache:
+    """
+    Read-through cache of serialized receipt responses: single receipts and
+    listing pages. The backend is an LRUCache bounded by bytes (per process)
+    or a FileCache (shared by the processes of a host), both with a TTL.
+
+    Every namespace (a receipt, or all listing pages) has a random
+    generation token, and entries are stored under it. Invalidating a
+    namespace drops its token, which makes its old entries unreachable
+    until they age out; that works the same on a shared backend, which
+    cannot enumerate keys cheaply. Session commits that wrote receipts
+    invalidate the receipts they touched and all listing pages.
+
+    Responses read from a replica are not stored for ``replica_lag``
+    seconds after an invalidation: the replica may not have the write yet,
+    and the stale entry would outlive its lag by the TTL. A generation
+    token carries the wall-clock time it was created, which is never before
+    the invalidation that dropped its predecessor, so on a shared backend
+    every process sees the same window.
+    """
+
+    def __init__(self, backend, replica_lag: float = 0.0):
+        self.backend = backend
+        self.replica_lag = replica_lag
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        maxbytes, ttl = config.get('READ_CACHE_BYTES', 0), config.get('READ_CACHE_TTL')
+        lag = (
+            config.get('REPLICA_MAX_LAG', 0)
+            if config.get('DATABASE_REPLICA_URLS')
+            else 0.0
+        )
+        if config.get('READ_CACHE_BACKEND') == 'file' and maxbytes > 0:
+            return cls(FileCache(config['READ_CACHE_DIR'], maxbytes, ttl=ttl), lag)
+        return cls(LRUCache(maxbytes, ttl=ttl, sizeof=len), lag)
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend.maxsize > 0
+
+    def _generation(self, namespace: str) -> bytes:
+        key = ('generation', namespace)
+        token = self.backend.get(key)
+        if token is None:
+            token = os.urandom(8) + struct.pack('>d', time.time())
+            self.backend.set(key, token)
+        return token
+
+    def slot(self, namespace: str, key) -> tuple:
+        """
+        The backend key for ``key`` under the namespace's current
+        generation. Take it before reading the database: an entry built from
+        rows that a concurrent commit then changes lands under a generation
+        that the commit has already dropped.
+        """
+        return namespace, self._generation(namespace), key
+
+    def get(self, slot):
+        data = self.backend.get(slot)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return CachedResponse.decode(data)
+
+    def set(self, slot, cached: CachedResponse, replica: bool = False) -> None:
+        if (
+            replica
+            and time.time() - struct.unpack('>d', slot[1][8:])[0] < self.replica_lag
+        ):
+            return
+        self.backend.set(slot, cached.encode())
+
+    def invalidate(self, receipt_ids=(), everything: bool = False) -> None:
+        """
+        Forget all listing pages and the given receipts, or with
+        ``everything`` every cached response.
+        """
+        if everything:
+            self.backend.clear()
+        else:
+            for namespace in [LISTINGS, *map(receipt_namespace, receipt_ids)]:
+                self.backend.pop(('generation', namespace))
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        backend = self.backend.stats()
+        return {
+            'backend': 'file' if isinstance(self.backend, FileCache) else 'memory',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'entries': backend['size'],
+            'bytes': backend['bytes'],
+            'maxbytes': backend['maxsize'],
+            'evictions': backend['evictions'],
+            'expirations': backend['expirations'],
+        }
+
+
+def invalidate_receipts(receipt_ids=(), everything: bool = False) -> None:
+    """
+    Forget cached responses for the given receipts and all listing pages
+    (or all of them). Commits through the session do this themselves;
+    writers that go around it, on a Core connection, call it after
+    committing.
+    """
+    cache = current_app.extensions.get('read_cache')
+    if cache is not None:
+        cache.invalidate(receipt_ids, everything)
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_flush')
+def _note_written_receipts(session, flush_context):
+    ids = {
+        obj.id
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, Receipt)
+    }
+    if ids:
+        session.info.setdefault('read_cache_receipts', set()).update(ids)
+
+
+@sa.event.listens_for(sa.orm.Session, 'do_orm_execute')
+def _note_bulk_receipt_writes(state):
+    # session.execute(insert/update/delete(Receipt)) skips the flush. New
+    # rows only change listings; other statements may touch any receipt.
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    if state.statement.table.name == Receipt.__tablename__:
+        if state.is_insert:
+            state.session.info['read_cache_listings'] = True
+        else:
+            state.session.info['read_cache_everything'] = True
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_commit')
+def _invalidate_read_cache(session):
+    ids = session.info.pop('read_cache_receipts', None)
+    listings = session.info.pop('read_cache_listings', False)
+    everything = session.info.pop('read_cache_everything', False)
+    if (ids or listings or everything) and has_app_context():
+        invalidate_receipts(ids or (), everything)
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_rollback')
+def _forget_written_receipts(session):
+    for key in ('read_cache_receipts', 'read_cache_listings', 'read_cache_everything'):
+        session.info.pop(key, None)
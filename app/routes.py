@@ -1,29 +1,130 @@
+import contextlib
+import io
 import os
-from flask import Blueprint, request, jsonify, current_app
-from werkzeug.utils import secure_filename
+import hashlib
+import tempfile
+from flask import Blueprint, abort, request, jsonify, current_app, send_file, url_for
+from werkzeug.http import is_resource_modified
 from app import db
-from app.models import Receipt
+from app.models import (
+    Receipt,
+    ReceiptTag,
+    Tag,
+    STATUS_QUEUED,
+    STATUS_PROCESSING,
+    STATUS_DONE,
+    split_tags,
+)
 from app.schemas import ReceiptSchema
+from app.serializers import receipt_serializer
 import datetime
 import re
 from marshmallow import fields  # <-- Ensure fields is imported for schema use
-from app.ocr import ocr_extract, parse_receipt_fields
-from app.parser import parse_with_regex
+from sqlalchemy import func
+from app.pipeline import (
+    process_receipt,
+    apply_result,
+    extract_many,
+    result_values,
+    tier_stats,
+)
+from app import analytics, export, images, importer, llm, ocr, search
+from app.pagination import InvalidCursor, keyset_page, estimate_count
+from app.read_cache import LISTINGS, CachedResponse, receipt_namespace
+from app.database import pool_stats, reading_replica
+from app.storage import content_key, get_storage, receipt_file
 
 # Blueprints
 upload_bp = Blueprint('upload', __name__)
 receipts_bp = Blueprint('receipts', __name__)
+jobs_bp = Blueprint('jobs', __name__)
+metrics_bp = Blueprint('metrics', __name__)
+analytics_bp = Blueprint('analytics', __name__)
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
+DEDUPE_POLICIES = ('reject', 'link', 'allow')
+CHUNK_SIZE = 64 * 1024
+MAX_PER_PAGE = 100
+# ?sort= values; a leading '-' means descending
+SORT_COLUMNS = {
+    'created_at': Receipt.created_at,
+    'date': Receipt.date,
+    'total': Receipt.total,
+}
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+
+def _save_upload(file):
+    """
+    Stream an upload to a temp file in UPLOAD_FOLDER, hashing it on the way.
+    Returns (filename, temp_path, sha256); _finish_upload moves it into
+    storage. The filename is only kept as the receipt's metadata.
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    os.makedirs(upload_folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, prefix='.upload-')
+    with os.fdopen(fd, 'wb') as out:
+        for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    return _original_name(file.filename), tmp_path, digest.hexdigest()
+
+
+def _original_name(filename):
+    # Browsers on Windows may send the full path
+    return filename.replace('\\', '/').rsplit('/', 1)[-1][:256]
+
+
+def _finish_upload(filename, tmp_path, digest):
+    """
+    Move a saved upload into storage under its content key and return the
+    key. Identical bytes are stored once.
+    """
+    key = content_key(digest, filename)
+    get_storage().put(key, tmp_path)
+    return key
+
+
+def _dedupe_policy():
+    policy = request.args.get('dedupe', request.form.get('dedupe'))
+    return policy or current_app.config.get('DEDUPE_POLICY', 'allow')
+
+
+def _find_duplicate(digest, policy):
+    if policy == 'allow':
+        return None
+    return Receipt.query.filter_by(sha256=digest).order_by(Receipt.id).first()
+
+
+def _duplicate_result(filename, existing, policy, schema) -> dict:
+    # A batch file answered with an earlier receipt of the same bytes
+    if policy == 'reject':
+        return {
+            'filename': filename,
+            'status': 'duplicate',
+            'error': 'Duplicate receipt',
+            'id': existing.id,
+        }
+    return {'filename': filename, 'status': 'linked', 'receipt': schema.dump(existing)}
+
+
+def _wants_async():
+    flag = request.args.get('async', request.form.get('async'))
+    if flag is None:
+        return current_app.config.get('ASYNC_UPLOADS', False)
+    return flag.lower() in ('1', 'true', 'yes')
+
+
 @upload_bp.route('/upload', methods=['POST'])
 def upload_receipt():
     """
     Upload a receipt image and extract fields using OCR and LLM.
+    In async mode the receipt is queued for background OCR and a job is returned.
     ---
     tags:
       - Receipts
@@ -45,6 +146,19 @@ def upload_receipt():
         type: string
         required: false
         description: Optional comma-separated tags
+      - name: dedupe
+        in: query
+        type: string
+        enum: [reject, link, allow]
+        required: false
+        description: What to do when identical bytes were already uploaded
+          (defaults to the DEDUPE_POLICY setting)
+      - name: async
+        in: query
+        type: boolean
+        required: false
+        description: Queue OCR in the background and return 202
+          (defaults to the ASYNC_UPLOADS setting)
     responses:
       201:
         description: Receipt created and parsed successfully
@@ -60,6 +174,19 @@ def upload_receipt():
             notes: "Morning coffee"
             tags: ["coffee", "breakfast"]
             created_at: "2025-04-24T09:00:00"
+      200:
+        description: Duplicate upload linked to the existing receipt (dedupe=link)
+        schema:
+          $ref: '#/definitions/Receipt'
+      202:
+        description: Receipt stored and queued for OCR (async mode)
+        schema:
+          $ref: '#/definitions/Job'
+        examples:
+          application/json:
+            id: 1
+            status: "queued"
+            status_url: "/jobs/1"
       400:
         description: Invalid input or file
         schema:
@@ -70,6 +197,19 @@ def upload_receipt():
         examples:
           application/json:
             error: "No file part"
+      409:
+        description: Duplicate upload rejected (dedupe=reject)
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+            id:
+              type: integer
+        examples:
+          application/json:
+            error: "Duplicate receipt"
+            id: 1
     x-marshmallow-schema: ReceiptSchema
     security:
       - {}
@@ -79,47 +219,332 @@ def upload_receipt():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
+    policy = _dedupe_policy()
+    if policy not in DEDUPE_POLICIES:
+        return jsonify({'error': f'Invalid dedupe policy: {policy}'}), 400
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_folder, exist_ok=True)
-        file_path = os.path.join(upload_folder, filename)
-        file.save(file_path)
-        # Parse optional notes/tags from form
+        filename, tmp_path, digest = _save_upload(file)
+        existing = _find_duplicate(digest, policy)
+        if existing is not None:
+            os.remove(tmp_path)
+            if policy == 'reject':
+                return jsonify({'error': 'Duplicate receipt', 'id': existing.id}), 409
+            return ReceiptSchema().jsonify(existing), 200
+        storage_key = _finish_upload(filename, tmp_path, digest)
+        # Optional notes/tags from the form; tags are comma-separated and
+        # linked to the tags table when the receipt is flushed
         notes = request.form.get('notes')
-        tags_raw = request.form.get('tags')
-        tags = None
-        if tags_raw:
-            # Accept comma-separated only (do not split on spaces)
-            tags = ','.join([t.strip() for t in tags_raw.split(',') if t.strip()])
+        tags = request.form.get('tags') or None
+        values = {
+            'filename': filename,
+            'notes': notes,
+            'tags': tags,
+            'sha256': digest,
+            'storage_key': storage_key,
+        }
+        writer = current_app.extensions['group_commit']
+        if writer.enabled:
+            return _upload_grouped(writer, values)
+        if _wants_async():
+            # Store the row as a queued job and let the worker pool run OCR
+            receipt = Receipt(**values, status=STATUS_QUEUED)
+            db.session.add(receipt)
+            db.session.commit()
+            current_app.extensions['job_queue'].submit(receipt.id)
+            body, status_url = _job_payload(receipt)
+            return jsonify(body), 202, {'Location': status_url}
         # Create DB record and parse fields
-        receipt = Receipt(filename=filename, notes=notes, tags=tags)
+        receipt = Receipt(**values, status=STATUS_PROCESSING)
         db.session.add(receipt)
         db.session.commit()
-        try:
-            raw_text = ocr_extract(file_path)
-            parsed = parse_receipt_fields(raw_text)
-            # Fallback regex parsing for missing fields
-            if not all([parsed.get('merchant'), parsed.get('date'), parsed.get('total')]):
-                regexed = parse_with_regex(raw_text)
-                parsed = {k: parsed.get(k) or regexed.get(k) for k in ['merchant', 'date', 'total']}
-            if parsed.get('merchant'):
-                receipt.merchant = parsed['merchant']
-            if parsed.get('date'):
-                receipt.date = datetime.date.fromisoformat(parsed['date'])
-            if parsed.get('total'):
-                receipt.total = float(parsed['total'])
-            db.session.commit()
-        except Exception as e:
-            current_app.logger.error(f"OCR parsing failed: {e}")
+        with receipt_file(receipt) as file_path:
+            process_receipt(
+                receipt,
+                file_path,
+                logger=current_app.logger,
+                cache=current_app.extensions['ocr_cache'],
+            )
+        db.session.commit()
         schema = ReceiptSchema()
         return schema.jsonify(receipt), 201
     return jsonify({'error': 'File type not allowed'}), 400
 
+
+def _upload_grouped(writer, values):
+    """
+    upload_receipt() with both of its writes, the new row and the parse
+    result, going through the group-commit writer. The receipt is parsed
+    as a transient object; the stored row is read back for the response.
+    """
+    if _wants_async():
+        receipt = Receipt(**values, status=STATUS_QUEUED)
+        receipt.id = writer.insert(**values, status=STATUS_QUEUED)
+        current_app.extensions['job_queue'].submit(receipt.id)
+        body, status_url = _job_payload(receipt)
+        return jsonify(body), 202, {'Location': status_url}
+    receipt = Receipt(**values, status=STATUS_PROCESSING)
+    receipt_id = writer.insert(**values, status=STATUS_PROCESSING)
+    with receipt_file(receipt) as file_path:
+        process_receipt(
+            receipt,
+            file_path,
+            logger=current_app.logger,
+            cache=current_app.extensions['ocr_cache'],
+        )
+    writer.update(receipt_id, **result_values(receipt))
+    return ReceiptSchema().jsonify(db.session.get(Receipt, receipt_id)), 201
+
+
+@upload_bp.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """
+    Upload many receipt images in one request.
+    OCR and parsing fan out over a process pool; all receipts are inserted in one
+    transaction.
+    ---
+    tags:
+      - Receipts
+    consumes:
+      - multipart/form-data
+    parameters:
+      - name: files
+        in: formData
+        type: file
+        required: true
+        description: Receipt image files (repeat the field for each file)
+      - name: notes
+        in: formData
+        type: string
+        required: false
+        description: Optional notes applied to every receipt
+      - name: tags
+        in: formData
+        type: string
+        required: false
+        description: Optional comma-separated tags applied to every receipt
+      - name: dedupe
+        in: query
+        type: string
+        enum: [reject, link, allow]
+        required: false
+        description: Duplicate policy applied to each file
+    definitions:
+      BatchResult:
+        type: object
+        properties:
+          filename:
+            type: string
+          status:
+            type: string
+            enum: [done, failed, rejected, duplicate, linked]
+          error:
+            type: string
+          receipt:
+            $ref: '#/definitions/Receipt'
+    responses:
+      201:
+        description: All files were stored and parsed
+        schema:
+          type: object
+          properties:
+            results:
+              type: array
+              items:
+                $ref: '#/definitions/BatchResult'
+            succeeded:
+              type: integer
+            failed:
+              type: integer
+      207:
+        description: Some files were rejected or failed OCR; see per-file results
+        examples:
+          application/json:
+            results:
+              - filename: "a.jpg"
+                status: "done"
+                receipt:
+                  id: 1
+                  filename: "a.jpg"
+                  merchant: "Starbucks"
+              - filename: "notes.txt"
+                status: "rejected"
+                error: "File type not allowed"
+            succeeded: 1
+            failed: 1
+      400:
+        description: No files or too many files
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+        examples:
+          application/json:
+            error: "No file part"
+    security:
+      - {}
+    """
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({'error': 'No file part'}), 400
+    max_files = current_app.config.get('MAX_BATCH_FILES', 200)
+    if len(files) > max_files:
+        return jsonify({'error': f'Too many files (max {max_files})'}), 400
+    policy = _dedupe_policy()
+    if policy not in DEDUPE_POLICIES:
+        return jsonify({'error': f'Invalid dedupe policy: {policy}'}), 400
+    notes = request.form.get('notes')
+    tags = request.form.get('tags') or None
+    cache = current_app.extensions['ocr_cache']
+    schema = ReceiptSchema()
+
+    results = [None] * len(files)
+    receipts = []
+    # Files to OCR by hash, each with its local path (held until extraction
+    # is done) and the receipts of every copy in the batch
+    pending = {}
+    # The receipt for each file's first copy in the batch, and the later
+    # copies the policy turns away, answered once that receipt has an id
+    first = {}
+    turned_away = []
+    files_open = contextlib.ExitStack()
+    for i, file in enumerate(files):
+        if not allowed_file(file.filename):
+            results[i] = {
+                'filename': file.filename,
+                'status': 'rejected',
+                'error': 'File type not allowed',
+            }
+            continue
+        filename, tmp_path, digest = _save_upload(file)
+        if policy != 'allow' and digest in first:
+            os.remove(tmp_path)
+            turned_away.append((i, filename, first[digest]))
+            continue
+        existing = _find_duplicate(digest, policy)
+        if existing is not None:
+            os.remove(tmp_path)
+            results[i] = _duplicate_result(filename, existing, policy, schema)
+            continue
+        storage_key = _finish_upload(filename, tmp_path, digest)
+        receipt = Receipt(
+            filename=filename,
+            notes=notes,
+            tags=tags,
+            sha256=digest,
+            storage_key=storage_key,
+        )
+        receipts.append((i, receipt))
+        first.setdefault(digest, receipt)
+        parsed = cache.lookup(digest)
+        if parsed is not None:
+            apply_result(receipt, parsed)
+        elif digest in pending:
+            pending[digest][1].append(receipt)
+        else:
+            pending[digest] = (
+                files_open.enter_context(receipt_file(receipt)),
+                [receipt],
+            )
+
+    try:
+        extracted = extract_many(
+            [path for path, _ in pending.values()],
+            current_app.config.get('BATCH_WORKERS'),
+        )
+    finally:
+        files_open.close()
+    for (digest, (_, copies)), (parsed, error, elapsed) in zip(
+        pending.items(), extracted
+    ):
+        if error is None:
+            cache.store(digest, parsed, elapsed)
+        for receipt in copies:
+            apply_result(receipt, parsed, error, logger=current_app.logger)
+    db.session.add_all([r for _, r in receipts])
+    db.session.commit()
+
+    for i, receipt in receipts:
+        results[i] = {
+            'filename': receipt.filename,
+            'status': receipt.status,
+            'receipt': schema.dump(receipt),
+        }
+        if receipt.error:
+            results[i]['error'] = receipt.error
+    for i, filename, receipt in turned_away:
+        results[i] = _duplicate_result(filename, receipt, policy, schema)
+    failed = sum(1 for r in results if r['status'] not in (STATUS_DONE, 'linked'))
+    body = {'results': results, 'succeeded': len(results) - failed, 'failed': failed}
+    return jsonify(body), 207 if failed else 201
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    # Smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _filtered_receipts(args):
+    """
+    Receipt query with the filters from GET /receipts applied. Every filter
+    is written as an equality or range on an indexed column or expression
+    so the planner can use an index. Raises ValueError for bad parameters.
+    """
+    q = Receipt.query
+    merchant = func.lower(Receipt.merchant)
+    if args.get('merchant'):
+        q = q.filter(merchant == args['merchant'].lower())
+    if args.get('merchant_prefix'):
+        prefix = args['merchant_prefix'].lower()
+        # A range rather than LIKE 'x%', which SQLite and non-C Postgres
+        # collations cannot serve from an index
+        q = q.filter(merchant >= prefix, merchant < _prefix_upper_bound(prefix))
+    for name, op in (('date_from', '__ge__'), ('date_to', '__le__')):
+        if args.get(name):
+            try:
+                value = datetime.date.fromisoformat(args[name])
+            except ValueError:
+                raise ValueError(f'{name} must be YYYY-MM-DD')
+            q = q.filter(getattr(Receipt.date, op)(value))
+    for name, op in (('min_total', '__ge__'), ('max_total', '__le__')):
+        if args.get(name):
+            try:
+                value = float(args[name])
+            except ValueError:
+                raise ValueError(f'{name} must be a number')
+            q = q.filter(getattr(Receipt.total, op)(value))
+    # One lookup per tag on the unique tag name and the (tag_id, receipt_id) index
+    for tag in split_tags(args.getlist('tag')):
+        tagged = (
+            db.select(ReceiptTag.receipt_id)
+            .join(Tag, Tag.id == ReceiptTag.tag_id)
+            .where(Tag.name == tag)
+        )
+        q = q.filter(Receipt.id.in_(tagged))
+    return q
+
+
+def _sort_order(args):
+    sort = args.get('sort', '-created_at')
+    descending = sort.startswith('-')
+    column = SORT_COLUMNS.get(sort.lstrip('-'))
+    if column is None:
+        raise ValueError(
+            f"sort must be one of {', '.join(SORT_COLUMNS)} (prefix '-' for descending)"
+        )
+    return column, descending
+
+
 @receipts_bp.route('/receipts', methods=['GET'])
 def list_receipts():
     """
     List all receipts with pagination.
+    Pass `cursor` (empty for the first page) to use keyset pagination: each
+    response carries an opaque `next_cursor` for the following page, and
+    deep pages cost the same as the first. Offset pagination (`page`)
+    counts every row on each request.
+    Responses carry an ETag; sending it back in If-None-Match returns 304
+    while the page is unchanged.
     ---
     tags:
       - Receipts
@@ -129,13 +554,77 @@ def list_receipts():
         type: integer
         required: false
         default: 1
-        description: Page number
+        description: Page number (offset mode)
       - name: per_page
         in: query
         type: integer
         required: false
         default: 10
         description: Items per page
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: next_cursor from the previous page; empty for the first page
+          (cursor mode)
+      - name: count
+        in: query
+        type: string
+        enum: [exact, estimate]
+        required: false
+        description: Include a total in cursor mode; estimate uses planner statistics
+          (exact when filtered)
+      - name: merchant
+        in: query
+        type: string
+        required: false
+        description: Merchant name, case-insensitive exact match
+      - name: merchant_prefix
+        in: query
+        type: string
+        required: false
+        description: Merchant name prefix, case-insensitive
+      - name: date_from
+        in: query
+        type: string
+        format: date
+        required: false
+        description: Earliest receipt date (inclusive)
+      - name: date_to
+        in: query
+        type: string
+        format: date
+        required: false
+        description: Latest receipt date (inclusive)
+      - name: min_total
+        in: query
+        type: number
+        required: false
+      - name: max_total
+        in: query
+        type: number
+        required: false
+      - name: tag
+        in: query
+        type: array
+        items:
+          type: string
+        collectionFormat: multi
+        required: false
+        description: Only receipts carrying this tag; repeat to require several
+      - name: sort
+        in: query
+        type: string
+        enum: [created_at, -created_at, date, -date, total, -total]
+        default: -created_at
+        required: false
+        description: Sort key, '-' for descending. Sorting by date or total skips
+          receipts without one.
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma-separated fields to return, e.g. id,total,date (default all)
     responses:
       200:
         description: Paginated list of receipts
@@ -154,6 +643,8 @@ def list_receipts():
               type: integer
             per_page:
               type: integer
+            next_cursor:
+              type: string
         examples:
           application/json:
             receipts:
@@ -169,6 +660,9 @@ def list_receipts():
             page: 1
             pages: 1
             per_page: 10
+      304:
+        description: The page is unchanged since the response whose ETag was sent in
+          If-None-Match
       400:
         description: Invalid pagination parameters
         schema:
@@ -183,24 +677,474 @@ def list_receipts():
     security:
       - {}
     """
+    try:
+        serializer = receipt_serializer(request.args.get('fields'))
+        q = _filtered_receipts(request.args)
+        column, descending = _sort_order(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    cache = current_app.extensions['read_cache']
+    slot = cache.slot(LISTINGS, tuple(sorted(request.args.items(multi=True))))
+    cached = cache.get(slot)
+    if cached is not None:
+        return _cached_response(cached, if_modified_since=False)
+    if column is not Receipt.created_at:
+        # NULLs sort differently per database and cannot be seeked past
+        q = q.filter(column.isnot(None))
+    # Rows of just the needed columns; the cursor needs the sort key and id,
+    # the validators need updated_at
+    q = serializer.select(q, Receipt.id, column, Receipt.updated_at)
+    if 'cursor' in request.args:
+        return _list_receipts_keyset(serializer, q, column, descending, slot)
     # Pagination params
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 10))
-    q = Receipt.query.order_by(Receipt.created_at.desc())
+    if descending:
+        q = q.order_by(column.desc(), Receipt.id.desc())
+    else:
+        q = q.order_by(column.asc(), Receipt.id.asc())
     paginated = q.paginate(page=page, per_page=per_page, error_out=False)
-    schema = ReceiptSchema(many=True)
-    return jsonify({
-        'receipts': schema.dump(paginated.items),
-        'total': paginated.total,
-        'page': paginated.page,
-        'pages': paginated.pages,
-        'per_page': paginated.per_page
-    })
+    return _page_response(
+        serializer,
+        paginated.items,
+        {
+            'total': paginated.total,
+            'page': paginated.page,
+            'pages': paginated.pages,
+            'per_page': paginated.per_page,
+        },
+        slot,
+    )
+
+
+def _list_receipts_keyset(serializer, q, column, descending, slot):
+    per_page = request.args.get('per_page', 10, type=int)
+    count = request.args.get('count')
+    if not per_page or per_page < 1 or count not in (None, 'exact', 'estimate'):
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    per_page = min(per_page, MAX_PER_PAGE)
+    try:
+        items, next_cursor = keyset_page(
+            q, column, Receipt.id, per_page, request.args['cursor'], descending
+        )
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    body = {'per_page': per_page, 'next_cursor': next_cursor}
+    if count == 'exact':
+        body['total'] = q.order_by(None).count()
+    elif count == 'estimate':
+        # Planner statistics describe the whole table, so a filtered
+        # listing is counted exactly
+        estimate = q.whereclause is None
+        body['total'] = (
+            estimate_count(Receipt) if estimate else q.order_by(None).count()
+        )
+        body['total_is_estimate'] = estimate
+    return _page_response(serializer, items, body, slot)
+
+
+def _page_response(serializer, rows, body, slot):
+    """
+    The listing response for a page of rows, or a 304 when the client
+    already has it. A page's body is fixed by the query string, the ids and
+    updated_at of its rows and the rest of ``body``, so the ETag is a
+    digest of those. The serialized page goes into the read cache at
+    ``slot``; without the cache a matching request skips the tags query
+    and serialization.
+    """
+    etag = _etag(
+        sorted(request.args.items(multi=True)),
+        serializer.fields,
+        [(row.id, row.updated_at) for row in rows],
+        sorted(body.items()),
+    )
+    last_modified = max(
+        (row.updated_at for row in rows if row.updated_at is not None), default=None
+    )
+    # Only the ETag is checked: the newest updated_at on the page does not
+    # move when a receipt is deleted from it
+    cache = current_app.extensions['read_cache']
+    not_modified = (
+        None
+        if cache.enabled
+        else _not_modified(etag, last_modified, if_modified_since=False)
+    )
+    if not_modified is not None:
+        return not_modified
+    body['receipts'] = serializer.dump(rows)
+    cached = CachedResponse(etag, last_modified, jsonify(body).get_data())
+    cache.set(slot, cached, replica=reading_replica(db.session))
+    return _cached_response(cached, if_modified_since=False)
+
+
+def _etag(*parts) -> str:
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Caches may keep the body but must revalidate it on every use
+    response.cache_control.no_cache = True
+    return response
+
+
+def _not_modified(etag, last_modified, if_modified_since=True):
+    """
+    An empty 304 when the request's If-None-Match (or, without one and if
+    ``if_modified_since``, If-Modified-Since) still matches; None when the
+    body has to be sent.
+    """
+    checked = last_modified if if_modified_since else None
+    if is_resource_modified(request.environ, etag=etag, last_modified=checked):
+        return None
+    return _set_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def _cached_response(cached, if_modified_since=True):
+    not_modified = _not_modified(cached.etag, cached.last_modified, if_modified_since)
+    if not_modified is not None:
+        return not_modified
+    response = current_app.response_class(cached.body, mimetype='application/json')
+    return _set_validators(response, cached.etag, cached.last_modified)
+
+
+@receipts_bp.route('/receipts/export', methods=['GET'])
+def export_receipts():
+    """
+    Export every receipt matching the listing filters as CSV or NDJSON.
+    Rows are streamed from a single query as they are read, so any number
+    of receipts can be exported in constant memory, and the export is a
+    consistent snapshot even while receipts are being written. The output
+    is gzipped on the fly when the client accepts gzip.
+    ---
+    tags:
+      - Receipts
+    produces:
+      - text/csv
+      - application/x-ndjson
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [csv, ndjson]
+        default: csv
+        required: false
+      - name: merchant
+        in: query
+        type: string
+        required: false
+        description: Merchant name, case-insensitive exact match
+      - name: merchant_prefix
+        in: query
+        type: string
+        required: false
+        description: Merchant name prefix, case-insensitive
+      - name: date_from
+        in: query
+        type: string
+        format: date
+        required: false
+      - name: date_to
+        in: query
+        type: string
+        format: date
+        required: false
+      - name: min_total
+        in: query
+        type: number
+        required: false
+      - name: max_total
+        in: query
+        type: number
+        required: false
+      - name: tag
+        in: query
+        type: array
+        items:
+          type: string
+        collectionFormat: multi
+        required: false
+      - name: sort
+        in: query
+        type: string
+        enum: [created_at, -created_at, date, -date, total, -total]
+        default: -created_at
+        required: false
+        description: As for GET /receipts; sorting by date or total skips receipts
+          without one
+    responses:
+      200:
+        description: >
+          One row per receipt with the fields id, filename, merchant, date,
+          total, notes, tags, status and created_at. CSV has a header row and
+          comma-separated tags; NDJSON has one JSON object per line.
+        examples:
+          text/csv: |
+            id,filename,merchant,date,total,notes,tags,status,created_at
+            1,r1.jpg,Starbucks,2025-04-24,4.99,Latte,"coffee,food",done,2025-04-24T09:00:00
+      400:
+        description: Invalid format or filter
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+    security:
+      - {}
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.MIMETYPES:
+        return (
+            jsonify({'error': f"format must be one of {', '.join(export.MIMETYPES)}"}),
+            400,
+        )
+    try:
+        q = _filtered_receipts(request.args)
+        column, descending = _sort_order(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if column is not Receipt.created_at:
+        q = q.filter(column.isnot(None))
+    compress = request.accept_encodings['gzip'] > 0
+    headers = {
+        'Content-Disposition': f'attachment; filename=receipts.{fmt}',
+        'Vary': 'Accept-Encoding',
+    }
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    # The generator outlives the request context, so it gets the engine
+    # the request reads from (a replica, for most) rather than its session
+    chunks = export.stream(
+        db.session.get_bind(),
+        export.export_statement(q, column, descending),
+        fmt,
+        compress,
+    )
+    return current_app.response_class(
+        chunks, mimetype=export.MIMETYPES[fmt], headers=headers
+    )
+
+
+@receipts_bp.route('/receipts/import', methods=['POST'])
+def import_receipts():
+    """
+    Import receipts in bulk from CSV or NDJSON, e.g. a customer's already
+    digitized history. The body is read as a stream and validated and
+    written in chunks with set-based inserts, each chunk in its own
+    transaction, so memory stays flat however many rows are sent. Invalid
+    rows are skipped and reported by line. Rows carrying an import_key that
+    is already stored are counted as duplicates, so a failed import can
+    simply be sent again.
+    ---
+    tags:
+      - Receipts
+    consumes:
+      - text/csv
+      - application/x-ndjson
+      - multipart/form-data
+    parameters:
+      - name: body
+        in: body
+        required: false
+        description: >
+          CSV with a header row, or one JSON object per line, with any of the
+          fields import_key (at most 64 characters), filename, merchant, date
+          (YYYY-MM-DD), total, notes and tags (a list, or comma-separated).
+          Other fields, such as those of an export, are ignored.
+        schema:
+          type: string
+      - name: file
+        in: formData
+        type: file
+        required: false
+        description: The same input as a file upload (.csv, .ndjson or .jsonl)
+      - name: format
+        in: query
+        type: string
+        enum: [csv, ndjson]
+        required: false
+        description: Defaults to the Content-Type, or the uploaded file's extension
+    definitions:
+      ImportReport:
+        type: object
+        properties:
+          imported:
+            type: integer
+          duplicates:
+            type: integer
+            description: Rows whose import_key was already stored or repeated
+          failed:
+            type: integer
+          errors:
+            type: array
+            description: The first row errors, by input line
+            items:
+              type: object
+              properties:
+                line:
+                  type: integer
+                error:
+                  type: string
+          errors_truncated:
+            type: boolean
+    responses:
+      201:
+        description: Every row was imported or was a duplicate
+        schema:
+          $ref: '#/definitions/ImportReport'
+      207:
+        description: Some rows failed validation; the rest were imported
+        examples:
+          application/json:
+            imported: 9998
+            duplicates: 0
+            failed: 2
+            errors:
+              - line: 17
+                error: "date must be YYYY-MM-DD"
+              - line: 4032
+                error: "total must be a number"
+            errors_truncated: false
+      400:
+        description: Unknown format, no file part, or a CSV header without any of
+          the fields
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+    security:
+      - {}
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'error': 'No file part'}), 400
+        stream, implied = upload.stream, importer.format_for(upload.filename)
+    else:
+        inverse = {mimetype: fmt for fmt, mimetype in export.MIMETYPES.items()}
+        # The WSGI input is unbuffered: reading it a line at a time would
+        # read a byte per call
+        stream, implied = io.BufferedReader(request.stream, 1 << 16), inverse.get(
+            request.mimetype
+        )
+    fmt = request.args.get('format') or implied
+    try:
+        report = importer.import_receipts(stream, fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(report.to_dict()), 207 if report.failed else 201
+
+
+@receipts_bp.route('/receipts/search', methods=['GET'])
+def search_receipts():
+    """
+    Full-text search over the stored OCR text of receipts.
+    Every word of `q` must appear. Results are ranked by relevance and
+    paginated with `next_cursor`; each carries a snippet of the matching
+    text with the offsets of the matched words.
+    ---
+    tags:
+      - Receipts
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: Words to look for, e.g. an item or shop name
+      - name: per_page
+        in: query
+        type: integer
+        required: false
+        default: 10
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: next_cursor from the previous page
+    responses:
+      200:
+        description: Matching receipts, best first
+        schema:
+          type: object
+          properties:
+            results:
+              type: array
+              items:
+                type: object
+                properties:
+                  receipt:
+                    $ref: '#/definitions/Receipt'
+                  score:
+                    type: number
+                  snippet:
+                    type: string
+                  highlights:
+                    type: array
+                    items:
+                      type: array
+                      items:
+                        type: integer
+            per_page:
+              type: integer
+            next_cursor:
+              type: string
+        examples:
+          application/json:
+            results:
+              - receipt:
+                  id: 7
+                  merchant: "Mega Mart"
+                  total: 12.34
+                score: 2.71
+                snippet: "… Oat milk 2.34 Bread 1.99 …"
+                highlights: [[6, 10]]
+            per_page: 10
+            next_cursor: null
+      400:
+        description: Missing query or invalid pagination parameters
+      501:
+        description: The database has no full-text search support
+    security:
+      - {}
+    """
+    per_page = request.args.get('per_page', 10, type=int)
+    if not per_page or per_page < 1:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    per_page = min(per_page, MAX_PER_PAGE)
+    query = request.args.get('q', '')
+    try:
+        found, next_cursor = search.search(query, per_page, request.args.get('cursor'))
+    except ValueError as e:  # includes InvalidCursor
+        return jsonify({'error': str(e)}), 400
+    except search.SearchUnavailable as e:
+        return jsonify({'error': str(e)}), 501
+    schema = ReceiptSchema()
+    words = search.terms(query)
+    results = []
+    for receipt, score in found:
+        text, highlights = search.snippet(receipt.ocr_text, words)
+        results.append(
+            {
+                'receipt': schema.dump(receipt),
+                'score': score,
+                'snippet': text,
+                'highlights': highlights,
+            }
+        )
+    return jsonify(
+        {'results': results, 'per_page': per_page, 'next_cursor': next_cursor}
+    )
+
 
 @receipts_bp.route('/receipts/<int:receipt_id>', methods=['GET'])
 def get_receipt(receipt_id):
     """
     Get details of a specific receipt by ID.
+    Responses carry an ETag and Last-Modified (from updated_at); a request
+    whose If-None-Match or If-Modified-Since still matches gets a 304.
     ---
     tags:
       - Receipts
@@ -210,6 +1154,11 @@ def get_receipt(receipt_id):
         type: integer
         required: true
         description: ID of the receipt
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma-separated fields to return, e.g. id,total,date (default all)
     responses:
       200:
         description: Receipt details
@@ -225,6 +1174,15 @@ def get_receipt(receipt_id):
             notes: "Morning coffee"
             tags: ["coffee", "breakfast"]
             created_at: "2025-04-24T09:00:00"
+      304:
+        description: The receipt is unchanged (If-None-Match or If-Modified-Since)
+      400:
+        description: Unknown field in fields
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
       404:
         description: Receipt not found
         schema:
@@ -239,6 +1197,664 @@ def get_receipt(receipt_id):
     security:
       - {}
     """
-    receipt = Receipt.query.get_or_404(receipt_id)
-    schema = ReceiptSchema()
-    return schema.jsonify(receipt), 200
+    try:
+        serializer = receipt_serializer(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    cache = current_app.extensions['read_cache']
+    slot = cache.slot(receipt_namespace(receipt_id), serializer.fields)
+    cached = cache.get(slot)
+    if cached is not None:
+        return _cached_response(cached)
+    row = serializer.select(
+        Receipt.query.filter(Receipt.id == receipt_id), Receipt.updated_at
+    ).first_or_404()
+    etag = _etag(receipt_id, serializer.fields, row.updated_at)
+    # Without the read cache a matching request skips the tags query and
+    # serialization; with it the entry is built anyway for later reads
+    not_modified = None if cache.enabled else _not_modified(etag, row.updated_at)
+    if not_modified is not None:
+        return not_modified
+    cached = CachedResponse(
+        etag, row.updated_at, jsonify(serializer.dump_one(row)).get_data()
+    )
+    cache.set(slot, cached, replica=reading_replica(db.session))
+    return _cached_response(cached)
+
+
+@receipts_bp.route('/receipts/<int:receipt_id>/image', methods=['GET'])
+def get_receipt_image(receipt_id):
+    """
+    Get a receipt's image: a grayscale copy scaled for viewing, or a
+    thumbnail.
+    Compacted copies are served with a long max-age; before a receipt is
+    compacted the original is served, and the thumbnail is made on the fly.
+    Both carry an ETag.
+    ---
+    tags:
+      - Receipts
+    produces:
+      - image/webp
+      - image/jpeg
+      - image/png
+      - application/pdf
+    parameters:
+      - name: receipt_id
+        in: path
+        type: integer
+        required: true
+        description: ID of the receipt
+      - name: size
+        in: query
+        type: string
+        enum: [thumb, full]
+        required: false
+        description: Thumbnail or full-size image (default full)
+    responses:
+      200:
+        description: The image
+      304:
+        description: The image is unchanged (If-None-Match)
+      400:
+        description: Invalid size
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+        examples:
+          application/json:
+            error: "Invalid size: huge"
+      404:
+        description: Receipt or its file not found
+    security:
+      - {}
+    """
+    size = request.args.get('size', 'full')
+    if size not in images.SIZES:
+        return jsonify({'error': f'Invalid size: {size}'}), 400
+    row = (
+        Receipt.query.with_entities(
+            Receipt.filename, Receipt.storage_key, Receipt.image_key, Receipt.thumb_key
+        )
+        .filter(Receipt.id == receipt_id)
+        .first_or_404()
+    )
+    key = row.thumb_key if size == 'thumb' else row.image_key
+    try:
+        if key is not None:
+            return _image_response(
+                get_storage().open(key),
+                images.mimetype_for(key),
+                _etag(key),
+                immutable=True,
+            )
+        # Not compacted yet. The ETags differ from the copies' so clients
+        # pick those up once they exist.
+        etag = _etag(row.storage_key or row.filename, size)
+        if size == 'thumb':
+            with receipt_file(row) as path:
+                data = images.derive(path, sizes=('thumb',))['thumb']
+            return _image_response(io.BytesIO(data), images.compact_mimetype(), etag)
+        if row.storage_key is not None:
+            return _image_response(
+                get_storage().open(row.storage_key),
+                images.mimetype_for(row.storage_key),
+                etag,
+            )
+        # Only a bare name inside UPLOAD_FOLDER: imported receipts carry a
+        # client-supplied filename and never had a file
+        with receipt_file(row) as path:
+            f = open(path, 'rb')
+        return _image_response(f, images.mimetype_for(row.filename), etag)
+    except (OSError, ValueError):
+        # Missing, or not an image we can decode
+        abort(404)
+
+
+def _image_response(f, mimetype, etag, immutable=False):
+    response = send_file(f, mimetype=mimetype, etag=etag, conditional=True)
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.max_age = images.IMAGE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+@receipts_bp.route('/tags', methods=['GET'])
+def list_tags():
+    """
+    List tags with the number of receipts carrying each, most used first.
+    Counted from the (tag_id, receipt_id) index without touching receipts.
+    ---
+    tags:
+      - Receipts
+    responses:
+      200:
+        description: Tags and receipt counts
+        schema:
+          type: object
+          properties:
+            tags:
+              type: array
+              items:
+                type: object
+                properties:
+                  name:
+                    type: string
+                  count:
+                    type: integer
+        examples:
+          application/json:
+            tags:
+              - name: "coffee"
+                count: 12
+              - name: "breakfast"
+                count: 3
+    security:
+      - {}
+    """
+    counts = (
+        db.select(ReceiptTag.tag_id, func.count().label('count'))
+        .group_by(ReceiptTag.tag_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        db.select(Tag.name, counts.c.count)
+        .join(counts, counts.c.tag_id == Tag.id)
+        .order_by(counts.c.count.desc(), Tag.name)
+    )
+    return jsonify({'tags': [{'name': name, 'count': count} for name, count in rows]})
+
+
+def _job_payload(receipt):
+    status_url = url_for('jobs.get_job', job_id=receipt.id)
+    body = {'id': receipt.id, 'status': receipt.status, 'status_url': status_url}
+    if receipt.status == STATUS_DONE:
+        body['receipt_url'] = url_for('receipts.get_receipt', receipt_id=receipt.id)
+    if receipt.error:
+        body['error'] = receipt.error
+    return body, status_url
+
+
+@jobs_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Poll the status of an asynchronous upload.
+    ---
+    tags:
+      - Jobs
+    parameters:
+      - name: job_id
+        in: path
+        type: integer
+        required: true
+        description: Job ID returned by POST /upload (same as the receipt ID)
+    definitions:
+      Job:
+        type: object
+        properties:
+          id:
+            type: integer
+          status:
+            type: string
+            enum: [queued, processing, done, failed]
+          status_url:
+            type: string
+          receipt_url:
+            type: string
+          error:
+            type: string
+    responses:
+      200:
+        description: Current job status
+        schema:
+          $ref: '#/definitions/Job'
+        examples:
+          application/json:
+            id: 1
+            status: "done"
+            status_url: "/jobs/1"
+            receipt_url: "/receipts/1"
+      404:
+        description: Job not found
+    security:
+      - {}
+    """
+    receipt = Receipt.query.get_or_404(job_id)
+    body, _ = _job_payload(receipt)
+    return jsonify(body), 200
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Runtime counters for caches and pipelines in this worker process.
+    ---
+    tags:
+      - Metrics
+    responses:
+      200:
+        description: Metrics snapshot
+        examples:
+          application/json:
+            ocr_cache:
+              size: 12
+              maxsize: 1024
+              hits: 30
+              misses: 12
+              evictions: 0
+              hit_ratio: 0.714
+              saved_seconds: 84.2
+            llm:
+              cache:
+                hits: 5
+                misses: 40
+              max_concurrency: 4
+              batch_size: 8
+            extraction:
+              receipts: 45
+              llm_calls_avoided: 26
+            ocr_stages:
+              detect:
+                count: 45
+                avg_ms: 4.1
+              recognize:
+                count: 45
+                avg_ms: 812.5
+            read_cache:
+              backend: memory
+              hits: 950
+              misses: 50
+              hit_ratio: 0.95
+              invalidations: 12
+              entries: 48
+              bytes: 61440
+              maxbytes: 67108864
+              evictions: 0
+              expirations: 2
+            group_commit:
+              enabled: true
+              commits: 40
+              writes: 1000
+              writes_per_commit: 25.0
+              retries: 0
+            db_pools:
+              primary:
+                size: 10
+                checked_out: 3
+                overflow: 0
+                checkouts: 5210
+                timeouts: 0
+                wait_ms_mean: 0.4
+                wait_ms_p99: 2.1
+                wait_ms_max: 12.8
+            replicas:
+              replicas: 1
+              replica_reads: 4100
+              primary_reads: 0
+              sticky_reads: 35
+    security:
+      - {}
+    """
+    return jsonify(
+        {
+            'ocr_cache': current_app.extensions['ocr_cache'].stats(),
+            'llm': llm.stats(),
+            'extraction': dict(tier_stats),
+            'ocr_stages': ocr.stage_stats(),
+            'read_cache': current_app.extensions['read_cache'].stats(),
+            'group_commit': current_app.extensions['group_commit'].stats(),
+            'db_pools': pool_stats(
+                {
+                    'primary': db.engine,
+                    **current_app.extensions['replica_router'].engines,
+                }
+            ),
+            'replicas': current_app.extensions['replica_router'].stats(),
+        }
+    )
+
+
+@analytics_bp.route('/analytics/summary', methods=['GET'])
+def analytics_summary():
+    """
+    Receipt counts and spend, grouped by period and/or merchant or tag.
+    Served from incrementally maintained daily rollups, so the cost does
+    not grow with the number of receipts. Receipts without a date are not
+    counted.
+    ---
+    tags:
+      - Analytics
+    parameters:
+      - name: group_by
+        in: query
+        type: string
+        required: false
+        description: Comma-separated; at most one of day, week, month and one of
+          merchant, tag (e.g. month,merchant)
+      - name: date_from
+        in: query
+        type: string
+        format: date
+        required: false
+      - name: date_to
+        in: query
+        type: string
+        format: date
+        required: false
+    responses:
+      200:
+        description: One entry per group; periods in order, biggest spend first
+          within a period
+        examples:
+          application/json:
+            group_by: ["month", "merchant"]
+            groups:
+              - month: "2025-04"
+                merchant: "Mega Mart"
+                receipts: 12
+                total: 341.2
+              - month: "2025-04"
+                merchant: "Corner Cafe"
+                receipts: 20
+                total: 96.5
+      400:
+        description: Invalid grouping or dates
+    security:
+      - {}
+    """
+    group_by = [
+        g.strip() for g in request.args.get('group_by', '').split(',') if g.strip()
+    ]
+    units = [g for g in group_by if g in analytics.TIME_BUCKETS]
+    keys = [g for g in group_by if g in analytics.KEY_DIMENSIONS]
+    if len(units) > 1 or len(keys) > 1 or len(units) + len(keys) != len(group_by):
+        return (
+            jsonify(
+                {
+                    'error': 'group_by takes at most one of day, week, month '
+                    'and one of merchant, tag'
+                }
+            ),
+            400,
+        )
+    try:
+        dates = _date_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(
+        {'group_by': group_by, 'groups': analytics.summary(group_by, **dates)}
+    )
+
+
+def _date_range(args) -> dict:
+    try:
+        return {
+            name: datetime.date.fromisoformat(args[name])
+            for name in ('date_from', 'date_to')
+            if args.get(name)
+        }
+    except ValueError:
+        raise ValueError('date_from and date_to must be YYYY-MM-DD')
+
+
+def _snapshot_params(args, **spec):
+    """
+    Date range plus the named numeric query parameters, as keyword
+    arguments for a Snapshot method. ``spec`` maps each name to
+    (type, default, minimum). Raises ValueError naming the bad parameter.
+    """
+    params = _date_range(args)
+    for name, (kind, default, minimum) in spec.items():
+        value = args.get(name, default, type=kind)
+        if value is None or value < minimum:
+            raise ValueError(f'{name} must be a number >= {minimum}')
+        params[name] = value
+    return params
+
+
+@analytics_bp.route('/analytics/snapshot', methods=['GET'])
+def analytics_snapshot():
+    """
+    Size and age of the in-memory columnar snapshot behind the statistics endpoints.
+    The snapshot holds every receipt with a total as NumPy arrays and is
+    rebuilt after writes or ANALYTICS_SNAPSHOT_TTL seconds.
+    ---
+    tags:
+      - Analytics
+    responses:
+      200:
+        description: Snapshot statistics
+        examples:
+          application/json:
+            rows: 1000000
+            merchants: 5000
+            bytes: 28000000
+            bytes_per_row: 28.0
+            age_seconds: 12.5
+    security:
+      - {}
+    """
+    return jsonify(analytics.get_snapshot().stats())
+
+
+@analytics_bp.route('/analytics/percentiles', methods=['GET'])
+def analytics_percentiles():
+    """
+    Percentiles of receipt totals.
+    ---
+    tags:
+      - Analytics
+    parameters:
+      - name: p
+        in: query
+        type: string
+        required: false
+        default: "50,90,99"
+        description: Comma-separated percentiles between 0 and 100
+      - name: date_from
+        in: query
+        type: string
+        format: date
+        required: false
+      - name: date_to
+        in: query
+        type: string
+        format: date
+        required: false
+    responses:
+      200:
+        description: Total at each percentile
+        examples:
+          application/json:
+            percentiles:
+              "50": 18.4
+              "90": 96.1
+              "99": 412.0
+      400:
+        description: Invalid percentiles or dates
+    security:
+      - {}
+    """
+    try:
+        dates = _date_range(request.args)
+        ps = [float(p) for p in request.args.get('p', '50,90,99').split(',')]
+        if not all(0 <= p <= 100 for p in ps):
+            raise ValueError
+    except ValueError as e:
+        return jsonify({'error': str(e) or 'p must be numbers between 0 and 100'}), 400
+    values = analytics.get_snapshot().percentiles(ps, **dates)
+    return jsonify({'percentiles': {f'{p:g}': v for p, v in values.items()}})
+
+
+@analytics_bp.route('/analytics/moving-average', methods=['GET'])
+def analytics_moving_average():
+    """
+    Daily spend with its trailing moving average.
+    ---
+    tags:
+      - Analytics
+    parameters:
+      - name: window
+        in: query
+        type: integer
+        required: false
+        default: 7
+        description: Window length in days
+      - name: date_from
+        in: query
+        type: string
+        format: date
+        required: false
+      - name: date_to
+        in: query
+        type: string
+        format: date
+        required: false
+    responses:
+      200:
+        description: One entry per day in the range, including days without receipts
+        examples:
+          application/json:
+            window: 7
+            days:
+              - date: "2025-04-01"
+                total: 12.5
+                average: 12.5
+              - date: "2025-04-02"
+                total: 0.0
+                average: 6.25
+      400:
+        description: Invalid window or dates
+    security:
+      - {}
+    """
+    try:
+        params = _snapshot_params(request.args, window=(int, 7, 1))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(
+        {
+            'window': params['window'],
+            'days': analytics.get_snapshot().moving_average(**params),
+        }
+    )
+
+
+@analytics_bp.route('/analytics/outliers', methods=['GET'])
+def analytics_outliers():
+    """
+    Receipts whose total is unusual for their merchant (z-score).
+    ---
+    tags:
+      - Analytics
+    parameters:
+      - name: threshold
+        in: query
+        type: number
+        required: false
+        default: 3
+        description: Minimum absolute z-score
+      - name: min_count
+        in: query
+        type: integer
+        required: false
+        default: 5
+        description: Only merchants with at least this many receipts
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        default: 100
+      - name: date_from
+        in: query
+        type: string
+        format: date
+        required: false
+      - name: date_to
+        in: query
+        type: string
+        format: date
+        required: false
+    responses:
+      200:
+        description: Outliers, largest deviation first
+        examples:
+          application/json:
+            outliers:
+              - id: 42
+                merchant: "Corner Cafe"
+                total: 86.0
+                merchant_mean: 4.8
+                z: 9.7
+      400:
+        description: Invalid parameters
+    security:
+      - {}
+    """
+    try:
+        params = _snapshot_params(
+            request.args,
+            threshold=(float, 3.0, 0),
+            min_count=(int, 5, 2),
+            limit=(int, 100, 1),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'outliers': analytics.get_snapshot().merchant_outliers(**params)})
+
+
+@analytics_bp.route('/analytics/duplicates', methods=['GET'])
+def analytics_duplicates():
+    """
+    Receipts from the same merchant with the same total on nearby dates.
+    ---
+    tags:
+      - Analytics
+    parameters:
+      - name: window_days
+        in: query
+        type: integer
+        required: false
+        default: 0
+        description: Maximum days between receipts in a group (0 = same day)
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        default: 100
+      - name: date_from
+        in: query
+        type: string
+        format: date
+        required: false
+      - name: date_to
+        in: query
+        type: string
+        format: date
+        required: false
+    responses:
+      200:
+        description: Groups of likely duplicates
+        examples:
+          application/json:
+            duplicates:
+              - merchant: "Taxi Co"
+                total: 23.4
+                ids: [17, 18]
+                dates: ["2025-03-09", "2025-03-09"]
+      400:
+        description: Invalid parameters
+    security:
+      - {}
+    """
+    try:
+        params = _snapshot_params(
+            request.args, window_days=(int, 0, 0), limit=(int, 100, 1)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'duplicates': analytics.get_snapshot().duplicate_amounts(**params)})
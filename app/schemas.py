@@ -1,33 +1,35 @@
 from app import ma
-from app.models import Receipt
+from app.models import Receipt, split_tags
 
 
 from marshmallow import fields
 
-from marshmallow import pre_dump, post_load
+from marshmallow import post_load
+
 
 class ReceiptSchema(ma.SQLAlchemyAutoSchema):
     notes = fields.String(allow_none=True)
-    tags = fields.List(fields.String(), allow_none=True)
+    tags = fields.Method('dump_tags', deserialize='load_tags', allow_none=True)
 
     class Meta:
         model = Receipt
         load_instance = True
+        exclude = ('raw_text', 'storage_key', 'image_key', 'thumb_key')
+
+    def dump_tags(self, obj):
+        # Receipts read their names from the tags table; anything else is
+        # expected to carry the comma-separated string
+        if isinstance(obj, Receipt):
+            return obj.tag_names
+        return split_tags(obj.tags)
 
-    @pre_dump
-    def split_tags(self, obj, **kwargs):
-        # Convert comma-separated tags string to list for serialization
-        if isinstance(obj.tags, str):
-            obj.tags = [t.strip() for t in obj.tags.split(',') if t.strip()]
-        elif obj.tags is None:
-            obj.tags = []
-        return obj
+    def load_tags(self, value):
+        return fields.List(fields.String()).deserialize(value)
 
     @post_load
     def join_tags(self, data, **kwargs):
         # Convert list of tags to comma-separated string for DB
         tags = data.get('tags')
         if isinstance(tags, list):
-            data['tags'] = ','.join([t.strip() for t in tags if t.strip()])
+            data['tags'] = ','.join(split_tags(tags))
         return data
-
@@ -0,0 +1,213 @@
+import os
+import re
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from app import db
+from app.models import Receipt
+from app.pagination import decode_cursor, encode_cursor
+
+# Postgres text search configuration; 'simple' lowercases without stemming,
+# which suits OCR'd item names and shop names in any language
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'simple')
+SNIPPET_CHARS = int(os.getenv('SEARCH_SNIPPET_CHARS', 160))
+
+# The index lives beside receipts: an FTS5 table keyed by receipt id on
+# SQLite, a tsvector table with a GIN index on Postgres. Both are written by
+# the application (the text is stored compressed, so the database cannot
+# derive them itself).
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS receipts_fts "
+    "USING fts5(body, tokenize='unicode61')"
+]
+POSTGRES_DDL = [
+    "CREATE TABLE IF NOT EXISTS receipt_search ("
+    " receipt_id integer PRIMARY KEY REFERENCES receipts (id) ON DELETE CASCADE,"
+    " document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_receipt_search_document "
+    "ON receipt_search USING gin (document)",
+]
+DROP_DDL = {
+    'sqlite': ["DROP TABLE IF EXISTS receipts_fts"],
+    'postgresql': ["DROP TABLE IF EXISTS receipt_search"],
+}
+
+for _statement in SQLITE_DDL:
+    sa.event.listen(
+        Receipt.__table__,
+        'after_create',
+        sa.DDL(_statement).execute_if(dialect='sqlite'),
+    )
+for _statement in POSTGRES_DDL:
+    sa.event.listen(
+        Receipt.__table__,
+        'after_create',
+        sa.DDL(_statement).execute_if(dialect='postgresql'),
+    )
+for _dialect, _statements in DROP_DDL.items():
+    for _statement in _statements:
+        sa.event.listen(
+            Receipt.__table__,
+            'before_drop',
+            sa.DDL(_statement).execute_if(dialect=_dialect),
+        )
+
+
+class SearchUnavailable(Exception):
+    pass
+
+
+def terms(query: str) -> list:
+    """
+    Lowercased word tokens of a search query; every term must match.
+    """
+    return list(dict.fromkeys(re.findall(r'\w+', query.lower())))
+
+
+def sync(connection, texts: dict, deleted=()) -> None:
+    """
+    Replace the indexed text of receipts: ``texts`` maps receipt id to its
+    OCR text (None removes it), ``deleted`` lists receipts being removed.
+    """
+    ids = list(texts) + list(deleted)
+    if not ids:
+        return
+    rows = [{'id': rid, 'body': text} for rid, text in texts.items() if text]
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        connection.execute(
+            sa.text("DELETE FROM receipts_fts WHERE rowid IN :ids").bindparams(
+                sa.bindparam('ids', expanding=True)
+            ),
+            {'ids': ids},
+        )
+        if rows:
+            connection.execute(
+                sa.text("INSERT INTO receipts_fts (rowid, body) VALUES (:id, :body)"),
+                rows,
+            )
+    elif dialect == 'postgresql':
+        connection.execute(
+            sa.text("DELETE FROM receipt_search WHERE receipt_id IN :ids").bindparams(
+                sa.bindparam('ids', expanding=True)
+            ),
+            {'ids': ids},
+        )
+        if rows:
+            connection.execute(
+                sa.text(
+                    "INSERT INTO receipt_search (receipt_id, document) "
+                    "VALUES (:id, to_tsvector(CAST(:config AS regconfig), :body))"
+                ),
+                [dict(row, config=SEARCH_CONFIG) for row in rows],
+            )
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    """
+    Keep the search index in step with receipts whose OCR text changed.
+    """
+    texts = {
+        obj.id: obj.ocr_text
+        for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, Receipt) and sa.inspect(obj).attrs.raw_text.history.added
+    }
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Receipt)]
+    if texts or deleted:
+        sync(session.connection(), texts, deleted)
+
+
+def _ranked(dialect, words, per_page, after=None):
+    """
+    One page of (receipt id, score) for receipts matching every word, best
+    first. ``after`` is the (score, id) of the previous page's last row.
+    """
+    if dialect == 'sqlite':
+        # bm25() is lower for better matches; negate so higher is better
+        score = sa.literal_column('-bm25(receipts_fts)')
+        match = ' '.join('"%s"' % w for w in words)
+        stmt = (
+            sa.select(sa.literal_column('rowid').label('id'), score.label('score'))
+            .select_from(sa.table('receipts_fts'))
+            .where(sa.literal_column('receipts_fts').op('MATCH')(match))
+        )
+        id_column = sa.literal_column('rowid')
+    elif dialect == 'postgresql':
+        search = sa.table(
+            'receipt_search', sa.column('receipt_id'), sa.column('document')
+        )
+        query = sa.func.plainto_tsquery(
+            sa.cast(SEARCH_CONFIG, REGCONFIG), ' '.join(words)
+        )
+        score = sa.func.ts_rank(search.c.document, query)
+        stmt = sa.select(search.c.receipt_id.label('id'), score.label('score')).where(
+            search.c.document.op('@@')(query)
+        )
+        id_column = search.c.receipt_id
+    else:
+        raise SearchUnavailable(f'Full-text search is not supported on {dialect}')
+    if after is not None:
+        stmt = stmt.where(sa.tuple_(score, id_column) < sa.tuple_(*after))
+    stmt = stmt.order_by(score.desc(), id_column.desc()).limit(per_page + 1)
+    return db.session.execute(stmt).all()
+
+
+def search(query: str, per_page: int, cursor: str = None):
+    """
+    Receipts whose OCR text contains every word of ``query``, ranked by
+    relevance (bm25 on SQLite, ts_rank on Postgres) and paginated with a
+    keyset cursor over (score, id). Returns ([(receipt, score)], next_cursor).
+    Raises ValueError for an empty query, InvalidCursor for a bad cursor.
+    """
+    words = terms(query)
+    if not words:
+        raise ValueError('q must contain at least one word')
+    after = decode_cursor(cursor, 'score', float) if cursor else None
+    rows = _ranked(db.engine.dialect.name, words, per_page, after)
+    page = rows[:per_page]
+    next_cursor = (
+        encode_cursor(page[-1].score, page[-1].id, 'score')
+        if len(rows) > per_page
+        else None
+    )
+    receipts = {
+        r.id: r
+        for r in Receipt.query.filter(Receipt.id.in_([row.id for row in page])).options(
+            sa.orm.undefer(Receipt.raw_text)
+        )
+    }
+    return [
+        (receipts[row.id], row.score) for row in page if row.id in receipts
+    ], next_cursor
+
+
+def snippet(text: str, words, width: int = None):
+    """
+    The stretch of ``text`` around the first matched word, with runs of
+    whitespace collapsed. Returns (snippet, [[start, end], ...]) where the
+    pairs are offsets of every matched word inside the snippet.
+    """
+    width = width or SNIPPET_CHARS
+    text = ' '.join((text or '').split())
+    pattern = re.compile(
+        r'(?<!\w)(?:%s)(?!\w)' % '|'.join(map(re.escape, words)), re.IGNORECASE
+    )
+    first = pattern.search(text)
+    start = max(0, (first.start() if first else 0) - width // 3)
+    if start:
+        # Start on a word boundary
+        space = text.find(' ', start)
+        start = (
+            space + 1 if 0 <= space < (first.start() if first else len(text)) else start
+        )
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > start else end
+    prefix = '…' if start else ''
+    suffix = '…' if end < len(text) else ''
+    shift = len(prefix) - start
+    hits = [
+        [m.start() + shift, m.end() + shift] for m in pattern.finditer(text, start, end)
+    ]
+    return prefix + text[start:end] + suffix, hits
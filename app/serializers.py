@@ -0,0 +1,124 @@
+import functools
+from app import db
+from app.models import Receipt, ReceiptTag, Tag
+
+# What ReceiptSchema dumps: every column but raw_text, with tags as a list
+RECEIPT_FIELDS = (
+    'id',
+    'filename',
+    'merchant',
+    'date',
+    'total',
+    'notes',
+    'tags',
+    'field_sources',
+    'sha256',
+    'import_key',
+    'status',
+    'error',
+    'created_at',
+    'updated_at',
+)
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+# Columns whose database value is not already what ReceiptSchema emits
+CONVERTERS = {
+    'date': _isoformat,
+    'created_at': _isoformat,
+    'updated_at': _isoformat,
+    'total': _float,
+}
+
+
+def tag_names(receipt_ids) -> dict:
+    """
+    {receipt id: [tag name, ...]} for the given receipts, in one query.
+    """
+    names = {}
+    rows = db.session.execute(
+        db.select(ReceiptTag.receipt_id, Tag.name)
+        .join(Tag, Tag.id == ReceiptTag.tag_id)
+        .where(ReceiptTag.receipt_id.in_(receipt_ids))
+        .order_by(ReceiptTag.receipt_id, ReceiptTag.position)
+    )
+    for receipt_id, name in rows:
+        names.setdefault(receipt_id, []).append(name)
+    return names
+
+
+class ReceiptSerializer:
+    """
+    Dumps receipts the way ReceiptSchema does, from plain result rows instead
+    of ORM objects: select() narrows a Receipt query to the columns of the
+    requested fields, dump() turns its rows into dicts. The field layout is
+    worked out once per field set, so dumping a row is a zip into a dict plus
+    the few value conversions the fields need.
+    """
+
+    def __init__(self, fields=RECEIPT_FIELDS):
+        self.fields = fields
+        self.names = tuple(name for name in fields if name != 'tags')
+        self.columns = [getattr(Receipt, name) for name in self.names]
+        self.converters = [
+            (name, CONVERTERS[name]) for name in self.names if name in CONVERTERS
+        ]
+        self.with_tags = 'tags' in fields
+
+    def select(self, query, *extra):
+        """
+        ``query`` returning the serializer's columns, followed by the id and
+        any ``extra`` columns callers need that were not asked for.
+        """
+        wanted = [Receipt.id] + list(extra) if self.with_tags or extra else list(extra)
+        extra = [column for column in wanted if column.key not in self.names]
+        return query.with_entities(*self.columns, *extra)
+
+    def dump(self, rows) -> list:
+        names, converters = self.names, self.converters
+        items = []
+        for row in rows:
+            # zip stops at the requested columns, dropping the extras
+            item = dict(zip(names, row))
+            for name, convert in converters:
+                item[name] = convert(item[name])
+            items.append(item)
+        if self.with_tags and items:
+            tags = tag_names([row.id for row in rows])
+            for row, item in zip(rows, items):
+                item['tags'] = tags.get(row.id, [])
+        return items
+
+    def dump_one(self, row) -> dict:
+        return self.dump([row])[0]
+
+
+_serializers = functools.lru_cache(maxsize=64)(ReceiptSerializer)
+
+
+def receipt_serializer(fields: str = None) -> ReceiptSerializer:
+    """
+    Serializer for a ``?fields=`` value: comma-separated field names, or all
+    fields when empty. Raises ValueError for unknown names.
+    """
+    names = tuple(
+        dict.fromkeys(
+            name.strip() for name in (fields or '').split(',') if name.strip()
+        )
+    )
+    if not names:
+        return _serializers(RECEIPT_FIELDS)
+    unknown = [name for name in names if name not in RECEIPT_FIELDS]
+    if unknown:
+        raise ValueError(
+            f"Unknown field(s): {', '.join(unknown)}; "
+            f"fields must be among {', '.join(RECEIPT_FIELDS)}"
+        )
+    return _serializers(names)
@@ -0,0 +1,365 @@
+import errno
+import hashlib
+import importlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import sqlalchemy as sa
+from flask import current_app
+from werkzeug.security import safe_join
+from app import db
+from app.models import Receipt
+
+CHUNK_SIZE = 64 * 1024
+# Receipts per rehome batch: files moved in parallel, then one commit
+REHOME_BATCH = int(os.getenv('STORAGE_REHOME_BATCH', 500))
+
+_init_lock = threading.Lock()
+
+
+def content_key(digest: str, filename: str) -> str:
+    """
+    Where a file with this SHA-256 is stored: ``ab/cd/<hash>.<ext>``. Two
+    levels of 256 directories keep each directory small even with millions
+    of files; the extension, from ``filename``, is kept for tools that go by
+    it.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+class Storage:
+    """
+    Where uploaded files live, addressed by content_key(). Backends
+    implement put, open, exists, size and delete; local_path works for any
+    of them by copying to a temp file, and backends on a filesystem
+    override it.
+    """
+
+    def put(self, key: str, path: str, move: bool = True) -> None:
+        """
+        Store the local file at ``path`` under ``key``, all or nothing:
+        readers see the old object or the new one, never part of one.
+        ``move`` lets the backend take ``path`` over (it is gone after);
+        otherwise it is left alone.
+        """
+        raise NotImplementedError
+
+    def open(self, key: str):
+        """
+        A binary file object for the stored file. FileNotFoundError if
+        there is none.
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, key: str) -> int:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    @contextmanager
+    def local_path(self, key: str):
+        """
+        A filesystem path holding the file for the duration of the block,
+        for code (OCR, PDF rendering) that needs one.
+        """
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, 'wb') as out, self.open(key) as src:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+            yield path
+        finally:
+            os.remove(path)
+
+
+class LocalStorage(Storage):
+    """
+    Files under ``root`` in the ``ab/cd/<hash>.<ext>`` layout. Writes go to
+    a temp file in ``root`` and are renamed into place, which is atomic on
+    one filesystem.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('STORAGE_ROOT') or config['UPLOAD_FOLDER'])
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key, path, move=True):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if move:
+            try:
+                os.replace(path, target)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+            else:
+                # Renaming a hard link onto its twin leaves both in place
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+        # Stage the file next to its target, linked where possible rather
+        # than copied, so the rename that publishes it is atomic
+        tmp_path = os.path.join(self.root, f'.put-{os.urandom(8).hex()}')
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target)
+        if move:
+            os.remove(path)
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def local_path(self, key):
+        yield self.path(key)
+
+
+class MemoryStorage(Storage):
+    """
+    Objects kept in a dict: a stand-in for an object store (S3, GCS) in
+    tests and local runs. Like one, it has no paths of its own.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls()
+
+    def put(self, key, path, move=True):
+        with open(path, 'rb') as f:
+            data = f.read()
+        with self._lock:
+            self.objects[key] = data
+        if move:
+            os.remove(path)
+
+    def open(self, key):
+        with self._lock:
+            if key not in self.objects:
+                raise FileNotFoundError(key)
+            return io.BytesIO(self.objects[key])
+
+    def exists(self, key):
+        with self._lock:
+            return key in self.objects
+
+    def size(self, key):
+        with self._lock:
+            if key not in self.objects:
+                raise FileNotFoundError(key)
+            return len(self.objects[key])
+
+    def delete(self, key):
+        with self._lock:
+            self.objects.pop(key, None)
+
+
+BACKENDS = {'local': LocalStorage, 'memory': MemoryStorage}
+
+
+def make_storage(config) -> Storage:
+    """
+    The STORAGE_BACKEND backend: 'local', 'memory', or 'package.module:Class'
+    for any Storage subclass with a from_config(config) classmethod.
+    """
+    name = config.get('STORAGE_BACKEND', 'local')
+    if name in BACKENDS:
+        cls = BACKENDS[name]
+    else:
+        module, _, attr = name.partition(':')
+        try:
+            cls = getattr(importlib.import_module(module), attr)
+        except (ImportError, AttributeError, ValueError) as e:
+            raise ValueError(f'Unknown STORAGE_BACKEND: {name}') from e
+    return cls.from_config(config)
+
+
+def get_storage() -> Storage:
+    """
+    The app's storage backend, created on first use so the config can still
+    be changed after create_app().
+    """
+    with _init_lock:
+        storage = current_app.extensions.get('storage')
+        if storage is None:
+            storage = current_app.extensions['storage'] = make_storage(
+                current_app.config
+            )
+        return storage
+
+
+def legacy_path(filename: str, folder: str = None):
+    """
+    Where an upload was written before content-addressed storage, or None
+    when ``filename`` cannot name one: empty, or a path that would lead out
+    of the upload folder (filenames are client-supplied metadata).
+    """
+    folder = folder or current_app.config['UPLOAD_FOLDER']
+    path = safe_join(folder, filename) if filename else None
+    if path is None:
+        return None
+    # Symlinks in the folder must not lead out of it either
+    if not os.path.realpath(path).startswith(os.path.realpath(folder) + os.sep):
+        return None
+    return path
+
+
+@contextmanager
+def receipt_file(receipt):
+    """
+    A local path to the receipt's upload, from storage or, for receipts not
+    rehomed yet, the flat upload folder. FileNotFoundError if it has none.
+    """
+    if receipt.storage_key is None:
+        path = legacy_path(receipt.filename)
+        if path is None or not os.path.isfile(path):
+            raise FileNotFoundError(receipt.filename)
+        yield path
+    else:
+        with get_storage().local_path(receipt.storage_key) as path:
+            yield path
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RehomeReport:
+    def __init__(self):
+        self.files = 0
+        self.receipts = 0
+        self.bytes = 0
+        self.missing = []
+
+    def to_dict(self) -> dict:
+        return {
+            'files': self.files,
+            'receipts': self.receipts,
+            'bytes': self.bytes,
+            'missing': self.missing,
+        }
+
+
+def _rehome_file(storage, folder, filename):
+    """
+    Hash one legacy upload and store it under its content key, leaving the
+    original in place. Returns (filename, key, digest, size); key is None
+    when there is no such file in the folder.
+    """
+    path = legacy_path(filename, folder)
+    if path is None or not os.path.isfile(path):
+        return filename, None, None, 0
+    try:
+        digest = hash_file(path)
+    except FileNotFoundError:
+        return filename, None, None, 0
+    key = content_key(digest, filename)
+    storage.put(key, path, move=False)
+    return filename, key, digest, os.path.getsize(path)
+
+
+def rehome(
+    workers: int = 8, batch_size: int = None, remove: bool = True
+) -> RehomeReport:
+    """
+    Move uploads from the flat UPLOAD_FOLDER into storage, ``workers``
+    files at a time, and point their receipts at them.
+
+    Receipts without a storage_key are taken in filename order,
+    ``batch_size`` at a time. A batch's files are copied (hard-linked, when
+    storage is on the same filesystem) in parallel, then its receipts are
+    updated in one transaction, and only then are the originals removed.
+    A run that stops part way leaves every receipt readable, and running it
+    again carries on after the last committed batch. Receipts that shared
+    a filename, and so a file, all get that file. A filename that names no
+    regular file inside the folder is reported missing and left alone.
+    """
+    storage = get_storage()
+    folder = current_app.config['UPLOAD_FOLDER']
+    batch_size = batch_size or REHOME_BATCH
+    report = RehomeReport()
+    receipts = Receipt.__table__
+    # A Core statement: the responses do not change, so neither the caches
+    # nor updated_at (the receipts' validators) need to
+    update = (
+        receipts.update()
+        .where(
+            receipts.c.filename == sa.bindparam('name'),
+            receipts.c.storage_key.is_(None),
+        )
+        .values(
+            storage_key=sa.bindparam('key'),
+            sha256=sa.func.coalesce(receipts.c.sha256, sa.bindparam('digest')),
+            updated_at=receipts.c.updated_at,
+        )
+    )
+    after = None
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        while True:
+            # Receipts with no filename (imported ones) never had a file
+            q = (
+                db.session.query(Receipt.filename)
+                .filter(Receipt.storage_key.is_(None), Receipt.filename != '')
+                .distinct()
+            )
+            if after is not None:
+                q = q.filter(Receipt.filename > after)
+            filenames = [
+                name for (name,) in q.order_by(Receipt.filename).limit(batch_size)
+            ]
+            if not filenames:
+                return report
+            after = filenames[-1]
+            moved = []
+            for filename, key, digest, size in pool.map(
+                lambda name: _rehome_file(storage, folder, name), filenames
+            ):
+                if key is None:
+                    report.missing.append(filename)
+                    continue
+                moved.append(filename)
+                report.files += 1
+                report.bytes += size
+                result = db.session.connection().execute(
+                    update, {'name': filename, 'key': key, 'digest': digest}
+                )
+                report.receipts += result.rowcount
+            db.session.commit()
+            if remove:
+                for filename in moved:
+                    os.remove(legacy_path(filename, folder))
@@ -0,0 +1,124 @@
+"""Normalize receipt tags into tags tables
+
+Revision ID: af2878fd6817
+Revises: 620ce9a2aae3
+Create Date: 2026-10-18 03:52:21.168044
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'af2878fd6817'
+down_revision = '620ce9a2aae3'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 2000
+
+receipts = sa.table(
+    'receipts', sa.column('id', sa.Integer), sa.column('tags', sa.String)
+)
+tags = sa.table('tags', sa.column('id', sa.Integer), sa.column('name', sa.String))
+receipt_tags = sa.table(
+    'receipt_tags',
+    sa.column('receipt_id', sa.Integer),
+    sa.column('tag_id', sa.Integer),
+    sa.column('position', sa.SmallInteger),
+)
+
+
+def _split(value):
+    return list(dict.fromkeys(t.strip() for t in value.split(',') if t.strip()))
+
+
+def _backfill_batch(conn, rows):
+    names = {name for _, raw in rows for name in _split(raw)}
+    ids = dict(
+        conn.execute(
+            sa.select(tags.c.name, tags.c.id).where(tags.c.name.in_(names))
+        ).all()
+    )
+    missing = sorted(names - ids.keys())
+    if missing:
+        conn.execute(tags.insert(), [{'name': name} for name in missing])
+        ids.update(
+            conn.execute(
+                sa.select(tags.c.name, tags.c.id).where(tags.c.name.in_(missing))
+            ).all()
+        )
+    # Rebuilt from the column, so a rerun after an interruption converges
+    conn.execute(
+        receipt_tags.delete().where(
+            receipt_tags.c.receipt_id.in_([rid for rid, _ in rows])
+        )
+    )
+    links = [
+        {'receipt_id': rid, 'tag_id': ids[name], 'position': i}
+        for rid, raw in rows
+        for i, name in enumerate(_split(raw))
+    ]
+    if links:
+        conn.execute(receipt_tags.insert(), links)
+
+
+def backfill():
+    """
+    Link every receipt to the tags in its comma-separated column, in id
+    batches. Runs outside the migration transaction so each batch commits
+    on its own and the receipts table is not held locked; the application
+    writes both forms from this revision on.
+    """
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(receipts.c.id, receipts.c.tags)
+            .where(receipts.c.id > last_id, receipts.c.tags.isnot(None))
+            .order_by(receipts.c.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            return
+        _backfill_batch(conn, rows)
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table(
+        'tags',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=256), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_table(
+        'receipt_tags',
+        sa.Column('receipt_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('position', sa.SmallInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['receipt_id'], ['receipts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('receipt_id', 'tag_id'),
+    )
+    with op.batch_alter_table('receipt_tags', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_receipt_tags_tag_id_receipt_id', ['tag_id', 'receipt_id'], unique=False
+        )
+
+    # ### end Alembic commands ###
+    with op.get_context().autocommit_block():
+        backfill()
+
+
+def downgrade():
+    # receipts.tags is kept in sync, so dropping the tables loses nothing
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('receipt_tags', schema=None) as batch_op:
+        batch_op.drop_index('ix_receipt_tags_tag_id_receipt_id')
+
+    op.drop_table('receipt_tags')
+    op.drop_table('tags')
+    # ### end Alembic commands ###
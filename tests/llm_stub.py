@@ -0,0 +1,124 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API.
+
+Answers receipt-extraction prompts with the regex parser after a simulated
+model latency, so LLM batching and caching can be benchmarked offline:
+
+    python tests/llm_stub.py --port 8089 --latency 0.3 --per-item 0.02
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import openai
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.parser import parse_with_regex  # noqa: E402
+
+BLOCK = re.compile(r"```(.*?)```", re.S)
+
+
+def answer(prompt: str) -> str:
+    fields = []
+    for text in BLOCK.findall(prompt):
+        parsed = parse_with_regex(text)
+        if parsed['date']:
+            parsed['date'] = parsed['date'].replace('/', '-')
+        fields.append(parsed)
+    if len(fields) == 1:
+        return json.dumps(fields[0])
+    return json.dumps(fields)
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.2, per_item=0.01):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.per_item = per_item
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content']
+        with self.server._lock:
+            self.server.requests += 1
+        time.sleep(
+            self.server.latency + self.server.per_item * len(BLOCK.findall(prompt))
+        )
+        payload = json.dumps(
+            {
+                'object': 'chat.completion',
+                'model': body.get('model'),
+                'choices': [
+                    {
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': answer(prompt)},
+                    }
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def chat_completion_client(base_url: str):
+    """
+    Return an openai client that talks to the stub, for llm.get_client.
+    """
+    return openai.OpenAI(base_url=base_url, api_key='stub', max_retries=0)
+
+
+def fake_client(create):
+    """
+    Return a client whose chat.completions.create is ``create``.
+    """
+    return SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument(
+        '--latency', type=float, default=0.2, help='seconds per request'
+    )
+    parser.add_argument(
+        '--per-item',
+        type=float,
+        default=0.01,
+        help='extra seconds per receipt in a prompt',
+    )
+    args = parser.parse_args()
+    server = StubLLMServer(args.port, args.latency, args.per_item)
+    print(f'Stub LLM listening on {server.url}')
+    server.serve_forever()
@@ -0,0 +1,273 @@
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+from types import SimpleNamespace
+import pytest
+import sqlalchemy as sa
+from app import create_app, db
+from app.analytics import _add, _cells, apply_deltas, rebuild_rollups, summary
+from app.models import Receipt, SpendRollup
+
+SAMPLE = [
+    ('Mega Mart', date(2025, 4, 1), 54.10, 'groceries,weekly'),
+    ('Mega Mart', date(2025, 4, 20), 12.00, 'groceries'),
+    ('Corner Cafe', date(2025, 4, 21), 4.50, 'coffee'),
+    ('Corner Cafe', date(2025, 5, 2), 3.20, 'coffee'),
+    ('Taxi Co', None, 23.40, None),  # no date: not counted
+]
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+        for i, (merchant, day, total, tags) in enumerate(SAMPLE):
+            db.session.add(
+                Receipt(
+                    filename=f'r{i}.png',
+                    merchant=merchant,
+                    date=day,
+                    total=total,
+                    tags=tags,
+                )
+            )
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def naive_summary(unit, dimension, date_from=date.min, date_to=date.max):
+    """
+    The same report straight from the receipts table.
+    """
+    labels = {
+        'month': lambda d: d.strftime('%Y-%m'),
+        'week': lambda d: '%04d-W%02d' % d.isocalendar()[:2],
+        'day': date.isoformat,
+        None: lambda d: None,
+    }
+    counts, totals = Counter(), Counter()
+    for r in Receipt.query.filter(Receipt.date.between(date_from, date_to)):
+        period = labels[unit](r.date)
+        keys = {'merchant': [r.merchant], 'tag': r.tag_names, None: [None]}[dimension]
+        for key in keys:
+            counts[period, key] += 1
+            totals[period, key] += round((r.total or 0) * 100)
+    return {k: (counts[k], totals[k]) for k in counts}
+
+
+def as_naive(groups, unit, dimension):
+    return {
+        (g.get(unit), g.get(dimension)): (g['receipts'], round(g['total'] * 100))
+        for g in groups
+    }
+
+
+def test_summary_by_month_and_merchant(client):
+    body = client.get('/analytics/summary?group_by=month,merchant').get_json()
+    assert body['groups'] == [
+        {'month': '2025-04', 'merchant': 'Mega Mart', 'receipts': 2, 'total': 66.1},
+        {'month': '2025-04', 'merchant': 'Corner Cafe', 'receipts': 1, 'total': 4.5},
+        {'month': '2025-05', 'merchant': 'Corner Cafe', 'receipts': 1, 'total': 3.2},
+    ]
+
+
+def test_summary_by_tag_with_date_range(client):
+    body = client.get(
+        '/analytics/summary?group_by=tag&date_from=2025-04-15&date_to=2025-04-30'
+    ).get_json()
+    assert body['groups'] == [
+        {'tag': 'groceries', 'receipts': 1, 'total': 12.0},
+        {'tag': 'coffee', 'receipts': 1, 'total': 4.5},
+    ]
+    body = client.get('/analytics/summary').get_json()
+    assert body['groups'] == [{'receipts': 4, 'total': 73.8}]
+    weeks = client.get('/analytics/summary?group_by=week').get_json()['groups']
+    assert [g['week'] for g in weeks] == [
+        '2025-W14',
+        '2025-W16',
+        '2025-W17',
+        '2025-W18',
+    ]
+
+
+@pytest.mark.parametrize(
+    'query',
+    [
+        'group_by=month,week',
+        'group_by=merchant,tag',
+        'group_by=year',
+        'date_from=april',
+    ],
+)
+def test_summary_invalid(client, query):
+    assert client.get(f'/analytics/summary?{query}').status_code == 400
+
+
+def test_edits_move_spend_between_cells(app):
+    with app.app_context():
+        receipt = Receipt.query.filter_by(filename='r0.png').one()
+        receipt.total = 50.00
+        receipt.date = date(2025, 5, 1)
+        receipt.tags = 'groceries'
+        db.session.commit()
+        undated = Receipt.query.filter_by(filename='r4.png').one()
+        undated.date = date(2025, 5, 3)
+        db.session.commit()
+        db.session.delete(Receipt.query.filter_by(filename='r3.png').one())
+        db.session.commit()
+        for unit, dimension in [('month', None), ('month', 'tag'), (None, 'merchant')]:
+            group_by = [g for g in (unit, dimension) if g]
+            assert as_naive(summary(group_by), unit, dimension) == naive_summary(
+                unit, dimension
+            )
+
+
+def test_deltas_are_upserted_in_key_order():
+    # The same cells in the same order for every transaction: no deadlocks
+    counts, totals = Counter(), Counter()
+    for merchant, day, tags in [
+        ('Zed', date(2025, 3, 9), 'x,b'),
+        ('Abe', date(2025, 1, 2), 'a'),
+    ]:
+        _add(counts, totals, _cells(merchant, day, 5.0, tags), 1)
+    written = []
+    connection = SimpleNamespace(
+        dialect=SimpleNamespace(name='sqlite'),
+        execute=lambda statement, rows: written.extend(rows),
+    )
+    apply_deltas(connection, counts, totals)
+    keys = [(r['grain'], r['dimension'], r['period'], r['key']) for r in written]
+    assert keys == sorted(keys) and len(keys) == len(counts)
+
+
+def test_random_edits_match_rebuild(app):
+    rng = random.Random(1)
+    merchants, tags = ['A', 'B', 'C', None], ['x', 'y', 'z']
+    with app.app_context():
+        receipts = Receipt.query.all()
+        for _ in range(200):
+            if rng.random() < 0.2:
+                receipt = Receipt(filename='n.png')
+                db.session.add(receipt)
+                receipts.append(receipt)
+            receipt = rng.choice(receipts)
+            receipt.merchant = rng.choice(merchants)
+            receipt.total = rng.choice([None, round(rng.uniform(1, 99), 2)])
+            receipt.date = rng.choice(
+                [None, date(2025, 1, 1) + timedelta(days=rng.randrange(90))]
+            )
+            receipt.tags = ','.join(rng.sample(tags, rng.randrange(3)))
+            db.session.commit()
+        incremental = {
+            (g, d): summary([g for g in (g, d) if g])
+            for g in ('month', None)
+            for d in ('tag', None)
+        }
+        rebuild_rollups(batch_size=7)
+        for (unit, dimension), groups in incremental.items():
+            assert groups == summary([g for g in (unit, dimension) if g])
+            assert as_naive(groups, unit, dimension) == naive_summary(unit, dimension)
+
+
+def test_partial_periods_match_base_table(app):
+    rng = random.Random(2)
+    with app.app_context():
+        for i in range(300):
+            db.session.add(
+                Receipt(
+                    filename=f'x{i}.png',
+                    merchant=rng.choice('ABC'),
+                    date=date(2024, 12, 1) + timedelta(days=rng.randrange(120)),
+                    total=round(rng.uniform(1, 50), 2),
+                    tags=rng.choice(['x', 'y', 'x,y']),
+                )
+            )
+        db.session.commit()
+        for _ in range(40):
+            date_from = date(2024, 11, 20) + timedelta(days=rng.randrange(140))
+            date_to = date_from + timedelta(days=rng.randrange(100))
+            for unit in ('day', 'week', 'month', None):
+                dimension = rng.choice(['merchant', 'tag', None])
+                group_by = [g for g in (unit, dimension) if g]
+                got = as_naive(summary(group_by, date_from, date_to), unit, dimension)
+                assert got == naive_summary(unit, dimension, date_from, date_to), (
+                    group_by,
+                    date_from,
+                    date_to,
+                )
+
+
+def test_rebuild_command(app):
+    with app.app_context():
+        db.session.execute(sa.delete(SpendRollup))
+        db.session.commit()
+    result = app.test_cli_runner().invoke(
+        args=['rollups', 'rebuild', '--batch-size', '2']
+    )
+    assert 'from 5 receipts' in result.output
+    with app.app_context():
+        assert summary([]) == [{'receipts': 4, 'total': 73.8}]
+
+
+@pytest.mark.benchmark
+def test_summary_benchmark(app):
+    """
+    Month x merchant spend over 200k receipts: the rollup table vs a
+    GROUP BY over receipts.
+    """
+    rows = 200_000
+    rng = random.Random(0)
+    names = [f'Shop {i}' for i in range(200)]
+    start_day = date(2023, 1, 1)
+    with app.app_context():
+        db.session.execute(
+            sa.insert(Receipt.__table__),
+            [
+                {
+                    'filename': f'b{i}.png',
+                    'status': 'done',
+                    'merchant': rng.choice(names),
+                    'date': start_day + timedelta(days=rng.randrange(730)),
+                    'total': round(rng.uniform(1, 200), 2),
+                }
+                for i in range(rows)
+            ],
+        )
+        db.session.commit()
+        rebuild_rollups()
+        naive = (
+            sa.select(
+                sa.func.strftime('%Y-%m', Receipt.date),
+                Receipt.merchant,
+                sa.func.count(),
+                sa.func.sum(Receipt.total),
+            )
+            .where(Receipt.date.between(date(2023, 1, 1), date(2023, 12, 31)))
+            .group_by(sa.func.strftime('%Y-%m', Receipt.date), Receipt.merchant)
+        )
+
+        def timed(fn, repeat=5):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = fn()
+            return (time.perf_counter() - start) / repeat, result
+
+        t_rollup, groups = timed(
+            lambda: summary(['month', 'merchant'], date(2023, 1, 1), date(2023, 12, 31))
+        )
+        t_naive, naive_rows = timed(lambda: db.session.execute(naive).all())
+    assert len(groups) == len(naive_rows)
+    print(
+        f"\nmonth x merchant over {rows} receipts: rollup {t_rollup * 1000:.1f}ms, "
+        f"GROUP BY {t_naive * 1000:.1f}ms"
+    )
+    assert t_rollup < t_naive
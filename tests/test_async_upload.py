@@ -0,0 +1,208 @@
+import datetime
+import io
+import threading
+import time
+import tempfile
+import pytest
+import app.ocr as ocr_module
+from app import create_app, db
+from app.config import TestConfig
+from app.models import Receipt
+
+OCR_DELAY = 0.05
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    # Slow stand-in for Tesseract + LLM so the queue has work to absorb
+    def slow_ocr(path):
+        time.sleep(OCR_DELAY)
+        return 'Corner Cafe\n2025-04-24\nTotal: 4.50'
+
+    monkeypatch.setattr(ocr_module, 'ocr_extract', slow_ocr)
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda t: {})
+    # Worker threads need their own connections, which :memory: cannot share
+    monkeypatch.setattr(
+        TestConfig, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'jobs.db'}"
+    )
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    yield app
+    app.extensions['job_queue'].shutdown()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def _upload(client, name, query=''):
+    # Distinct bytes per upload so the OCR result cache never short-circuits
+    data = {'file': (io.BytesIO(name.encode()), name), 'tags': 'coffee'}
+    return client.post('/upload' + query, data=data, content_type='multipart/form-data')
+
+
+def test_async_upload_returns_job(app, client):
+    resp = _upload(client, 'r.png', '?async=1')
+    assert resp.status_code == 202
+    job = resp.get_json()
+    assert job['status'] == 'queued'
+    assert resp.headers['Location'].endswith(f"/jobs/{job['id']}")
+
+    poll = client.get(job['status_url']).get_json()
+    assert poll['status'] == 'queued'
+    assert 'receipt_url' not in poll
+
+    assert app.extensions['job_queue'].run_pending() == 1
+    poll = client.get(job['status_url']).get_json()
+    assert poll['status'] == 'done'
+    receipt = client.get(poll['receipt_url']).get_json()
+    assert receipt['merchant'] == 'Corner Cafe'
+    assert receipt['total'] == 4.5
+    assert receipt['tags'] == ['coffee']
+
+
+def test_async_job_failure_is_reported(app, client, monkeypatch):
+    def broken(path):
+        raise RuntimeError('tesseract crashed')
+
+    monkeypatch.setattr(ocr_module, 'ocr_extract', broken)
+    job = _upload(client, 'r.png', '?async=1').get_json()
+    app.extensions['job_queue'].run_pending()
+    poll = client.get(job['status_url']).get_json()
+    assert poll['status'] == 'failed'
+    assert 'tesseract crashed' in poll['error']
+
+
+def test_job_claimed_once(app, client):
+    job = _upload(client, 'r.png', '?async=1').get_json()
+    queue = app.extensions['job_queue']
+    with app.app_context():
+        assert queue.process(job['id'])
+        assert not queue.process(job['id'])
+
+
+def test_recover_requeues_pending_rows(app):
+    with app.app_context():
+        db.session.add(Receipt(filename='left-over.png', status='queued'))
+        db.session.add(Receipt(filename='finished.png'))
+        db.session.commit()
+    queue = app.extensions['job_queue']
+    assert queue.recover() == 1
+
+
+def test_recover_reclaims_stale_jobs(app):
+    now = datetime.datetime.utcnow()
+    with app.app_context():
+        db.session.add_all(
+            [
+                # Claimed by a worker that died an hour ago, and one still working
+                Receipt(
+                    filename='stale.png',
+                    status='processing',
+                    updated_at=now - datetime.timedelta(hours=1),
+                ),
+                Receipt(filename='busy.png', status='processing', updated_at=now),
+            ]
+        )
+        db.session.commit()
+    queue = app.extensions['job_queue']
+    assert queue.recover() == 1
+    # Already on the queue: not scheduled twice
+    assert queue.recover() == 0
+    with app.app_context():
+        statuses = dict(db.session.query(Receipt.filename, Receipt.status))
+    assert statuses == {'stale.png': 'queued', 'busy.png': 'processing'}
+
+
+def test_workers_recover_on_first_request(app, client):
+    with app.app_context():
+        receipt = Receipt(filename='left-over.png', status='queued')
+        db.session.add(receipt)
+        db.session.commit()
+        receipt_id = receipt.id
+    app.config.update(UPLOAD_WORKERS=2, ASYNC_UPLOADS=True)
+    client.get('/receipts')
+    recovery = [t for t in threading.enumerate() if t.name == 'ocr-recovery']
+    assert len(recovery) == 1
+    for _ in range(100):
+        status = client.get(f'/jobs/{receipt_id}').get_json()['status']
+        if status not in ('queued', 'processing'):
+            break
+        time.sleep(0.02)
+    # The file is long gone, but the job ran
+    assert status == 'failed'
+
+
+def test_workers_wait_for_async_work(app, client):
+    app.config['UPLOAD_WORKERS'] = 2
+    queue = app.extensions['job_queue']
+    client.get('/receipts')
+    assert _upload(client, 'sync.png').status_code == 201
+    assert not queue._threads and queue._recovery is None
+    assert _upload(client, 'later.png', '?async=1').status_code == 202
+    assert len(queue._threads) == 2 and queue._recovery.is_alive()
+
+
+def test_job_that_raises_is_failed(app, client, monkeypatch):
+    def crash(*args, **kwargs):
+        raise MemoryError()
+
+    monkeypatch.setattr('app.jobs.process_receipt', crash)
+    app.config['UPLOAD_WORKERS'] = 1
+    job = _upload(client, 'r.png', '?async=1').get_json()
+    app.extensions['job_queue'].join()
+    poll = client.get(job['status_url']).get_json()
+    assert poll['status'] == 'failed' and poll['error'] == 'MemoryError'
+
+
+def test_unknown_job(client):
+    assert client.get('/jobs/999').status_code == 404
+
+
+def test_sync_upload_reports_status(client):
+    resp = _upload(client, 'r.png')
+    assert resp.status_code == 201
+    assert resp.get_json()['status'] == 'done'
+
+
+@pytest.mark.benchmark
+def test_burst_latency_stays_flat(app, client):
+    """
+    Load test: a burst of uploads in async mode should be accepted at a
+    roughly constant latency far below the OCR time, while the worker pool
+    drains the queue behind it.
+    """
+    burst = 30
+    app.config['UPLOAD_WORKERS'] = 2
+    sync_latencies = []
+    for i in range(5):
+        start = time.perf_counter()
+        assert _upload(client, f'sync_{i}.png').status_code == 201
+        sync_latencies.append(time.perf_counter() - start)
+
+    latencies = []
+    for i in range(burst):
+        start = time.perf_counter()
+        assert _upload(client, f'burst_{i}.png', '?async=1').status_code == 202
+        latencies.append(time.perf_counter() - start)
+    app.extensions['job_queue'].join()
+
+    # Late requests in the burst are not slower than early ones
+    first, last = latencies[:10], latencies[-10:]
+    assert sum(last) / len(last) < 3 * (sum(first) / len(first)) + 0.01
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    sync_p50 = sorted(sync_latencies)[len(sync_latencies) // 2]
+    print(
+        f"\nsync p50={sync_p50 * 1000:.1f}ms async p50={p50 * 1000:.1f}ms "
+        f"p95={p95 * 1000:.1f}ms"
+    )
+    assert sync_p50 >= OCR_DELAY
+    assert p95 < OCR_DELAY
+    with app.app_context():
+        statuses = {s for (s,) in db.session.query(Receipt.status)}
+    assert statuses == {'done'}
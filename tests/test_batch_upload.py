@@ -0,0 +1,224 @@
+import io
+import os
+import time
+import tempfile
+import numpy as np
+import cv2
+import pytest
+import app.ocr as ocr_module
+from app import create_app, db, pipeline
+from app.models import Receipt
+from app.ocr_engines import TesseractPoolEngine
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def fake_ocr(path):
+        # Stored files are named by hash; the fake image holds the name
+        with open(path) as f:
+            name = f.read()
+        if 'broken' in name:
+            raise RuntimeError('unreadable image')
+        return f'{name}\n2025-04-24\nTotal: 10.00'
+
+    monkeypatch.setattr(ocr_module, 'ocr_extract', fake_ocr)
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda t: {})
+    monkeypatch.setattr(
+        ocr_module, 'parse_receipt_fields_many', lambda texts: [{} for _ in texts]
+    )
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+
+def _files(*names):
+    return [(io.BytesIO(name.rsplit('.', 1)[0].encode()), name) for name in names]
+
+
+def test_batch_upload_all_succeed(client):
+    data = {'files': _files('shop_a.png', 'shop_b.jpg', 'shop_c.png'), 'tags': 'import'}
+    resp = client.post('/upload/batch', data=data, content_type='multipart/form-data')
+    assert resp.status_code == 201
+    body = resp.get_json()
+    assert body['succeeded'] == 3 and body['failed'] == 0
+    assert [r['receipt']['merchant'] for r in body['results']] == [
+        'shop_a',
+        'shop_b',
+        'shop_c',
+    ]
+    assert all(r['receipt']['tags'] == ['import'] for r in body['results'])
+    assert client.get('/receipts').get_json()['total'] == 3
+
+
+def test_batch_upload_partial_failure(client):
+    data = {'files': _files('shop_a.png', 'notes.txt', 'broken.png')}
+    resp = client.post('/upload/batch', data=data, content_type='multipart/form-data')
+    assert resp.status_code == 207
+    results = resp.get_json()['results']
+    assert [r['status'] for r in results] == ['done', 'rejected', 'failed']
+    assert results[1]['error'] == 'File type not allowed'
+    assert 'unreadable image' in results[2]['error']
+    # Rejected files are not stored; OCR failures are kept for retry
+    with client.application.app_context():
+        assert Receipt.query.count() == 2
+
+
+def test_batch_upload_requires_files(client):
+    resp = client.post('/upload/batch', data={}, content_type='multipart/form-data')
+    assert resp.status_code == 400
+
+
+def test_batch_upload_limit(client):
+    client.application.config['MAX_BATCH_FILES'] = 2
+    data = {'files': _files('a.png', 'b.png', 'c.png')}
+    resp = client.post('/upload/batch', data=data, content_type='multipart/form-data')
+    assert resp.status_code == 400
+
+
+def test_batch_upload_ocrs_identical_files_once(client, monkeypatch):
+    seen = []
+
+    def counting_ocr(path):
+        seen.append(path)
+        return f'{open(path).read()}\n2025-04-24\nTotal: 10.00'
+
+    monkeypatch.setattr(ocr_module, 'ocr_extract', counting_ocr)
+    data = {'files': _files('shop_a.png', 'shop_b.png', 'shop_a.png')}
+    body = client.post(
+        '/upload/batch', data=data, content_type='multipart/form-data'
+    ).get_json()
+    assert len(seen) == 2
+    assert [r['receipt']['merchant'] for r in body['results']] == [
+        'shop_a',
+        'shop_b',
+        'shop_a',
+    ]
+    assert len({r['receipt']['id'] for r in body['results']}) == 3
+
+
+@pytest.mark.parametrize(
+    'policy, status', [('reject', 'duplicate'), ('link', 'linked'), ('allow', 'done')]
+)
+def test_batch_dedupes_copies_in_the_same_batch(client, policy, status):
+    data = {'files': _files('shop_a.png', 'shop_b.png', 'shop_a.png')}
+    resp = client.post(
+        f'/upload/batch?dedupe={policy}', data=data, content_type='multipart/form-data'
+    )
+    first, _, copy = resp.get_json()['results']
+    assert copy['status'] == status
+    if policy == 'reject':
+        assert copy['id'] == first['receipt']['id'] and resp.status_code == 207
+    elif policy == 'link':
+        assert copy['receipt'] == first['receipt'] and resp.status_code == 201
+    with client.application.app_context():
+        assert Receipt.query.count() == (3 if policy == 'allow' else 2)
+
+
+def _crashing_ocr(path):
+    with open(path) as f:
+        name = f.read()
+    if name == 'crash':
+        # A worker killed mid-task, e.g. by the OOM killer
+        os._exit(1)
+    return f'{name}\n2025-04-24\nTotal: 10.00'
+
+
+def _install_crashing_ocr():
+    ocr_module.ocr_extract = _crashing_ocr
+
+
+def test_batch_upload_survives_a_dead_worker(client, monkeypatch):
+    client.application.config['BATCH_WORKERS'] = 2
+    # Workers are spawned, so the stub goes in through their initializer
+    monkeypatch.setattr(pipeline, '_init_worker', _install_crashing_ocr)
+    pipeline.shutdown_executor()
+    try:
+        resp = client.post(
+            '/upload/batch',
+            data={'files': _files('crash.png', 'shop_a.png')},
+            content_type='multipart/form-data',
+        )
+        assert resp.status_code == 207
+        results = resp.get_json()['results']
+        assert (
+            results[0]['status'] == 'failed'
+            and results[0]['error'] == 'OCR worker process died'
+        )
+        # The broken pool is replaced for the next batch
+        resp = client.post(
+            '/upload/batch',
+            data={'files': _files('shop_b.png', 'shop_c.png')},
+            content_type='multipart/form-data',
+        )
+        assert resp.status_code == 201
+    finally:
+        pipeline.shutdown_executor()
+
+
+def _child_engine():
+    return ocr_module.get_engine().name
+
+
+def test_batch_workers_do_not_inherit_the_engine(monkeypatch):
+    parent = TesseractPoolEngine('eng', size=1, factory=_fake_recognizer)
+    monkeypatch.setattr(ocr_module, '_engine', parent)
+    pipeline.shutdown_executor()
+    try:
+        executor = pipeline._get_executor(2)
+        assert executor._mp_context.get_start_method() == 'spawn'
+        # Neither the parent's pool nor one pool per worker
+        assert executor.submit(_child_engine).result() == 'pytesseract'
+    finally:
+        pipeline.shutdown_executor()
+        parent.close()
+
+
+def _fake_recognizer(lang, config):
+    return lambda arr: ''
+
+
+def _cpu_bound_ocr(path):
+    ocr_module.preprocess_image(path)
+    return 'Bench Mart\n2025-04-24\nTotal: 1.00'
+
+
+def _install_cpu_bound_ocr():
+    ocr_module.ocr_extract = _cpu_bound_ocr
+
+
+@pytest.mark.benchmark
+def test_extract_many_scaling(monkeypatch, tmp_path):
+    """
+    Benchmark: receipts/sec for serial vs process-pool extraction.
+    Near-linear scaling is only asserted when several cores are available.
+    """
+    monkeypatch.setattr(ocr_module, 'ocr_extract', _cpu_bound_ocr)
+    monkeypatch.setattr(pipeline, '_init_worker', _install_cpu_bound_ocr)
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda t: {})
+    monkeypatch.setattr(
+        ocr_module, 'parse_receipt_fields_many', lambda texts: [{} for _ in texts]
+    )
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(24):
+        path = str(tmp_path / f'r{i}.png')
+        cv2.imwrite(path, rng.integers(0, 255, (600, 400), dtype=np.uint8))
+        paths.append(path)
+    cores = os.cpu_count() or 1
+    timings = {}
+    try:
+        for workers in sorted({1, 2, cores}):
+            start = time.perf_counter()
+            results = pipeline.extract_many(paths, workers)
+            timings[workers] = time.perf_counter() - start
+            assert all(error is None for _, error, _ in results)
+            assert results[0][0]['merchant'] == 'Bench Mart'
+    finally:
+        pipeline.shutdown_executor()
+    for workers, elapsed in timings.items():
+        print(f"\n{workers} worker(s): {len(paths) / elapsed:.1f} receipts/sec")
+    if cores >= 4:
+        assert timings[1] / timings[cores] > cores / 2
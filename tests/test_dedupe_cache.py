@@ -0,0 +1,113 @@
+import io
+import hashlib
+import tempfile
+import pytest
+import app.ocr as ocr_module
+from app import create_app, db
+from app.cache import LRUCache
+from app.models import Receipt
+from app.pipeline import ResultCache
+
+IMAGE = b'same receipt bytes'
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def fake_ocr(path):
+        calls.append(path)
+        return 'Corner Cafe\n2025-04-24\nTotal: 4.50'
+
+    monkeypatch.setattr(ocr_module, 'ocr_extract', fake_ocr)
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda t: {})
+    monkeypatch.setattr(
+        ocr_module, 'parse_receipt_fields_many', lambda texts: [{} for _ in texts]
+    )
+    return calls
+
+
+@pytest.fixture
+def client(calls):
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+
+def _upload(client, name='r.png', query='', content=IMAGE):
+    data = {'file': (io.BytesIO(content), name)}
+    return client.post('/upload' + query, data=data, content_type='multipart/form-data')
+
+
+def test_lru_cache_evicts_least_recent():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache and 'a' in cache
+    assert cache.get('b') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 1, 1)
+
+
+def test_result_cache_keyed_by_pipeline_version(monkeypatch):
+    cache = ResultCache()
+    cache.store('abc', {'merchant': 'A'}, elapsed=2.0)
+    assert cache.lookup('abc') == {'merchant': 'A'}
+    assert cache.stats()['saved_seconds'] == 2.0
+    monkeypatch.setattr(ocr_module, 'TESS_LANG', 'eng')
+    assert cache.lookup('abc') is None
+
+
+def test_repeat_upload_served_from_cache(client, calls):
+    first = _upload(client).get_json()
+    second = _upload(client, name='retry.png').get_json()
+    assert len(calls) == 1
+    assert first['sha256'] == hashlib.sha256(IMAGE).hexdigest()
+    assert second['id'] != first['id']
+    assert second['merchant'] == 'Corner Cafe'
+    metrics = client.get('/metrics').get_json()['ocr_cache']
+    assert metrics['hits'] == 1 and metrics['misses'] == 1
+
+
+def test_dedupe_reject(client):
+    first = _upload(client).get_json()
+    resp = _upload(client, query='?dedupe=reject')
+    assert resp.status_code == 409
+    assert resp.get_json() == {'error': 'Duplicate receipt', 'id': first['id']}
+
+
+def test_dedupe_link(client):
+    first = _upload(client).get_json()
+    resp = _upload(client, name='other.png', query='?dedupe=link')
+    assert resp.status_code == 200
+    assert resp.get_json()['id'] == first['id']
+    with client.application.app_context():
+        assert Receipt.query.count() == 1
+
+
+def test_dedupe_allows_different_content(client):
+    _upload(client)
+    resp = _upload(client, query='?dedupe=reject', content=b'another receipt')
+    assert resp.status_code == 201
+
+
+def test_dedupe_invalid_policy(client):
+    assert _upload(client, query='?dedupe=maybe').status_code == 400
+
+
+def test_batch_upload_uses_cache_and_policy(client, calls):
+    _upload(client)
+    data = {'files': [(io.BytesIO(IMAGE), 'a.png'), (io.BytesIO(b'new'), 'b.png')]}
+    resp = client.post('/upload/batch', data=data, content_type='multipart/form-data')
+    assert resp.status_code == 201
+    assert len(calls) == 2
+    data = {'files': [(io.BytesIO(IMAGE), 'a.png')]}
+    resp = client.post(
+        '/upload/batch?dedupe=reject', data=data, content_type='multipart/form-data'
+    )
+    assert resp.get_json()['results'][0]['status'] == 'duplicate'
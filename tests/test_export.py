@@ -0,0 +1,248 @@
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import pytest
+import sqlalchemy as sa
+from app import create_app, db, export
+from app.config import TestConfig
+from app.models import Receipt
+from app.schemas import ReceiptSchema
+
+# 5M rows takes several minutes to seed; the default keeps the suite quick
+BENCH_ROWS = int(os.getenv('EXPORT_BENCH_ROWS', 200_000))
+
+SAMPLE = [
+    ('Mega Mart', date(2025, 1, 5), 54.10, 'groceries,weekly', 'Big shop'),
+    ('mega mart', date(2025, 2, 1), 12.00, 'groceries', None),
+    (
+        'Corner Cafe',
+        date(2025, 3, 1),
+        4.50,
+        'coffee,breakfast',
+        'Latte, "to go"\nand a bun',
+    ),
+    ('Corner Cafe', None, None, 'coffee', None),
+    ('Café Ünïcode', date(2025, 3, 9), 23.40, None, None),
+]
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+        for i, (merchant, day, total, tags, notes) in enumerate(SAMPLE):
+            db.session.add(
+                Receipt(
+                    filename=f'r{i}.png',
+                    merchant=merchant,
+                    date=day,
+                    total=total,
+                    tags=tags,
+                    notes=notes,
+                    created_at=datetime(2025, 4, 1) + timedelta(minutes=i),
+                )
+            )
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def listing(client, query=''):
+    body = client.get(f'/receipts?per_page=100&{query}').get_json()
+    return [{name: r[name] for name in export.COLUMNS} for r in body['receipts']]
+
+
+def csv_rows(data):
+    rows = list(csv.DictReader(io.StringIO(data.decode())))
+    assert rows and list(rows[0]) == list(export.COLUMNS)
+    return rows
+
+
+@pytest.mark.parametrize(
+    'query', ['', 'merchant_prefix=mega&sort=total', 'tag=coffee', 'sort=-date']
+)
+def test_ndjson_matches_listing(client, query):
+    resp = client.get(f'/receipts/export?format=ndjson&{query}')
+    assert resp.status_code == 200 and resp.mimetype == 'application/x-ndjson'
+    assert resp.headers['Content-Disposition'] == 'attachment; filename=receipts.ndjson'
+    rows = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert rows == listing(client, query)
+
+
+def test_csv_matches_listing(client):
+    resp = client.get('/receipts/export')
+    assert resp.status_code == 200 and resp.mimetype == 'text/csv'
+    expected = listing(client)
+    rows = csv_rows(resp.data)
+    assert [int(r['id']) for r in rows] == [r['id'] for r in expected]
+    for row, want in zip(rows, expected):
+        assert row['notes'] == (want['notes'] or '')
+        assert row['tags'] == ','.join(want['tags'])
+        assert row['total'] == ('' if want['total'] is None else repr(want['total']))
+        assert row['created_at'] == want['created_at']
+
+
+def test_gzip_when_accepted(client):
+    plain = client.get('/receipts/export?format=ndjson')
+    resp = client.get(
+        '/receipts/export?format=ndjson', headers={'Accept-Encoding': 'gzip, deflate'}
+    )
+    assert (
+        resp.headers['Content-Encoding'] == 'gzip'
+        and resp.headers['Vary'] == 'Accept-Encoding'
+    )
+    assert gzip.decompress(resp.data) == plain.data
+    assert 'Content-Encoding' not in plain.headers
+
+
+@pytest.mark.parametrize(
+    'query', ['format=xml', 'date_from=yesterday', 'sort=merchant']
+)
+def test_invalid_params(client, query):
+    resp = client.get(f'/receipts/export?{query}')
+    assert resp.status_code == 400 and 'error' in resp.get_json()
+
+
+def test_streams_in_batches(app):
+    with app.app_context():
+        chunks = list(
+            export.stream(
+                db.engine,
+                export.export_statement(Receipt.query, Receipt.id, False),
+                'ndjson',
+                batch_size=2,
+            )
+        )
+    assert [chunk.count(b'\n') for chunk in chunks] == [2, 2, 1]
+
+
+def test_export_is_a_snapshot(tmp_path, monkeypatch):
+    """
+    Rows written or deleted after the export started do not show up in it.
+    """
+    monkeypatch.setattr(
+        TestConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/export.db'
+    )
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        # WAL lets the writer commit while the export's read is open
+        db.session.execute(sa.text('PRAGMA journal_mode=WAL'))
+        db.session.execute(
+            sa.insert(Receipt),
+            [{'filename': f'r{i}.png', 'status': 'done'} for i in range(50)],
+        )
+        db.session.commit()
+        chunks = export.stream(
+            db.engine,
+            export.export_statement(Receipt.query, Receipt.id, False),
+            'ndjson',
+            batch_size=10,
+        )
+        first = next(chunks)
+        writer = sa.create_engine(f'sqlite:///{tmp_path}/export.db')
+        with writer.begin() as conn:
+            conn.execute(
+                sa.insert(Receipt), [{'filename': 'late.png', 'status': 'done'}]
+            )
+            conn.execute(sa.delete(Receipt).where(Receipt.id > 40))
+        writer.dispose()
+        ids = [
+            json.loads(line)['id'] for line in (first + b''.join(chunks)).splitlines()
+        ]
+    assert ids == list(range(1, 51))
+
+
+def _rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(
+    not os.path.exists('/proc/self/statm'), reason='needs /proc to sample RSS'
+)
+def test_export_benchmark(tmp_path, monkeypatch):
+    """
+    Streams EXPORT_BENCH_ROWS receipts (default 200k) through the endpoint as
+    CSV, NDJSON and gzipped CSV, sampling the worker's RSS per chunk, and
+    compares the row rate with marshmallow dumping ORM objects.
+    """
+    monkeypatch.setattr(
+        TestConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/bench.db'
+    )
+    app = create_app('testing')
+    rng = random.Random(0)
+    start_day = datetime(2023, 1, 1)
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            for offset in range(0, BENCH_ROWS, 50_000):
+                conn.execute(
+                    sa.insert(Receipt),
+                    [
+                        {
+                            'filename': f'r{i}.png',
+                            'status': 'done',
+                            'merchant': f'Shop {rng.randrange(1000)}',
+                            'date': (
+                                start_day + timedelta(days=rng.randrange(1000))
+                            ).date(),
+                            'total': round(rng.uniform(1, 500), 2),
+                            'tags': rng.choice([None, 'food', 'food,travel']),
+                            'notes': rng.choice([None, 'Paid by card']),
+                            'created_at': start_day + timedelta(seconds=i),
+                        }
+                        for i in range(offset, min(offset + 50_000, BENCH_ROWS))
+                    ],
+                )
+        sample = min(BENCH_ROWS, 20_000)
+        start = time.perf_counter()
+        ReceiptSchema(many=True).dump(
+            Receipt.query.order_by(Receipt.id).limit(sample).all()
+        )
+        marshmallow_rate = sample / (time.perf_counter() - start)
+        db.session.remove()
+
+    client = app.test_client()
+    results = {}
+    for name, url, headers in [
+        ('csv', '/receipts/export', {}),
+        ('ndjson', '/receipts/export?format=ndjson', {}),
+        ('csv+gzip', '/receipts/export', {'Accept-Encoding': 'gzip'}),
+    ]:
+        resp = client.get(url, headers=headers, buffered=False)
+        baseline = peak = _rss()
+        size = lines = 0
+        start = time.perf_counter()
+        for chunk in resp.response:
+            size += len(chunk)
+            lines += chunk.count(b'\n')
+            peak = max(peak, _rss())
+        elapsed = time.perf_counter() - start
+        resp.close()
+        if name == 'csv':
+            assert lines == BENCH_ROWS + 1
+        results[name] = (BENCH_ROWS / elapsed, size, (peak - baseline) / 2**20)
+
+    print(f"\n{BENCH_ROWS} receipts; marshmallow dump: {marshmallow_rate:,.0f} rows/s")
+    for name, (rate, size, growth) in results.items():
+        print(
+            f"{name:>9}: {rate:,.0f} rows/s, {size / 2 ** 20:.1f} MiB, RSS "
+            f"+{growth:.1f} MiB"
+        )
+    for rate, _, growth in results.values():
+        assert growth < 64
+        assert rate > marshmallow_rate
@@ -7,12 +7,13 @@ import cv2
 import pytest
 from PIL import Image
 import pytesseract
-import openai
 
 import app.ocr as ocr_module
+from app import llm
 from app.schemas import ReceiptSchema
 from app import create_app, db
 from app.routes import allowed_file
+from llm_stub import fake_client
 
 # Fixtures for Flask app and test client
 def pytest_configure():
@@ -72,13 +73,25 @@ class DummyChoice:
 
 def test_parse_receipt_fields_success(monkeypatch):
     sample = json.dumps({'merchant': 'A', 'date': '2025-01-01', 'total': '9.99'})
-    monkeypatch.setattr(openai.ChatCompletion, 'create', lambda **kwargs: type('R', (), {'choices': [DummyChoice(sample)]}))
+    monkeypatch.setattr(
+        llm,
+        'get_client',
+        lambda: fake_client(
+            lambda **kwargs: type('R', (), {'choices': [DummyChoice(sample)]})
+        ),
+    )
     data = ocr_module.parse_receipt_fields('text')
     assert data == {'merchant': 'A', 'date': '2025-01-01', 'total': '9.99'}
 
 
 def test_parse_receipt_fields_failure(monkeypatch):
-    monkeypatch.setattr(openai.ChatCompletion, 'create', lambda **kwargs: type('R', (), {'choices': [DummyChoice('no json')]}))
+    monkeypatch.setattr(
+        llm,
+        'get_client',
+        lambda: fake_client(
+            lambda **kwargs: type('R', (), {'choices': [DummyChoice('no json')]})
+        ),
+    )
     data = ocr_module.parse_receipt_fields('text')
     assert data == {'merchant': None, 'date': None, 'total': None}
 
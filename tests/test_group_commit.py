@@ -0,0 +1,238 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import sqlalchemy as sa
+import app.ocr as ocr_module
+from app import create_app, db
+from app.config import TestConfig
+from app.models import Receipt, ReceiptTag
+
+PG_URL = os.getenv('TEST_POSTGRES_URL')
+BENCH_UPLOADS = int(os.getenv('GROUP_COMMIT_BENCH_UPLOADS', 320))
+
+
+@pytest.fixture
+def make_app(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        ocr_module, 'ocr_extract', lambda path: 'Corner Cafe\n2025-04-24\nTotal: 4.50'
+    )
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda text: {})
+    apps = []
+
+    def make(url=None, **config):
+        # Writers run on other threads, which :memory: cannot share
+        monkeypatch.setattr(
+            TestConfig,
+            'SQLALCHEMY_DATABASE_URI',
+            url or f"sqlite:///{tmp_path / 'writes.db'}",
+        )
+        for name, value in config.items():
+            monkeypatch.setattr(TestConfig, name, value, raising=False)
+        app = create_app('testing')
+        app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        app.extensions['group_commit'].shutdown()
+        app.extensions['job_queue'].shutdown()
+
+
+def concurrently(count, fn):
+    start = threading.Barrier(count)
+
+    def run(i):
+        start.wait()
+        return fn(i)
+
+    with ThreadPoolExecutor(count) as pool:
+        return list(pool.map(run, range(count)))
+
+
+def test_concurrent_inserts_share_commits(make_app):
+    app = make_app(GROUP_COMMIT=True, GROUP_COMMIT_ROWS=100, GROUP_COMMIT_MS=200)
+    writer = app.extensions['group_commit']
+    ids = concurrently(20, lambda i: writer.insert(filename=f'r{i}.png', tags='food'))
+    assert len(set(ids)) == 20 and writer.commits == 1 and writer.writes == 20
+    with app.app_context():
+        assert Receipt.query.count() == 20 and ReceiptTag.query.count() == 20
+
+
+def test_group_size_triggers_commit(make_app):
+    # A wait far longer than the test: only the row count can end a group
+    app = make_app(GROUP_COMMIT=True, GROUP_COMMIT_ROWS=5, GROUP_COMMIT_MS=60_000)
+    writer = app.extensions['group_commit']
+    start = time.perf_counter()
+    concurrently(10, lambda i: writer.insert(filename=f'r{i}.png'))
+    assert time.perf_counter() - start < 30 and writer.commits == 2
+
+
+def test_writes_are_durable_on_return(make_app, tmp_path):
+    app = make_app(GROUP_COMMIT=True, GROUP_COMMIT_MS=20)
+    writer = app.extensions['group_commit']
+    other = sa.create_engine(f"sqlite:///{tmp_path / 'writes.db'}")
+    receipt_id = writer.insert(filename='a.png')
+    writer.update(receipt_id, merchant='Mega Mart', ocr_text='MEGA MART')
+    with other.connect() as conn:
+        assert (
+            conn.execute(
+                sa.text('SELECT merchant FROM receipts WHERE id = :id'),
+                {'id': receipt_id},
+            ).scalar()
+            == 'Mega Mart'
+        )
+    other.dispose()
+
+
+def test_failed_write_fails_alone(make_app):
+    app = make_app(GROUP_COMMIT=True, GROUP_COMMIT_ROWS=100, GROUP_COMMIT_MS=200)
+    writer = app.extensions['group_commit']
+    receipt_id = writer.insert(filename='a.png')
+
+    def write(i):
+        try:
+            if i == 0:
+                writer.update(999, merchant='Nobody')
+            elif i == 1:
+                writer.update(receipt_id, merchant='Mega Mart')
+            else:
+                writer.insert(filename=f'r{i}.png')
+        except LookupError as e:
+            return e
+
+    results = concurrently(6, write)
+    assert isinstance(results[0], LookupError) and results[1:] == [None] * 5
+    assert writer.retries == 1
+    with app.app_context():
+        assert (
+            Receipt.query.count() == 5
+            and db.session.get(Receipt, receipt_id).merchant == 'Mega Mart'
+        )
+
+
+def _upload(client, name, query=''):
+    data = {'file': (io.BytesIO(name.encode()), name), 'tags': 'coffee'}
+    return client.post('/upload' + query, data=data, content_type='multipart/form-data')
+
+
+def test_upload_through_writer(make_app):
+    app = make_app(GROUP_COMMIT=True, GROUP_COMMIT_MS=1)
+    client = app.test_client()
+    resp = _upload(client, 'a.png')
+    assert resp.status_code == 201
+    receipt = resp.get_json()
+    assert (
+        receipt['merchant'],
+        receipt['total'],
+        receipt['status'],
+        receipt['tags'],
+    ) == ('Corner Cafe', 4.5, 'done', ['coffee'])
+    assert client.get(f"/receipts/{receipt['id']}").get_json() == receipt
+    assert (
+        client.get('/analytics/summary?group_by=day').get_json()['groups'][0][
+            'receipts'
+        ]
+        == 1
+    )
+    stats = client.get('/metrics').get_json()['group_commit']
+    assert stats['writes'] == 2 and stats['enabled']
+
+    # Async uploads insert through the writer, and so do the workers' results
+    job = _upload(client, 'b.png', '?async=1').get_json()
+    assert job['status'] == 'queued'
+    assert app.extensions['job_queue'].run_pending() == 1
+    assert client.get(job['status_url']).get_json()['status'] == 'done'
+
+
+def _commit_counter(engine):
+    commits = []
+    sa.event.listen(engine, 'commit', lambda conn: commits.append(1))
+    return commits
+
+
+@pytest.mark.parametrize(
+    'url',
+    [
+        None,
+        pytest.param(
+            PG_URL,
+            marks=pytest.mark.skipif(
+                not PG_URL, reason='set TEST_POSTGRES_URL to run against Postgres'
+            ),
+        ),
+    ],
+    ids=['sqlite', 'postgres'],
+)
+@pytest.mark.benchmark
+def test_group_commit_benchmark(make_app, tmp_path, url):
+    """
+    BENCH_UPLOADS uploads (default 320) from 1, 8 and 32 concurrent
+    clients, each upload a row insert and a parse-result update, with and
+    without group commit. Reports database commits per second, uploads
+    per second and upload p50/p99. SQLite runs in WAL mode with
+    synchronous=FULL, so every commit is an fsync.
+    """
+    results = {}
+    for grouped in (False, True):
+        app = make_app(
+            url, GROUP_COMMIT=grouped, GROUP_COMMIT_ROWS=64, GROUP_COMMIT_MS=2
+        )
+        with app.app_context():
+            if url is None:
+                with db.engine.connect() as conn:
+                    conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+                sa.event.listen(
+                    db.engine,
+                    'connect',
+                    lambda dbapi, record: dbapi.execute('PRAGMA synchronous=FULL'),
+                )
+            commits = _commit_counter(db.engine)
+        for clients in (1, 8, 32):
+            uploads = BENCH_UPLOADS // clients
+            commits.clear()
+
+            def run(i):
+                client, timings = app.test_client(), []
+                for n in range(uploads):
+                    start = time.perf_counter()
+                    assert (
+                        _upload(client, f'{grouped}-{clients}-{i}-{n}.png').status_code
+                        == 201
+                    )
+                    timings.append(time.perf_counter() - start)
+                return timings
+
+            start = time.perf_counter()
+            timings = sorted(
+                t for per_client in concurrently(clients, run) for t in per_client
+            )
+            elapsed = time.perf_counter() - start
+            results[grouped, clients] = (
+                len(commits) / elapsed,
+                len(timings) / elapsed,
+                timings[len(timings) // 2] * 1000,
+                timings[int(len(timings) * 0.99)] * 1000,
+            )
+        with app.app_context():
+            assert Receipt.query.filter_by(status='done').count() == sum(
+                BENCH_UPLOADS // clients * clients for clients in (1, 8, 32)
+            )
+
+    print()
+    for (grouped, clients), (commit_rate, upload_rate, p50, p99) in results.items():
+        print(
+            f"{'group commit' if grouped else 'per-request':>12}, {clients:>2} "
+            "clients: "
+            f"{commit_rate:,.0f} commits/s, {upload_rate:,.0f} uploads/s, p50 "
+            f"{p50:.1f}ms, p99 {p99:.1f}ms"
+        )
+    # With many writers, sharing commits must pay off
+    assert results[True, 32][1] > results[False, 32][1]
@@ -0,0 +1,203 @@
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import pytest
+import sqlalchemy as sa
+from app import create_app, db
+from app.cache import LRUCache
+from app.models import Receipt
+from app.read_cache import ReadCache
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+        for i in range(5):
+            db.session.add(
+                Receipt(
+                    filename=f'r{i}.png',
+                    merchant=f'Shop {i}',
+                    date=date(2025, 1, i + 1),
+                    total=10.0 + i,
+                    tags='food',
+                    created_at=datetime(2025, 4, 1, i),
+                )
+            )
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def update(app, receipt_id, **values):
+    with app.app_context():
+        receipt = db.session.get(Receipt, receipt_id)
+        for name, value in values.items():
+            setattr(receipt, name, value)
+        db.session.commit()
+
+
+def test_updated_at_tracks_writes(app):
+    with app.app_context():
+        receipt = db.session.get(Receipt, 1)
+        created = receipt.updated_at
+        assert created is not None
+        receipt.tags = 'food,travel'
+        db.session.commit()
+        assert receipt.updated_at > created
+
+
+def test_receipt_conditional_get(app, client):
+    resp = client.get('/receipts/1')
+    etag, last_modified = resp.headers['ETag'], resp.headers['Last-Modified']
+    assert resp.status_code == 200 and resp.headers['Cache-Control'] == 'no-cache'
+    again = client.get('/receipts/1', headers={'If-None-Match': etag})
+    assert (
+        again.status_code == 304 and again.data == b'' and again.headers['ETag'] == etag
+    )
+    assert (
+        client.get(
+            '/receipts/1', headers={'If-Modified-Since': last_modified}
+        ).status_code
+        == 304
+    )
+    # Each field set is a different representation
+    sparse = client.get('/receipts/1?fields=id,total', headers={'If-None-Match': etag})
+    assert sparse.status_code == 200 and sparse.headers['ETag'] != etag
+
+    update(app, 1, tags='food,travel')
+    changed = client.get('/receipts/1', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert changed.get_json()['tags'] == ['food', 'travel']
+    old = {'If-Modified-Since': 'Wed, 01 Jan 2020 00:00:00 GMT'}
+    assert client.get('/receipts/1', headers=old).status_code == 200
+    assert (
+        client.get('/receipts/999', headers={'If-None-Match': etag}).status_code == 404
+    )
+
+
+@pytest.mark.parametrize(
+    'query',
+    [
+        '',
+        '?sort=total&per_page=2',
+        '?cursor=&per_page=2',
+        '?cursor=&count=exact',
+        '?tag=food&fields=id',
+    ],
+)
+def test_listing_conditional_get(app, client, query):
+    etag = client.get(f'/receipts{query}').headers['ETag']
+    assert (
+        client.get(f'/receipts{query}', headers={'If-None-Match': etag}).status_code
+        == 304
+    )
+
+    update(app, 5, merchant='Renamed')
+    update(app, 1, total=99.0)
+    resp = client.get(f'/receipts{query}', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+    assert (
+        client.get(f'/receipts{query}', headers={'If-None-Match': etag}).status_code
+        == 304
+    )
+
+
+def test_listing_sees_deletes_and_inserts(app, client):
+    etag = client.get('/receipts?per_page=2').headers['ETag']
+    with app.app_context():
+        db.session.delete(db.session.get(Receipt, 3))
+        db.session.commit()
+    resp = client.get('/receipts?per_page=2', headers={'If-None-Match': etag})
+    assert resp.status_code == 200 and resp.get_json()['total'] == 4
+    etag = resp.headers['ETag']
+    with app.app_context():
+        db.session.add(Receipt(filename='new.png', created_at=datetime(2025, 1, 1)))
+        db.session.commit()
+    # The new receipt sorts last, off this page, but the total changed
+    assert (
+        client.get('/receipts?per_page=2', headers={'If-None-Match': etag}).status_code
+        == 200
+    )
+
+
+def test_listing_ignores_if_modified_since(client):
+    resp = client.get('/receipts?cursor=')
+    headers = {'If-Modified-Since': resp.headers['Last-Modified']}
+    assert client.get('/receipts?cursor=', headers=headers).status_code == 200
+
+
+@pytest.mark.benchmark
+def test_polling_benchmark(app):
+    """
+    200 clients each poll one receipt and the first page of the listing
+    while one receipt in 20 is updated between rounds. Compares bytes sent,
+    SQL statements run by the polls and time taken by clients that ignore
+    the validators with clients that send If-None-Match.
+    """
+    # HTTP validation alone, without the read cache in front of the database
+    app.extensions['read_cache'] = ReadCache(LRUCache(0, sizeof=len))
+    with app.app_context():
+        db.session.execute(
+            sa.insert(Receipt),
+            [
+                {
+                    'filename': f'b{i}.png',
+                    'merchant': f'Shop {i % 50}',
+                    'total': float(i % 300),
+                    'date': date(2025, 1, 1) + timedelta(days=i % 200),
+                    'status': 'done',
+                    'created_at': datetime(2025, 1, 1) + timedelta(minutes=i),
+                }
+                for i in range(2000)
+            ],
+        )
+        db.session.commit()
+        ids = [rid for (rid,) in db.session.query(Receipt.id)]
+        statements = []
+        sa.event.listen(
+            db.engine, 'before_cursor_execute', lambda *args: statements.append(1)
+        )
+    client = app.test_client()
+    rng = random.Random(0)
+    clients = [(rng.choice(ids), {}) for _ in range(200)]
+
+    def run(conditional, rounds=5):
+        sent = queries = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for receipt_id, etags in clients:
+                for url in (f'/receipts/{receipt_id}', '/receipts?cursor=&per_page=20'):
+                    headers = (
+                        {'If-None-Match': etags[url]}
+                        if conditional and url in etags
+                        else {}
+                    )
+                    statements.clear()
+                    resp = client.get(url, headers=headers)
+                    queries += len(statements)
+                    assert resp.status_code in (200, 304)
+                    etags[url] = resp.headers['ETag']
+                    sent += len(resp.data)
+            for receipt_id in rng.sample(ids, len(ids) // 20):
+                update(app, receipt_id, notes=f'edit {rng.random()}')
+        return sent, queries, time.perf_counter() - start
+
+    plain_bytes, plain_queries, plain_time = run(conditional=False)
+    cond_bytes, cond_queries, cond_time = run(conditional=True)
+    print(
+        f"\nplain: {plain_bytes / 1024:.0f} KiB, {plain_queries} statements, "
+        f"{plain_time:.2f}s"
+        f"\nconditional: {cond_bytes / 1024:.0f} KiB, {cond_queries} statements, "
+        f"{cond_time:.2f}s"
+    )
+    assert cond_bytes < plain_bytes / 2
+    assert cond_queries < plain_queries
@@ -0,0 +1,274 @@
+import io
+import os
+import tempfile
+import cv2
+import numpy as np
+import pytest
+import app.ocr as ocr_module
+from app import create_app, db, images, storage
+from app.models import Receipt
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(
+        ocr_module, 'ocr_extract', lambda path: 'Corner Cafe\n2025-04-24\nTotal: 4.50'
+    )
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda text: {})
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def photo(seed=0, size=(3000, 2200), ext='.jpg') -> bytes:
+    """
+    A phone photo of a receipt: lines of dark "text" on noisy paper.
+    """
+    rng = np.random.default_rng(seed)
+    h, w = size
+    img = rng.normal(225, 12, (h, w, 3)).clip(0, 255).astype(np.uint8)
+    for y in range(150, h - 150, 90):
+        x = 150
+        while x < w - 300:
+            word = int(rng.integers(60, 260))
+            cv2.rectangle(img, (x, y), (x + word, y + 40), (40, 40, 40), -1)
+            x += word + 40
+    params = [cv2.IMWRITE_JPEG_QUALITY, 95] if ext == '.jpg' else []
+    return cv2.imencode(ext, img, params)[1].tobytes()
+
+
+def _upload(client, data, name, query=''):
+    resp = client.post(
+        '/upload' + query,
+        data={'file': (io.BytesIO(data), name)},
+        content_type='multipart/form-data',
+    )
+    assert resp.status_code in (201, 202)
+    return resp.get_json()['id']
+
+
+def _exists(key):
+    return storage.get_storage().exists(key)
+
+
+def _decode(data) -> np.ndarray:
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def test_derive(tmp_path):
+    path = tmp_path / 'r.jpg'
+    path.write_bytes(photo())
+    copies = images.derive(str(path))
+    full, thumb = _decode(copies['full']), _decode(copies['thumb'])
+    # WebP has no grayscale mode: the channels differ only by rounding
+    for img in (full, thumb):
+        assert np.abs(img.astype(int) - img[..., :1]).max() <= 2
+    assert (
+        max(full.shape) == images.IMAGE_FULL_SIDE
+        and max(thumb.shape) == images.IMAGE_THUMB_SIDE
+    )
+    jpeg = _decode(
+        images.encode(images.load(str(path), images.IMAGE_FULL_SIDE), 'jpeg')
+    )
+    assert jpeg.ndim == 2
+    assert copies['full'][8:12] == b'WEBP'
+    assert len(copies['full']) < path.stat().st_size / 5
+
+
+def test_image_before_compaction(app):
+    client = app.test_client()
+    original = photo()
+    receipt_id = _upload(client, original, 'r.jpg')
+    resp = client.get(f'/receipts/{receipt_id}/image')
+    assert resp.data == original and resp.mimetype == 'image/jpeg'
+    assert (
+        'no-cache' in resp.headers['Cache-Control']
+        and 'private' in resp.headers['Cache-Control']
+    )
+    resp = client.get(f'/receipts/{receipt_id}/image?size=thumb')
+    assert (
+        resp.mimetype == 'image/webp'
+        and max(_decode(resp.data).shape) == images.IMAGE_THUMB_SIDE
+    )
+    assert (
+        client.get(
+            f'/receipts/{receipt_id}/image?size=thumb',
+            headers={'If-None-Match': resp.headers['ETag']},
+        ).status_code
+        == 304
+    )
+    assert client.get(f'/receipts/{receipt_id}/image?size=huge').status_code == 400
+    assert client.get('/receipts/999/image').status_code == 404
+
+
+@pytest.mark.parametrize('filename', ['/etc/passwd', '../../etc/passwd', ''])
+def test_no_file_outside_the_upload_folder(app, filename):
+    with app.app_context():
+        receipt = Receipt(filename=filename)
+        db.session.add(receipt)
+        db.session.commit()
+        receipt_id = receipt.id
+    client = app.test_client()
+    for size in images.SIZES:
+        assert (
+            client.get(f'/receipts/{receipt_id}/image?size={size}').status_code == 404
+        )
+    # Through an import too
+    client.post(
+        '/receipts/import',
+        data='{"filename": "/etc/passwd"}',
+        content_type='application/x-ndjson',
+    )
+    assert client.get(f'/receipts/{receipt_id + 1}/image').status_code == 404
+
+
+def test_legacy_upload(app):
+    original = photo(size=(400, 300))
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], 'old.jpg'), 'wb') as f:
+        f.write(original)
+    with app.app_context():
+        receipt = Receipt(filename='old.jpg')
+        db.session.add(receipt)
+        db.session.commit()
+        receipt_id = receipt.id
+    assert app.test_client().get(f'/receipts/{receipt_id}/image').data == original
+
+
+def test_compact(app):
+    client = app.test_client()
+    ids = [_upload(client, photo(i), f'r{i}.jpg') for i in range(3)]
+    # A PNG screenshot, and the same bytes uploaded twice
+    ids.append(_upload(client, photo(3, (1800, 900), '.png'), 'shot.png'))
+    ids.append(_upload(client, photo(0), 'again.jpg'))
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=['receipts', 'compact', '--workers', '2', '--batch-size', '3']
+    )
+    assert result.exit_code == 0
+    assert (
+        'Compacted 4 files for 5 receipts' in result.output
+        and 'Replaced 0 originals' in result.output
+    )
+    resp = client.get(f'/receipts/{ids[0]}/image')
+    assert (
+        resp.mimetype == 'image/webp'
+        and max(_decode(resp.data).shape) == images.IMAGE_FULL_SIDE
+    )
+    assert (
+        'immutable' in resp.headers['Cache-Control']
+        and 'max-age=31536000' in resp.headers['Cache-Control']
+    )
+    assert (
+        client.get(
+            f'/receipts/{ids[0]}/image', headers={'If-None-Match': resp.headers['ETag']}
+        ).status_code
+        == 304
+    )
+    assert client.get(f'/receipts/{ids[4]}/image').data == resp.data
+    # The originals are kept, and a second run has nothing to do
+    with app.app_context():
+        for receipt in Receipt.query:
+            assert _exists(receipt.storage_key) and receipt.image_key.endswith(
+                '.full.webp'
+            )
+    result = runner.invoke(args=['receipts', 'compact'])
+    assert 'Compacted 0 files for 0 receipts' in result.output
+
+
+def test_replace_originals(app):
+    client = app.test_client()
+    done = _upload(client, photo(0), 'done.jpg')
+    queued = _upload(client, photo(1), 'queued.jpg', '?async=1')
+    with app.app_context():
+        original = db.session.get(Receipt, done).storage_key
+        report = images.compact_all(replace_originals=True).to_dict()
+        assert report['files'] == 2 and report['replaced'] == 1
+        assert report['bytes_saved'] > 0.8 * len(photo(0)) - report['compact_bytes']
+        receipt, waiting = db.session.get(Receipt, done), db.session.get(
+            Receipt, queued
+        )
+        assert (
+            receipt.storage_key == receipt.image_key
+            and waiting.storage_key != waiting.image_key
+        )
+        assert not _exists(original) and _exists(waiting.storage_key)
+        # Reprocessing reads the compact copy
+        with storage.receipt_file(receipt) as path:
+            assert ocr_module.load_grayscale(path).shape[0] == images.IMAGE_FULL_SIDE
+    # The job still has its original to OCR
+    assert app.extensions['job_queue'].run_pending() == 1
+    assert client.get(f'/receipts/{queued}').get_json()['status'] == 'done'
+
+
+def test_object_store_backend(app):
+    app.config['STORAGE_BACKEND'] = 'memory'
+    client = app.test_client()
+    receipt_id = _upload(client, photo(), 'r.jpg')
+    with app.app_context():
+        report = images.compact_all(replace_originals=True)
+    assert (report.files, report.replaced) == (1, 1)
+    objects = app.extensions['storage'].objects
+    assert sorted(key.rsplit('.', 2)[1] for key in objects) == ['full', 'thumb']
+    resp = client.get(f'/receipts/{receipt_id}/image?size=thumb')
+    assert (
+        resp.mimetype == 'image/webp' and 'immutable' in resp.headers['Cache-Control']
+    )
+
+
+def test_compact_resumes(app, monkeypatch):
+    client = app.test_client()
+    for i in range(4):
+        _upload(client, photo(i, (1200, 900)), f'r{i}.jpg')
+    with app.app_context():
+        keys = sorted(r.storage_key for r in Receipt.query)
+    compact_file = images._compact_file
+
+    def crash_on_third(backend, key, digest):
+        if key == keys[2]:
+            raise OSError('disk went away')
+        return compact_file(backend, key, digest)
+
+    monkeypatch.setattr(images, '_compact_file', crash_on_third)
+    with app.app_context(), pytest.raises(OSError):
+        images.compact_all(workers=2, batch_size=2)
+    with app.app_context():
+        assert Receipt.query.filter(Receipt.image_key.isnot(None)).count() == 2
+    monkeypatch.setattr(images, '_compact_file', compact_file)
+    with app.app_context():
+        assert images.compact_all(workers=2, batch_size=2).files == 2
+        assert Receipt.query.filter(Receipt.image_key.is_(None)).count() == 0
+
+
+def test_undecodable_upload_is_reported(app):
+    client = app.test_client()
+    receipt_id = _upload(client, b'not an image', 'broken.png')
+    assert client.get(f'/receipts/{receipt_id}/image?size=thumb').status_code == 404
+    result = app.test_cli_runner().invoke(args=['receipts', 'compact'])
+    assert result.exit_code == 1 and '1 failed' in result.output
+
+
+@pytest.mark.benchmark
+def test_compaction_report(app):
+    """
+    Bytes saved by compacting 5 phone photos and replacing the originals.
+    """
+    client = app.test_client()
+    for i in range(5):
+        _upload(client, photo(i), f'r{i}.jpg')
+    with app.app_context():
+        report = images.compact_all(replace_originals=True).to_dict()
+    print(
+        f"\n{report['files']} photos: {report['original_bytes'] / 2 ** 20:.1f} MiB -> "
+        f"{report['compact_bytes'] / 2 ** 20:.2f} MiB, "
+        f"{report['bytes_saved'] / 2 ** 20:.1f} MiB saved"
+    )
+    assert report['bytes_saved'] > 0.8 * report['original_bytes']
+    folder = app.config['UPLOAD_FOLDER']
+    stored = sum(
+        os.path.getsize(os.path.join(d, f))
+        for d, _, files in os.walk(folder)
+        for f in files
+    )
+    assert stored == report['compact_bytes']
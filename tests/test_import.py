@@ -0,0 +1,350 @@
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+import pytest
+import sqlalchemy as sa
+from app import analytics, create_app, db, importer
+from app.config import TestConfig
+from app.models import Receipt, ReceiptTag, SpendRollup
+
+# 100k rows is what onboarding a customer typically loads
+BENCH_ROWS = int(os.getenv('IMPORT_BENCH_ROWS', 100_000))
+
+ROWS = [
+    {
+        'import_key': 'acme-1',
+        'merchant': 'Mega Mart',
+        'date': '2025-01-05',
+        'total': 54.1,
+        'tags': ['groceries', 'weekly'],
+        'notes': 'Big shop',
+    },
+    {
+        'import_key': 'acme-2',
+        'merchant': 'Corner Cafe',
+        'date': '2025-03-01',
+        'total': '4.50',
+        'tags': 'coffee',
+    },
+    {'merchant': 'Taxi Co', 'total': 23},
+]
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def ndjson(rows) -> bytes:
+    return b''.join(json.dumps(row).encode() + b'\n' for row in rows)
+
+
+def post(client, data, content_type='application/x-ndjson', query=''):
+    return client.post(f'/receipts/import{query}', data=data, content_type=content_type)
+
+
+def rollups():
+    return sorted(
+        tuple(r)
+        for r in db.session.query(
+            SpendRollup.grain,
+            SpendRollup.dimension,
+            SpendRollup.period,
+            SpendRollup.key,
+            SpendRollup.receipts,
+            SpendRollup.total_cents,
+        )
+    )
+
+
+def test_import_ndjson(app, client):
+    resp = post(client, ndjson(ROWS))
+    assert resp.status_code == 201
+    assert resp.get_json() == {
+        'imported': 3,
+        'duplicates': 0,
+        'failed': 0,
+        'errors': [],
+        'errors_truncated': False,
+    }
+    receipts = client.get('/receipts?sort=total').get_json()['receipts']
+    assert [
+        (r['merchant'], r['total'], r['tags'], r['import_key'], r['status'])
+        for r in receipts
+    ] == [
+        ('Corner Cafe', 4.5, ['coffee'], 'acme-2', 'done'),
+        ('Taxi Co', 23.0, [], None, 'done'),
+        ('Mega Mart', 54.1, ['groceries', 'weekly'], 'acme-1', 'done'),
+    ]
+    with app.app_context():
+        # Tag links and rollups match what the ORM hooks would have written
+        assert ReceiptTag.query.count() == 3
+        imported = rollups()
+        analytics.rebuild_rollups()
+        assert rollups() == imported and imported
+
+
+def test_import_is_idempotent(app, client):
+    assert post(client, ndjson(ROWS[:1])).status_code == 201
+    resp = post(client, ndjson(ROWS + ROWS[1:2]))
+    assert resp.status_code == 201
+    # acme-1 was already stored and acme-2 repeats; unkeyed rows always import
+    assert resp.get_json()['imported'] == 2 and resp.get_json()['duplicates'] == 2
+    assert client.get('/receipts').get_json()['total'] == 3
+    resp = post(client, ndjson(ROWS[:2]), query='?format=ndjson')
+    assert (
+        resp.get_json()['duplicates'] == 2
+        and client.get('/receipts').get_json()['total'] == 3
+    )
+
+
+def test_duplicates_across_chunks(app):
+    with app.app_context():
+        report = importer.import_receipts(
+            io.BytesIO(ndjson([ROWS[0]] * 5 + ROWS[1:])), 'ndjson', chunk_size=2
+        )
+        assert (report.imported, report.duplicates) == (3, 4)
+        assert Receipt.query.count() == 3
+
+
+def test_row_errors(client):
+    lines = [
+        json.dumps(ROWS[0]),
+        '',
+        json.dumps({'date': '05/01/2025'}),
+        '{"total": ',
+        json.dumps([1]),
+        json.dumps({'total': True}),
+        json.dumps({'tags': [1]}),
+        json.dumps({'merchant': 'x' * 129}),
+        json.dumps({'import_key': 7}),
+        json.dumps({'total': 'NaN'}),
+        json.dumps(ROWS[1]),
+    ]
+    resp = post(client, '\n'.join(lines))
+    body = resp.get_json()
+    assert resp.status_code == 207 and body['imported'] == 2 and body['failed'] == 8
+    assert body['errors'][:3] == [
+        {'line': 3, 'error': 'date must be YYYY-MM-DD'},
+        {'line': 4, 'error': 'invalid JSON'},
+        {'line': 5, 'error': 'row must be an object'},
+    ]
+    assert [e['line'] for e in body['errors']] == [3, 4, 5, 6, 7, 8, 9, 10]
+
+
+def test_filename_is_a_bare_name(client):
+    names = ['/etc/passwd', '../../app/config.py', 'C:\\scans\\r 1.pdf', 'scan-1.pdf']
+    post(client, ndjson([{'filename': name} for name in names]))
+    receipts = client.get('/receipts?sort=created_at').get_json()['receipts']
+    assert [r['filename'] for r in receipts] == [
+        'passwd',
+        'config.py',
+        'r_1.pdf',
+        'scan-1.pdf',
+    ]
+
+
+def test_errors_are_capped(client, monkeypatch):
+    monkeypatch.setattr(importer, 'IMPORT_MAX_ERRORS', 3)
+    body = post(client, ndjson([{'total': 'x'}] * 10)).get_json()
+    assert (
+        body['failed'] == 10 and len(body['errors']) == 3 and body['errors_truncated']
+    )
+
+
+def test_export_round_trip(app, client):
+    post(client, ndjson(ROWS))
+    exported = client.get('/receipts/export').data
+    # An export's id, status and created_at columns are ignored
+    resp = client.post(
+        '/receipts/import',
+        data={'file': (io.BytesIO(exported), 'receipts.csv')},
+        content_type='multipart/form-data',
+    )
+    assert resp.status_code == 201 and resp.get_json()['imported'] == 3
+    fields = ('merchant', 'date', 'total', 'notes', 'tags')
+    receipts = client.get('/receipts?sort=total').get_json()['receipts']
+    copies = [tuple(r[f] for f in fields) for r in receipts]
+    assert copies[::2] == copies[1::2] and len(copies) == 6
+
+
+def test_csv_body(client):
+    data = (
+        'import_key,merchant,date,total,tags\n'
+        'k1,Mega Mart,2025-01-05,54.10,"food,weekly"\n'
+        'k2,,,,\n'
+    )
+    resp = post(client, data.encode('utf-8-sig'), content_type='text/csv')
+    assert resp.status_code == 201 and resp.get_json()['imported'] == 2
+    receipt = client.get('/receipts?sort=date').get_json()['receipts'][0]
+    assert receipt['tags'] == ['food', 'weekly'] and receipt['date'] == '2025-01-05'
+
+
+def test_unreadable_csv_stops(client):
+    resp = post(client, b'merchant\nOk\nBad \xff\nNever\n', content_type='text/csv')
+    body = resp.get_json()
+    assert resp.status_code == 207 and body['failed'] == 1
+    assert 'unreadable input' in body['errors'][0]['error']
+
+
+@pytest.mark.parametrize(
+    'data, content_type, query',
+    [
+        (b'{}', 'application/json', ''),
+        (b'{}', 'application/x-ndjson', '?format=xml'),
+        (b'a,b\n1,2\n', 'text/csv', ''),
+    ],
+)
+def test_bad_requests(client, data, content_type, query):
+    resp = post(client, data, content_type, query)
+    assert resp.status_code == 400 and 'error' in resp.get_json()
+    assert client.get('/receipts').get_json()['total'] == 0
+
+
+def test_import_invalidates_caches(app, client):
+    assert client.get('/receipts').get_json()['total'] == 0
+    with app.app_context():
+        generation = analytics._generation
+    post(client, ndjson(ROWS))
+    assert client.get('/receipts').get_json()['total'] == 3
+    with app.app_context():
+        assert analytics._generation > generation
+
+
+def test_cli_import(app, tmp_path):
+    path = tmp_path / 'receipts.jsonl'
+    path.write_bytes(ndjson(ROWS + [{'date': 'soon'}]))
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['receipts', 'import', str(path), '--chunk-size', '2'])
+    assert result.exit_code == 1
+    assert 'Imported 3 receipts, 0 duplicates, 1 failed' in result.output
+    assert 'line 4: date must be YYYY-MM-DD' in result.output
+    result = runner.invoke(
+        args=['receipts', 'import', '--format', 'ndjson', '-'], input=ndjson(ROWS[:2])
+    )
+    assert (
+        result.exit_code == 0 and 'Imported 0 receipts, 2 duplicates' in result.output
+    )
+    assert runner.invoke(args=['receipts', 'import', '-'], input=b'').exit_code == 2
+
+
+def _rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(
+    not os.path.exists('/proc/self/statm'), reason='needs /proc to sample RSS'
+)
+def test_import_benchmark(tmp_path, monkeypatch):
+    """
+    Imports IMPORT_BENCH_ROWS receipts (default 100k) from an NDJSON file
+    through the endpoint, sampling RSS on a background thread, then imports
+    the file again (every row a duplicate). Compares the row rate with
+    adding ORM objects 1,000 per commit.
+    """
+    monkeypatch.setattr(
+        TestConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/bench.db'
+    )
+    app = create_app('testing')
+    rng = random.Random(0)
+    path = tmp_path / 'receipts.jsonl'
+    with open(path, 'wb') as f:
+        for i in range(BENCH_ROWS):
+            f.write(
+                json.dumps(
+                    {
+                        'import_key': f'legacy-{i}',
+                        'merchant': f'Shop {rng.randrange(1000)}',
+                        'date': (
+                            date(2023, 1, 1) + timedelta(days=rng.randrange(1000))
+                        ).isoformat(),
+                        'total': round(rng.uniform(1, 500), 2),
+                        'tags': rng.choice([[], ['food'], ['food', 'travel']]),
+                        'notes': rng.choice([None, 'Paid by card']),
+                        'filename': f'scan-{i}.pdf',
+                    }
+                ).encode()
+                + b'\n'
+            )
+    with app.app_context():
+        db.create_all()
+        sample = min(BENCH_ROWS, 5000)
+        start = time.perf_counter()
+        for offset in range(0, sample, 1000):
+            db.session.add_all(
+                Receipt(
+                    filename=f'orm-{i}.pdf',
+                    merchant='Shop',
+                    date=date(2024, 1, 1),
+                    total=1.0,
+                    tags='food',
+                )
+                for i in range(offset, offset + 1000)
+            )
+            db.session.commit()
+        orm_rate = sample / (time.perf_counter() - start)
+        db.session.remove()
+
+    client = app.test_client()
+    results = []
+    for _ in range(2):
+        baseline = peak = _rss()
+        done = threading.Event()
+
+        def sample_rss():
+            nonlocal peak
+            while not done.wait(0.01):
+                peak = max(peak, _rss())
+
+        sampler = threading.Thread(target=sample_rss)
+        sampler.start()
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            # input_stream streams the body; data= would read the file whole
+            resp = client.post(
+                '/receipts/import',
+                input_stream=f,
+                content_length=path.stat().st_size,
+                content_type='application/x-ndjson',
+            )
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        assert resp.status_code == 201
+        results.append((resp.get_json(), elapsed, (peak - baseline) / 2**20))
+
+    (first, first_time, first_growth), (again, again_time, again_growth) = results
+    assert first['imported'] == BENCH_ROWS and again['duplicates'] == BENCH_ROWS
+    with app.app_context():
+        assert ReceiptTag.query.count() > 0
+        assert (
+            db.session.query(sa.func.sum(SpendRollup.receipts))
+            .filter_by(grain='day', dimension='all')
+            .scalar()
+            == BENCH_ROWS + sample
+        )
+    print(
+        f"\n{BENCH_ROWS} receipts; ORM objects: {orm_rate:,.0f} rows/s"
+        f"\nimport: {first_time:.2f}s, {BENCH_ROWS / first_time:,.0f} rows/s, RSS "
+        f"+{first_growth:.1f} MiB"
+        f"\nre-import: {again_time:.2f}s, {BENCH_ROWS / again_time:,.0f} rows/s, RSS "
+        f"+{again_growth:.1f} MiB"
+    )
+    assert BENCH_ROWS / first_time > orm_rate
+    assert first_growth < 64 and again_growth < 64
@@ -0,0 +1,230 @@
+import json
+import threading
+import time
+import openai
+import pytest
+import app.ocr as ocr_module
+from app import llm, pipeline
+from app.cache import LRUCache
+from llm_stub import StubLLMServer, chat_completion_client, fake_client
+
+RECEIPTS = [f"Shop {i}\n2025-04-{i + 1:02d}\nTotal: {i}.50" for i in range(16)]
+
+
+class Recorder:
+    def __init__(self, respond, delay=0.0):
+        self.respond = respond
+        self.delay = delay
+        self.prompts = []
+
+    def __call__(self, **kwargs):
+        prompt = kwargs['messages'][-1]['content']
+        self.prompts.append(prompt)
+        time.sleep(self.delay)
+        message = type('M', (), {'content': self.respond(prompt)})
+        return type('R', (), {'choices': [type('C', (), {'message': message})]})
+
+
+@pytest.fixture
+def memo(monkeypatch):
+    cache = LRUCache(100, ttl=60)
+    monkeypatch.setattr(llm, 'memo', cache)
+    return cache
+
+
+def test_lru_cache_ttl_expiry():
+    cache = LRUCache(10, ttl=0.05)
+    cache.set('k', 1)
+    assert cache.get('k') == 1
+    time.sleep(0.06)
+    assert cache.get('k') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_memo_cache_skips_repeat_calls(monkeypatch, memo):
+    rec = Recorder(
+        lambda p: json.dumps({'merchant': 'A', 'date': '2025-01-01', 'total': '1.00'})
+    )
+    monkeypatch.setattr(llm, 'get_client', lambda: fake_client(rec))
+    first = ocr_module.parse_receipt_fields("A  shop\n2025-01-01 ")
+    second = ocr_module.parse_receipt_fields("A shop 2025-01-01")
+    assert first == second == {'merchant': 'A', 'date': '2025-01-01', 'total': '1.00'}
+    assert len(rec.prompts) == 1
+    assert memo.stats()['hits'] == 1
+
+
+def test_memo_cache_ignores_empty_answers(monkeypatch, memo):
+    rec = Recorder(lambda p: 'not json')
+    monkeypatch.setattr(llm, 'get_client', lambda: fake_client(rec))
+    ocr_module.parse_receipt_fields('text')
+    ocr_module.parse_receipt_fields('text')
+    assert len(rec.prompts) == 2
+
+
+def test_batch_packs_texts_into_one_prompt(monkeypatch, memo):
+    rec = Recorder(
+        lambda p: json.dumps(
+            [{'merchant': f'M{i}'} for i in range(p.count('```') // 2)]
+        )
+    )
+    monkeypatch.setattr(llm, 'get_client', lambda: fake_client(rec))
+    monkeypatch.setattr(llm, 'LLM_BATCH_SIZE', 4)
+    texts = RECEIPTS[:6] + [RECEIPTS[0]]
+    results = ocr_module.parse_receipt_fields_many(texts)
+    # 6 distinct texts at 4 per prompt; the duplicate is sent once
+    assert len(rec.prompts) == 2
+    assert [r['merchant'] for r in results] == [
+        'M0',
+        'M1',
+        'M2',
+        'M3',
+        'M0',
+        'M1',
+        'M0',
+    ]
+
+
+def test_batch_falls_back_when_array_misaligned(monkeypatch, memo):
+    def respond(prompt):
+        if 'Receipt 1:' in prompt:
+            return json.dumps([{'merchant': 'only one'}])
+        return json.dumps({'merchant': 'single'})
+
+    rec = Recorder(respond)
+    monkeypatch.setattr(llm, 'get_client', lambda: fake_client(rec))
+    results = llm.extract_many(RECEIPTS[:3], 'model')
+    assert [r['merchant'] for r in results] == ['single'] * 3
+    assert len(rec.prompts) == 4
+
+
+def test_deadline_bounds_wait_for_slot(monkeypatch):
+    monkeypatch.setattr(llm, '_limiter', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(llm, 'LLM_TIMEOUT', 0.1)
+    llm._limiter.acquire()
+    try:
+        start = time.perf_counter()
+        assert llm.parse_one('text', 'model') == {
+            'merchant': None,
+            'date': None,
+            'total': None,
+        }
+        assert time.perf_counter() - start < 0.5
+        with pytest.raises(llm.LLMTimeout):
+            llm.chat('prompt', 'model')
+    finally:
+        llm._limiter.release()
+
+
+def test_chat_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(llm, 'LLM_RETRY_BACKOFF', 0.05)
+    attempts = []
+
+    def flaky(**kwargs):
+        attempts.append((time.perf_counter(), kwargs['timeout']))
+        if len(attempts) == 1:
+            raise ConnectionError('reset')
+        return Recorder(lambda p: '{}')(**kwargs)
+
+    monkeypatch.setattr(llm, 'get_client', lambda: fake_client(flaky))
+    assert llm.chat('prompt', 'model') == '{}'
+    assert len(attempts) == 2 and all(t > 0 for _, t in attempts)
+    # Backed off before retrying
+    assert attempts[1][0] - attempts[0][0] >= 0.025
+
+
+class _StatusError(openai.APIStatusError):
+    # An error response from the API, without an HTTP response behind it
+    def __init__(self, status):
+        Exception.__init__(self, f'HTTP {status}')
+        self.status_code = status
+
+
+@pytest.mark.parametrize(
+    'error, retried',
+    [
+        (_StatusError(401), False),
+        (_StatusError(503), True),
+        (openai.OpenAIError('no API key'), False),
+        (RuntimeError('boom'), True),
+    ],
+)
+def test_llm_errors_keep_regex_fields(monkeypatch, memo, error, retried):
+    monkeypatch.setattr(llm, 'LLM_RETRY_BACKOFF', 0)
+    calls = []
+
+    def failing(**kwargs):
+        calls.append(kwargs)
+        raise error
+
+    monkeypatch.setattr(llm, 'get_client', lambda: fake_client(failing))
+    parsed = pipeline.parse_text("some blurry text\nnothing useful 12")
+    assert parsed['text'] == "some blurry text\nnothing useful 12"
+    assert all(parsed['sources'].get(k) != 'llm' for k in llm.FIELDS)
+    # Errors the API answered with (other than 429 and 5xx) are not retried
+    assert len(calls) == (1 + llm.LLM_RETRIES if retried else 1)
+    assert llm.extract_many(['a', 'b'], 'model') == [llm.empty_fields()] * 2
+
+
+def test_default_client_failure_is_not_raised(monkeypatch, memo):
+    # No key configured: the client cannot even be built
+    monkeypatch.setattr(llm, '_client', None)
+    monkeypatch.setattr(llm, 'LLM_API_KEY', None)
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    assert llm.parse_one('text', 'model') == llm.empty_fields()
+
+
+def test_micro_batcher_coalesces_concurrent_calls(monkeypatch, memo):
+    rec = Recorder(
+        lambda p: json.dumps(
+            [{'merchant': f'M{i}'} for i in range(p.count('```') // 2)]
+        )
+    )
+    monkeypatch.setattr(llm, 'get_client', lambda: fake_client(rec))
+    monkeypatch.setattr(llm, 'LLM_BATCH_WINDOW_MS', 50)
+    monkeypatch.setattr(llm, '_batcher', llm.MicroBatcher(0.05))
+    results = {}
+
+    def call(i):
+        results[i] = ocr_module.parse_receipt_fields(RECEIPTS[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(rec.prompts) == 1
+    assert sorted(r['merchant'] for r in results.values()) == ['M0', 'M1', 'M2', 'M3']
+
+
+@pytest.mark.benchmark
+def test_stub_llm_benchmark(monkeypatch, memo):
+    """
+    Offline benchmark against the stub server: one call per receipt vs
+    batched prompts, then a fully cached re-run.
+    """
+    server = StubLLMServer(latency=0.05, per_item=0.005).start()
+    try:
+        client = chat_completion_client(server.url)
+        monkeypatch.setattr(llm, 'get_client', lambda: client)
+        start = time.perf_counter()
+        single = [llm.parse_one(text, 'stub') for text in RECEIPTS]
+        t_single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = llm.extract_many(RECEIPTS, 'stub')
+        t_batched = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cached = llm.extract_many(RECEIPTS, 'stub')
+        t_cached = time.perf_counter() - start
+    finally:
+        server.stop()
+    print(
+        f"\n{len(RECEIPTS)} receipts: single {t_single * 1000:.0f}ms "
+        f"({server.requests} requests total), "
+        f"batched {t_batched * 1000:.0f}ms, cached {t_cached * 1000:.1f}ms"
+    )
+    assert single == batched == cached
+    assert single[3] == {'merchant': 'Shop 3', 'date': '2025-04-04', 'total': '3.50'}
+    assert t_batched < t_single / 2
+    assert t_cached < t_batched
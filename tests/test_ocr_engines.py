@@ -0,0 +1,168 @@
+import os
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+import pytesseract
+import app.ocr as ocr_module
+import app.ocr_engines as ocr_engines
+from app.ocr_engines import (
+    PytesseractEngine,
+    TesseractPoolEngine,
+    create_engine,
+    tesseract_recognizer,
+)
+
+MODEL_LOAD = 0.2
+
+
+def fake_recognizer(lang, config):
+    # Stand-in for loading traineddata: expensive once, cheap per image
+    time.sleep(MODEL_LOAD)
+
+    def recognize(arr):
+        if arr[0, 0] == 7:
+            time.sleep(5)
+        if arr[0, 0] == 9:
+            raise ValueError('bad image')
+        return f'{lang}:{arr.shape[0]}x{arr.shape[1]}:{os.getpid()}'
+
+    return recognize
+
+
+@pytest.fixture
+def pool():
+    engine = TesseractPoolEngine(
+        'eng', size=2, timeout=1.0, max_tasks=3, factory=fake_recognizer
+    )
+    yield engine
+    engine.close()
+
+
+def test_pool_recognizes_in_warm_workers(pool):
+    img = np.zeros((4, 6), dtype=np.uint8)
+    start = time.perf_counter()
+    results = [pool.recognize(img) for _ in range(2)]
+    elapsed = time.perf_counter() - start
+    assert all(r.startswith('eng:4x6:') for r in results)
+    # Model load happened at pool start, not per task
+    assert elapsed < MODEL_LOAD
+
+
+def test_pool_recycles_workers(pool):
+    img = np.zeros((2, 2), dtype=np.uint8)
+    pids = {pool.recognize(img).rsplit(':', 1)[1] for _ in range(12)}
+    # 12 tasks over 2 workers retiring every 3 jobs needs fresh processes
+    assert len(pids) > 2
+    assert len(pool.worker_pids()) == 2
+
+
+def test_pool_task_timeout_replaces_worker(pool):
+    slow = np.full((2, 2), 7, dtype=np.uint8)
+    before = pool.worker_pids()
+    with pytest.raises(TimeoutError):
+        pool.recognize(slow)
+    assert pool.worker_pids() != before
+    assert pool.recognize(np.zeros((2, 2), dtype=np.uint8)).startswith('eng:')
+
+
+def test_pool_waits_for_a_free_worker_with_timeout(pool):
+    busy = [pool._idle.get(), pool._idle.get()]
+    with pytest.raises(TimeoutError, match='No OCR worker free'):
+        pool.recognize(np.zeros((2, 2), dtype=np.uint8))
+    for worker in busy:
+        pool._idle.put(worker)
+
+
+def test_pool_refills_after_a_failed_start(pool, monkeypatch):
+    def fail():
+        raise RuntimeError('OCR worker failed to initialise')
+
+    monkeypatch.setattr(pool, '_start_worker', fail)
+    # The task's own error is raised, not the replacement's
+    with pytest.raises(TimeoutError, match='exceeded'):
+        pool.recognize(np.full((2, 2), 7, dtype=np.uint8))
+    assert len(pool.worker_pids()) == 1
+    img = np.zeros((2, 2), dtype=np.uint8)
+    # Recycling keeps the old worker serving while no replacement starts
+    pids = {pool.recognize(img).rsplit(':', 1)[1] for _ in range(4)}
+    assert len(pids) == 1
+    monkeypatch.undo()
+    assert pool.recognize(img).startswith('eng:')
+    assert len(pool.worker_pids()) == 2
+
+
+def test_pool_needs_tesserocr(monkeypatch):
+    monkeypatch.setattr(ocr_engines, 'tesserocr', None)
+    engine = create_engine('pool', 'eng', '', size=1)
+    assert engine.name == 'pytesseract'
+
+
+def test_engine_is_created_once(monkeypatch):
+    created = []
+
+    def slow_create(*args, **kwargs):
+        time.sleep(0.05)
+        created.append(PytesseractEngine('eng'))
+        return created[-1]
+
+    monkeypatch.setattr(ocr_module, '_engine', None)
+    monkeypatch.setattr(ocr_module, 'create_engine', slow_create)
+    with ThreadPoolExecutor(8) as executor:
+        engines = list(executor.map(lambda _: ocr_module.get_engine(), range(8)))
+    assert len(created) == 1 and all(e is created[0] for e in engines)
+
+
+def test_pool_propagates_recognizer_errors(pool):
+    with pytest.raises(RuntimeError, match='bad image'):
+        pool.recognize(np.full((2, 2), 9, dtype=np.uint8))
+
+
+def test_ocr_extract_falls_back_to_pytesseract(monkeypatch):
+    class CrashingEngine:
+        def recognize(self, img):
+            raise RuntimeError('OCR worker crashed')
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(ocr_module, '_engine', CrashingEngine())
+    monkeypatch.setattr(
+        ocr_module, 'preprocess_image', lambda x: np.zeros((5, 5), dtype=np.uint8)
+    )
+    monkeypatch.setattr(
+        pytesseract, 'image_to_string', lambda img, lang, config: 'fallback'
+    )
+    assert ocr_module.ocr_extract('path') == 'fallback'
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(shutil.which('tesseract') is None, reason='tesseract not installed')
+def test_engine_benchmark():
+    """
+    Per-receipt latency and receipts/sec for the CLI engine vs the warm pool.
+    """
+    import cv2
+
+    img = np.full((400, 900), 255, dtype=np.uint8)
+    for i, line in enumerate(['CORNER CAFE', '2025-04-24', 'LATTE 4.50', 'TOTAL 4.50']):
+        cv2.putText(img, line, (20, 70 + i * 90), cv2.FONT_HERSHEY_SIMPLEX, 2, 0, 4)
+    n = 20
+    engines = [
+        PytesseractEngine(ocr_module.TESS_LANG, ocr_module.TESS_CONFIG),
+        TesseractPoolEngine(
+            ocr_module.TESS_LANG, ocr_module.TESS_CONFIG, factory=tesseract_recognizer
+        ),
+    ]
+    for engine in engines:
+        engine.recognize(img)  # warm-up
+        start = time.perf_counter()
+        for _ in range(n):
+            assert 'CAFE' in engine.recognize(img).upper()
+        elapsed = time.perf_counter() - start
+        print(
+            f"\n{engine.name}: {elapsed / n * 1000:.1f} ms/receipt, {n / elapsed:.1f} "
+            "receipts/sec"
+        )
+        engine.close()
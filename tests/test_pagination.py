@@ -0,0 +1,170 @@
+import tempfile
+import time
+from datetime import datetime, timedelta
+import pytest
+import sqlalchemy as sa
+from app import create_app, db
+from app.cache import LRUCache
+from app.models import Receipt
+from app.pagination import encode_cursor, decode_cursor, InvalidCursor
+from app.read_cache import ReadCache
+
+BASE = datetime(2025, 1, 1)
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def seed(app, count, same_second=1):
+    # Every ``same_second`` rows share a timestamp, to exercise the id tiebreak
+    rows = [
+        {
+            'filename': f'r{i}.png',
+            'status': 'done',
+            'created_at': BASE + timedelta(seconds=i // same_second),
+        }
+        for i in range(count)
+    ]
+    with app.app_context():
+        for start in range(0, count, 10_000):
+            db.session.execute(sa.insert(Receipt), rows[start : start + 10_000])
+        db.session.commit()
+
+
+def walk(client, per_page, **params):
+    ids, cursor = [], ''
+    while cursor is not None:
+        resp = client.get(
+            '/receipts', query_string={'cursor': cursor, 'per_page': per_page, **params}
+        )
+        assert resp.status_code == 200
+        body = resp.get_json()
+        ids.extend(r['id'] for r in body['receipts'])
+        cursor = body['next_cursor']
+    return ids
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(BASE, 42)
+    assert decode_cursor(cursor) == (BASE, 42)
+    for bad in ('', 'not-a-cursor', encode_cursor(BASE, 1)[:-3]):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(bad)
+
+
+def test_cursor_walk_visits_every_row_once(app, client):
+    seed(app, 57, same_second=4)
+    ids = walk(client, per_page=10)
+    with app.app_context():
+        expected = [
+            r.id
+            for r in Receipt.query.order_by(
+                Receipt.created_at.desc(), Receipt.id.desc()
+            )
+        ]
+    assert ids == expected
+
+
+def test_cursor_mode_matches_offset_mode(app, client):
+    seed(app, 25, same_second=3)
+    offset_ids = []
+    for page in (1, 2, 3):
+        body = client.get(f'/receipts?page={page}&per_page=10').get_json()
+        offset_ids.extend(r['id'] for r in body['receipts'])
+    assert walk(client, per_page=10) == offset_ids
+
+
+def test_count_is_opt_in(app, client):
+    seed(app, 30)
+    body = client.get('/receipts?cursor=&per_page=5').get_json()
+    assert 'total' not in body and len(body['receipts']) == 5
+    assert client.get('/receipts?cursor=&count=exact').get_json()['total'] == 30
+    body = client.get('/receipts?cursor=&count=estimate').get_json()
+    assert body['total'] == 30 and body['total_is_estimate']
+    with app.app_context():
+        db.session.execute(sa.text('ANALYZE'))
+        db.session.commit()
+    assert client.get('/receipts?cursor=&count=estimate').get_json()['total'] == 30
+
+
+@pytest.mark.parametrize(
+    'query', ['cursor=garbage', 'cursor=&per_page=0', 'cursor=&count=maybe']
+)
+def test_invalid_cursor_params(client, query):
+    resp = client.get(f'/receipts?{query}')
+    assert resp.status_code == 400
+    assert 'error' in resp.get_json()
+
+
+def test_seek_uses_composite_index(app):
+    seed(app, 100)
+    with app.app_context():
+        query = (
+            Receipt.query.filter(
+                sa.tuple_(Receipt.created_at, Receipt.id) < sa.tuple_(BASE, 50)
+            )
+            .order_by(Receipt.created_at.desc(), Receipt.id.desc())
+            .limit(10)
+        )
+        sql = str(
+            query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        )
+        plan = ' '.join(
+            str(row) for row in db.session.execute(sa.text(f'EXPLAIN QUERY PLAN {sql}'))
+        )
+    assert 'ix_receipts_created_at_id' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+@pytest.mark.benchmark
+def test_deep_page_benchmark(app, client):
+    """
+    Page 1 and page 10,000 (per_page=10) over 100k receipts: OFFSET with a
+    full COUNT vs keyset seeks from a cursor.
+    """
+    per_page, deep = 10, 10_000
+    # Time the queries, not repeat reads served from the read cache
+    app.extensions['read_cache'] = ReadCache(LRUCache(0, sizeof=len))
+    seed(app, deep * per_page)
+    with app.app_context():
+        row = (
+            Receipt.query.order_by(Receipt.created_at.desc(), Receipt.id.desc())
+            .offset((deep - 1) * per_page - 1)
+            .first()
+        )
+        deep_cursor = encode_cursor(row.created_at, row.id)
+
+    def timed(url, repeat=5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            resp = client.get(url)
+            assert resp.status_code == 200
+        return (time.perf_counter() - start) / repeat, resp.get_json()
+
+    offset_1, _ = timed(f'/receipts?page=1&per_page={per_page}')
+    offset_deep, offset_body = timed(f'/receipts?page={deep}&per_page={per_page}')
+    cursor_1, _ = timed(f'/receipts?cursor=&per_page={per_page}')
+    cursor_deep, cursor_body = timed(
+        f'/receipts?cursor={deep_cursor}&per_page={per_page}'
+    )
+    assert [r['id'] for r in cursor_body['receipts']] == [
+        r['id'] for r in offset_body['receipts']
+    ]
+    print(
+        f"\noffset: page 1 {offset_1 * 1000:.1f}ms, page {deep} "
+        f"{offset_deep * 1000:.1f}ms"
+        f"\ncursor: page 1 {cursor_1 * 1000:.1f}ms, page {deep} "
+        f"{cursor_deep * 1000:.1f}ms"
+    )
+    assert cursor_deep < offset_deep / 2
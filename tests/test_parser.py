@@ -1,5 +1,11 @@
+import json
+import os
+import re
+import time
 import pytest
-from app.parser import parse_with_regex
+from app.parser import parse_with_regex, parse_with_confidence, parse_many
+
+LABELED_PATH = os.path.join(os.path.dirname(__file__), 'data', 'labeled_receipts.json')
 
 @pytest.mark.parametrize("text, expected", [
     (
@@ -25,3 +31,85 @@ from app.parser import parse_with_regex
 def test_parse_with_regex(text, expected):
     result = parse_with_regex(text)
     assert result == expected
+
+
+@pytest.mark.parametrize(
+    "text, date, total",
+    [
+        ("Shop\n24/05/2025\nTotal 12.00", "2025-05-24", "12.00"),
+        ("Shop\n12.03.2025\nTOTAL EUR 13,50", "2025-03-12", "13.50"),
+        ("Shop\n2025.5.4\nTOTAL: $1,234.56", "2025-05-04", "1234.56"),
+        ("セブンイレブン\n2025年4月2日\n小計 ¥500\n合計 ¥1,540", "2025-04-02", "1540"),
+        ("Shop\n14 Mar 2025\nAmount Due 9.99", "2025-03-14", "9.99"),
+        ("Shop\nMarch 14, 2025\nTotal 5.00\nGrand Total 6.50", "2025-03-14", "6.50"),
+        ("Shop\n2025-13-01\n31/02/2025\n2025-04-01\nSubtotal 4.00", "2025-04-01", None),
+        ("Shop\nTotal Items: 3\nTotal: 1,000円", None, "1000"),
+    ],
+)
+def test_parse_with_confidence_formats(text, date, total):
+    fields, confidence = parse_with_confidence(text)
+    assert (fields['date'], fields['total']) == (date, total)
+    assert (confidence['date'] > 0) == (date is not None)
+
+
+def test_ambiguous_day_month_is_low_confidence():
+    _, unambiguous = parse_with_confidence("Shop\n24/05/2025")
+    fields, ambiguous = parse_with_confidence("Shop\n04/05/2025")
+    # Day-first, but 04/05 could be either way round
+    assert fields['date'] == '2025-05-04'
+    assert ambiguous['date'] < unambiguous['date']
+
+
+def test_parse_many_matches_single():
+    texts = ["A\n2025-01-02\nTotal 1.00", "", "B\n3 Jan 2025\n合計 ¥300"]
+    assert parse_many(texts) == [parse_with_confidence(t) for t in texts]
+
+
+def legacy_parse_with_regex(text):
+    # Previous implementation: recompiled patterns, full line list, two scans
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    merchant = lines[0] if lines else None
+    date_match = re.search(r"\b(\d{4}[/-]\d{2}[/-]\d{2})\b", text)
+    total_match = re.search(r"\b[Tt]otal[:\s]*[\$¥]?\s*([0-9]+(?:\.[0-9]{2}))\b", text)
+    return {
+        "merchant": merchant,
+        "date": date_match and date_match.group(1),
+        "total": total_match and total_match.group(1),
+    }
+
+
+@pytest.mark.benchmark
+def test_parser_benchmark():
+    """
+    Per-text cost of parsing 100k OCR texts, legacy parser vs the
+    single-pass parser, and how many dates/totals each finds.
+    """
+    samples = [s['text'] for s in json.load(open(LABELED_PATH, encoding='utf-8'))]
+    item = "ITEM {} {}.99\n"
+    texts = [
+        samples[i % len(samples)].replace('\n', '\n' + item.format(i, i % 50) * 8, 1)
+        for i in range(100_000)
+    ]
+    results = {}
+    for name, fn in (
+        ('legacy', legacy_parse_with_regex),
+        ('compiled', parse_with_regex),
+        ('parse_many', None),
+    ):
+        start = time.perf_counter()
+        parsed = parse_many(texts) if fn is None else [fn(t) for t in texts]
+        elapsed = time.perf_counter() - start
+        if fn is None:
+            parsed = [fields for fields, _ in parsed]
+        found = sum(bool(p['date']) for p in parsed), sum(
+            bool(p['total']) for p in parsed
+        )
+        results[name] = elapsed
+        print(
+            f"\n{name:>10}: {elapsed / len(texts) * 1e6:.1f}us/text, dates {found[0]}, "
+            f"totals {found[1]}",
+            end='',
+        )
+    print()
+    # Wider coverage without giving up throughput (with slack for timer noise)
+    assert results['compiled'] < results['legacy'] * 1.2
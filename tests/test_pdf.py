@@ -0,0 +1,183 @@
+import io
+import tempfile
+import threading
+import time
+import numpy as np
+import pytest
+from PIL import Image
+import app.ocr as ocr_module
+from app import create_app, db
+
+PAGE_TEXT = ['Mega Mart', '2025-05-01', 'Milk 2.34', 'Total: 12.34']
+
+
+def text_pdf(path, pages):
+    """
+    Write a PDF whose pages carry an embedded text layer (Helvetica lines).
+    """
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        None,
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    kids = []
+    for lines in pages:
+        ops = ' '.join(f'({line}) Tj 0 -20 Td' for line in lines)
+        stream = f'BT /F1 14 Tf 40 760 Td {ops} ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>'
+        )
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f'{number} 0 obj\n{body}\nendobj\n'.encode())
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+    for offset in offsets:
+        out.write(f'{offset:010d} 00000 n \n'.encode())
+    out.write(
+        f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n'
+        f'startxref\n{xref}\n%%EOF\n'.encode()
+    )
+    path.write_bytes(out.getvalue())
+    return str(path)
+
+
+def scanned_pdf(path, count):
+    # Image-only pages; page n is a flat gray of level 20 * (n + 1)
+    pages = [Image.new('L', (600, 800), 20 * (n + 1)) for n in range(count)]
+    pages[0].save(path, save_all=True, append_images=pages[1:], resolution=100)
+    return str(path)
+
+
+class PageEngine:
+    """
+    Fake OCR engine that reads the page number back from the gray level.
+    With ``stagger`` later pages finish first. Tracks pages in flight.
+    """
+
+    size = 2
+
+    def __init__(self, delay=0.0, stagger=True):
+        self.delay = delay
+        self.stagger = stagger
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def recognize(self, img):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        page = round(float(np.asarray(img).mean()) / 20) - 1
+        time.sleep(self.delay / (page + 1) if self.stagger else self.delay)
+        with self._lock:
+            self.active -= 1
+        return f'page {page}\f'
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def client():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    fake = PageEngine()
+    monkeypatch.setattr(ocr_module, '_engine', fake)
+    # Keep gray levels intact so the fake engine can identify pages
+    monkeypatch.setattr(ocr_module, 'preprocess_array', lambda img: img)
+    return fake
+
+
+def test_text_layer_skips_ocr(tmp_path, engine):
+    path = text_pdf(tmp_path / 'statement.pdf', [PAGE_TEXT[:2], PAGE_TEXT[2:]])
+    text = ocr_module.ocr_extract(path)
+    assert text.split('\n') == PAGE_TEXT
+    assert engine.calls == 0
+
+
+def test_text_layer_can_be_disabled(tmp_path, engine, monkeypatch):
+    monkeypatch.setattr(ocr_module, 'PDF_TEXT_LAYER', False)
+    path = text_pdf(tmp_path / 'statement.pdf', [PAGE_TEXT])
+    ocr_module.ocr_extract(path)
+    assert engine.calls == 1
+
+
+def test_scanned_pages_ocr_in_page_order(tmp_path, engine):
+    engine.delay = 0.05
+    path = scanned_pdf(tmp_path / 'scan.pdf', 6)
+    text = ocr_module.ocr_pdf(path, workers=3)
+    assert text.split('\n') == [f'page {n}' for n in range(6)]
+    assert 1 < engine.max_active <= 3
+
+
+def test_pages_render_lazily(tmp_path):
+    path = scanned_pdf(tmp_path / 'scan.pdf', 4)
+    pages = ocr_module.iter_pdf_pages(path)
+    index, page = next(pages)
+    assert index == 0 and page.ndim == 2
+    # 600x800 px at 100 dpi is 6x8 in; rendered at PDF_DPI
+    assert page.shape[0] == ocr_module.PDF_DPI * 8
+    assert abs(page.shape[1] - ocr_module.PDF_DPI * 6) <= 1
+    assert [i for i, _ in pages] == [1, 2, 3]
+
+
+def test_render_capped_by_max_side(tmp_path, monkeypatch):
+    monkeypatch.setitem(ocr_module.PREPROCESS_PARAMS, 'max_side', 1000)
+    path = scanned_pdf(tmp_path / 'scan.pdf', 1)
+    _, page = next(ocr_module.iter_pdf_pages(path))
+    assert max(page.shape) == 1000
+
+
+def test_upload_pdf_with_text_layer(client, tmp_path, engine):
+    path = text_pdf(tmp_path / 'receipt.pdf', [PAGE_TEXT])
+    with open(path, 'rb') as f:
+        resp = client.post(
+            '/upload',
+            data={'file': (f, 'receipt.pdf')},
+            content_type='multipart/form-data',
+        )
+    assert resp.status_code == 201
+    data = resp.get_json()
+    assert data['merchant'] == 'Mega Mart'
+    assert data['total'] == 12.34
+    assert engine.calls == 0
+
+
+@pytest.mark.benchmark
+def test_page_parallel_benchmark(tmp_path, engine):
+    """
+    Sequential vs page-parallel OCR of a 12-page scan with a fake engine
+    that takes ~50ms per page.
+    """
+    engine.delay, engine.stagger = 0.05, False
+    count = 12
+    path = scanned_pdf(tmp_path / 'scan.pdf', count)
+    timings = {}
+    for workers in (1, 4):
+        start = time.perf_counter()
+        text = ocr_module.ocr_pdf(path, workers=workers)
+        timings[workers] = time.perf_counter() - start
+        assert text.split('\n') == [f'page {n}' for n in range(count)]
+    print(
+        f"\n{count} pages: sequential {timings[1] * 1000:.0f}ms, "
+        f"4 workers {timings[4] * 1000:.0f}ms"
+    )
+    assert timings[4] < timings[1]
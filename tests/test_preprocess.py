@@ -0,0 +1,279 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+import pytest
+import app.ocr as ocr_module
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# (width, height, font scale) for small scans, phone photos and 12MP photos
+SIZES = {
+    'small': (600, 400, 0.6),
+    'medium': (2000, 1500, 1.4),
+    'huge': (4000, 3000, 2.4),
+}
+LINES = ['CORNER CAFE', '2025-04-24', 'LATTE 4.50', 'MUFFIN 3.25', 'TOTAL 7.75']
+
+
+def legacy_preprocess(file_path):
+    # Previous fixed pipeline: 2x cubic upscale + 9px bilateral filter
+    img = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+    img = cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    img = cv2.bilateralFilter(img, 9, 75, 75)
+    _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return img
+
+
+def draw_receipt(width, height, font_scale):
+    img = np.full((height, width), 230, dtype=np.uint8)
+    rng = np.random.default_rng(0)
+    img = cv2.add(img, rng.integers(0, 20, img.shape, dtype=np.uint8))
+    step = int(40 * font_scale)
+    for i in range(height // step - 1):
+        line = LINES[i % len(LINES)]
+        cv2.putText(
+            img,
+            line,
+            (step, step * (i + 1)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            font_scale,
+            20,
+            max(1, int(font_scale * 2)),
+        )
+    return img
+
+
+def make_receipt(path, width, height, font_scale):
+    cv2.imwrite(
+        str(path),
+        draw_receipt(width, height, font_scale),
+        [cv2.IMWRITE_JPEG_QUALITY, 90],
+    )
+    return str(path)
+
+
+def make_photo(path, size=(1500, 2000), angle=7):
+    """
+    Phone-style photo: a receipt rotated by ``angle`` degrees with some
+    perspective, on a dark textured table with a shadow gradient.
+    Returns the path and the receipt's true corners (tl, tr, br, bl).
+    """
+    w, h = size
+    rng = np.random.default_rng(2)
+    table = cv2.GaussianBlur(rng.integers(40, 110, (h, w), dtype=np.uint8), (15, 15), 0)
+    receipt = draw_receipt(560, 1300, 1.0)
+    rh, rw = receipt.shape
+    src = np.float32([[0, 0], [rw, 0], [rw, rh], [0, rh]])
+    center = np.float32([w / 2, h / 2])
+    theta = np.deg2rad(angle)
+    rot = np.float32([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    # Top edge slightly narrower than the bottom: camera tilted towards the table
+    offsets = np.float32(
+        [
+            [-rw / 2 + 30, -rh / 2],
+            [rw / 2 - 30, -rh / 2],
+            [rw / 2, rh / 2],
+            [-rw / 2, rh / 2],
+        ]
+    )
+    dst = offsets @ rot.T + center
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    warped = cv2.warpPerspective(receipt, matrix, (w, h))
+    mask = cv2.warpPerspective(np.full_like(receipt, 255), matrix, (w, h))
+    photo = np.where(mask > 0, warped, table)
+    shadow = np.linspace(0.75, 1.0, w, dtype=np.float32)[None, :]
+    photo = (photo * shadow).astype(np.uint8)
+    cv2.imwrite(str(path), photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return str(path), dst
+
+
+@pytest.fixture(scope='module')
+def images(tmp_path_factory):
+    d = tmp_path_factory.mktemp('preprocess')
+    return {
+        name: make_receipt(d / f'{name}.jpg', *size) for name, size in SIZES.items()
+    }
+
+
+def test_estimate_text_height(images):
+    img = cv2.imread(images['medium'], cv2.IMREAD_GRAYSCALE)
+    # FONT_HERSHEY_SIMPLEX caps are ~22px tall at scale 1
+    assert 20 < ocr_module.estimate_text_height(img) < 45
+
+
+def test_scale_adapts_to_input(images):
+    small = ocr_module.preprocess_image(images['small'])
+    huge = ocr_module.preprocess_image(images['huge'])
+    assert small.shape[0] > 400
+    assert max(huge.shape) <= ocr_module.PREPROCESS_PARAMS['max_side']
+    assert huge.shape[0] < 3000
+
+
+def test_large_images_decoded_reduced(tmp_path, monkeypatch):
+    monkeypatch.setitem(ocr_module.PREPROCESS_PARAMS, 'max_side', 1000)
+    path = make_receipt(tmp_path / 'big.jpg', 4000, 3000, 2.4)
+    # 4000px decodes at 1/4 scale, the largest reduction still >= max_side
+    assert max(ocr_module.load_grayscale(path).shape) == 1000
+
+
+def test_tiled_filter_matches_whole_image(monkeypatch):
+    monkeypatch.setitem(ocr_module.PREPROCESS_PARAMS, 'tile_rows', 64)
+    img = np.random.default_rng(1).integers(0, 255, (300, 200), dtype=np.uint8)
+    fn = lambda t: cv2.bilateralFilter(t, 9, 75, 75)  # noqa: E731
+    np.testing.assert_array_equal(ocr_module._apply_tiled(img, fn, 5), fn(img))
+
+
+def test_unreadable_file_raises(tmp_path):
+    path = tmp_path / 'bad.png'
+    path.write_bytes(b'not an image')
+    with pytest.raises(ValueError):
+        ocr_module.preprocess_image(str(path))
+
+
+def test_detect_receipt_corners(tmp_path):
+    path, corners = make_photo(tmp_path / 'photo.jpg')
+    found = ocr_module.detect_receipt(cv2.imread(path, cv2.IMREAD_GRAYSCALE))
+    assert found is not None
+    assert np.abs(found - corners).max() < 25
+
+
+def test_detect_receipt_skips_tight_scans(images):
+    img = cv2.imread(images['medium'], cv2.IMREAD_GRAYSCALE)
+    assert ocr_module.detect_receipt(img) is None
+
+
+def test_deskew_recovers_rotation():
+    img = draw_receipt(800, 1000, 1.0)
+    assert abs(ocr_module.estimate_skew(img)) < 0.5
+    tilted = ocr_module._rotate(img, 6)
+    assert abs(ocr_module.estimate_skew(tilted) + 6) < 0.5
+
+
+def test_receipt_stage_toggle_and_timings(tmp_path, monkeypatch):
+    path, _ = make_photo(tmp_path / 'photo.jpg')
+    monkeypatch.setattr(ocr_module, 'stage_timings', {})
+    cropped = ocr_module.preprocess_image(path)
+    assert {'load', 'detect', 'crop', 'deskew', 'threshold'} <= set(
+        ocr_module.stage_stats()
+    )
+    monkeypatch.setitem(ocr_module.PREPROCESS_PARAMS, 'detect_receipt', False)
+    full = ocr_module.preprocess_image(path)
+    assert cropped.size < full.size / 2
+
+
+_MEASURE = '''
+import json, sys, time
+sys.path.insert(0, {root!r}); sys.path.insert(0, {tests!r})
+from app.ocr import preprocess_image
+from test_preprocess import legacy_preprocess, rss_kb
+fn = legacy_preprocess if {legacy!r} else preprocess_image
+with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')  # reset the peak-RSS watermark left by imports
+baseline = rss_kb('VmRSS')
+start = time.perf_counter()
+out = fn({path!r})
+elapsed = time.perf_counter() - start
+peak_mb = (rss_kb('VmHWM') - baseline) / 1024
+print(json.dumps({{'seconds': elapsed, 'peak_mb': peak_mb, 'shape': list(out.shape)}}))
+'''
+
+
+def rss_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def _measure(path, legacy):
+    code = _MEASURE.format(
+        root=ROOT, tests=os.path.dirname(__file__), legacy=legacy, path=path
+    )
+    out = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(
+    not os.path.exists('/proc/self/clear_refs'),
+    reason='needs Linux /proc peak-RSS reset',
+)
+def test_preprocess_benchmark(images):
+    """
+    Time and peak RSS growth per image size, legacy vs adaptive
+    preprocessing. Each run is a fresh interpreter so the peak RSS reflects
+    that run only.
+    """
+    print()
+    results = {}
+    for name, path in images.items():
+        before, after = _measure(path, True), _measure(path, False)
+        results[name] = (before, after)
+        print(
+            f"{name:>6}: {before['seconds'] * 1000:7.0f}ms {before['peak_mb']:6.0f}MB "
+            f"{before['shape']}"
+            f" -> {after['seconds'] * 1000:6.0f}ms {after['peak_mb']:6.0f}MB "
+            f"{after['shape']}"
+        )
+    before, after = results['huge']
+    assert after['seconds'] < before['seconds'] / 2
+    assert after['peak_mb'] < before['peak_mb']
+
+
+@pytest.mark.skipif(shutil.which('tesseract') is None, reason='tesseract not installed')
+def test_ocr_accuracy_parity(images):
+    import pytesseract
+
+    for name, path in images.items():
+        for fn in (legacy_preprocess, ocr_module.preprocess_image):
+            text = pytesseract.image_to_string(
+                fn(path), lang='eng', config=ocr_module.TESS_CONFIG
+            )
+            found = sum(line in text for line in LINES)
+            print(f"\n{name} {fn.__name__}: {found}/{len(LINES)} lines")
+            if fn is ocr_module.preprocess_image:
+                assert found >= len(LINES) - 1
+
+
+@pytest.mark.benchmark
+def test_receipt_detection_benchmark(tmp_path, monkeypatch):
+    """
+    Pixels handed to Tesseract and preprocessing time for phone photos,
+    with and without the detect/crop/deskew stage. OCR time is compared
+    too when tesseract is installed.
+    """
+    paths = [
+        make_photo(tmp_path / f'photo{i}.jpg', angle=a)[0]
+        for i, a in enumerate((-9, 0, 7))
+    ]
+    results = {}
+    for enabled in (False, True):
+        monkeypatch.setitem(ocr_module.PREPROCESS_PARAMS, 'detect_receipt', enabled)
+        start = time.perf_counter()
+        outputs = [ocr_module.preprocess_image(p) for p in paths]
+        prep = (time.perf_counter() - start) / len(paths)
+        ocr = None
+        if shutil.which('tesseract'):
+            import pytesseract
+
+            start = time.perf_counter()
+            for img in outputs:
+                pytesseract.image_to_string(
+                    img, lang='eng', config=ocr_module.TESS_CONFIG
+                )
+            ocr = (time.perf_counter() - start) / len(paths)
+        results[enabled] = (sum(o.size for o in outputs) / len(paths), prep, ocr)
+    print()
+    for enabled, (pixels, prep, ocr) in results.items():
+        ocr_ms = f'{ocr * 1000:.0f}ms' if ocr is not None else 'n/a'
+        print(
+            f"detect={enabled!s:5}: {pixels / 1e6:.2f} MP to OCR, preprocess "
+            f"{prep * 1000:.0f}ms, OCR {ocr_ms}"
+        )
+    assert results[True][0] < results[False][0] / 2
@@ -0,0 +1,292 @@
+import io
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+import pytest
+import sqlalchemy as sa
+from app import create_app, db
+from app.cache import FileCache, LRUCache
+from app.config import TestConfig
+from app.models import Receipt
+from app.read_cache import CachedResponse, ReadCache
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # Off by default; see test_cache_is_off_by_default
+    monkeypatch.setattr(TestConfig, 'READ_CACHE_BYTES', 64 * 1024 * 1024)
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+        for i in range(3):
+            db.session.add(
+                Receipt(
+                    filename=f'r{i}.png',
+                    merchant=f'Shop {i}',
+                    total=1.0 + i,
+                    tags='food',
+                    created_at=datetime(2025, 4, 1, i),
+                )
+            )
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(app):
+    seen = []
+    with app.app_context():
+        sa.event.listen(
+            db.engine, 'before_cursor_execute', lambda *args: seen.append(args[2])
+        )
+    return seen
+
+
+def read(client, statements, url, **kwargs):
+    statements.clear()
+    resp = client.get(url, **kwargs)
+    return resp, len(statements)
+
+
+def test_lru_bounded_by_bytes():
+    cache = LRUCache(10, sizeof=len)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    cache.set('c', b'1234')
+    assert 'a' not in cache and cache.stats()['bytes'] == 8 and cache.evictions == 1
+    cache.set('b', b'123456')
+    assert cache.get('c') == b'1234' and cache.weight == 10
+    cache.set('c', b'x' * 11)
+    assert 'c' not in cache and cache.weight == 6
+
+
+def test_file_cache(tmp_path):
+    cache, other = FileCache(str(tmp_path), 100), FileCache(str(tmp_path), 100)
+    cache.set(('k', 1), b'value')
+    assert other.get(('k', 1)) == b'value' and other.hits == 1
+    assert other.pop(('k', 1)) == b'value' and cache.get(('k', 1)) is None
+    for i in range(12):
+        cache.set(i, b'x' * 10)
+        time.sleep(0.01)
+    cache.sweep()
+    assert (
+        cache.stats()['bytes'] <= 100
+        and cache.get(0) is None
+        and cache.get(11) == b'x' * 10
+    )
+    expiring = FileCache(str(tmp_path / 'ttl'), 100, ttl=0.05)
+    expiring.set('k', b'v')
+    time.sleep(0.06)
+    assert expiring.get('k') is None and expiring.expirations == 1
+
+
+def test_reads_are_served_from_cache(app, client, statements):
+    for url in (
+        '/receipts/1',
+        '/receipts/1?fields=id,total',
+        '/receipts?cursor=',
+        '/receipts?sort=total',
+    ):
+        first, _ = read(client, statements, url)
+        again, queries = read(client, statements, url)
+        assert (
+            queries == 0
+            and again.data == first.data
+            and again.headers['ETag'] == first.headers['ETag']
+        )
+        conditional, queries = read(
+            client, statements, url, headers={'If-None-Match': first.headers['ETag']}
+        )
+        assert conditional.status_code == 304 and queries == 0
+    stats = client.get('/metrics').get_json()['read_cache']
+    assert (
+        stats['hits'] == 8
+        and stats['misses'] == 4
+        and stats['hit_ratio'] == pytest.approx(2 / 3)
+    )
+
+
+def test_commits_invalidate(app, client, statements):
+    client.get('/receipts/1')
+    client.get('/receipts/2')
+    client.get('/receipts')
+    with app.app_context():
+        db.session.get(Receipt, 1).merchant = 'Renamed'
+        db.session.commit()
+    assert client.get('/receipts/1').get_json()['merchant'] == 'Renamed'
+    assert 'Renamed' in [
+        r['merchant'] for r in client.get('/receipts').get_json()['receipts']
+    ]
+    # Receipts the commit did not touch stay cached
+    assert read(client, statements, '/receipts/2')[1] == 0
+
+    resp = client.post(
+        '/upload',
+        data={'file': (io.BytesIO(b'img'), 'new.png')},
+        content_type='multipart/form-data',
+    )
+    assert resp.status_code == 201
+    assert client.get('/receipts').get_json()['total'] == 4
+
+
+def test_rollback_keeps_cache(app, client, statements):
+    client.get('/receipts/1')
+    with app.app_context():
+        db.session.get(Receipt, 1).merchant = 'Never'
+        db.session.flush()
+        db.session.rollback()
+    resp, queries = read(client, statements, '/receipts/1')
+    assert queries == 0 and resp.get_json()['merchant'] == 'Shop 0'
+
+
+def test_bulk_statements_invalidate(app, client):
+    client.get('/receipts/1')
+    client.get('/receipts')
+    with app.app_context():
+        db.session.execute(
+            sa.insert(Receipt), [{'filename': 'bulk.png', 'status': 'done'}]
+        )
+        db.session.commit()
+    assert client.get('/receipts').get_json()['total'] == 4
+    with app.app_context():
+        db.session.execute(
+            sa.update(Receipt).where(Receipt.id == 1).values(merchant='Bulk')
+        )
+        db.session.commit()
+    assert client.get('/receipts/1').get_json()['merchant'] == 'Bulk'
+
+
+def test_file_backend_is_shared(tmp_path, monkeypatch):
+    # Two apps stand in for two worker processes on one host
+    monkeypatch.setattr(
+        TestConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/shared.db'
+    )
+    monkeypatch.setattr(TestConfig, 'READ_CACHE_BACKEND', 'file')
+    monkeypatch.setattr(TestConfig, 'READ_CACHE_BYTES', 64 * 1024 * 1024)
+    monkeypatch.setattr(TestConfig, 'READ_CACHE_DIR', str(tmp_path / 'cache'))
+    first, second = create_app('testing'), create_app('testing')
+    with first.app_context():
+        db.create_all()
+        db.session.add(Receipt(filename='a.png', merchant='Before'))
+        db.session.commit()
+    assert first.test_client().get('/receipts/1').get_json()['merchant'] == 'Before'
+    assert second.test_client().get('/receipts/1').get_json()['merchant'] == 'Before'
+    assert second.extensions['read_cache'].hits == 1
+    with second.app_context():
+        db.session.get(Receipt, 1).merchant = 'After'
+        db.session.commit()
+    assert first.test_client().get('/receipts/1').get_json()['merchant'] == 'After'
+
+
+def test_replica_lag_window_is_shared(tmp_path):
+    # Two processes on one host: one commits, the other reads a replica
+    writer = ReadCache(FileCache(str(tmp_path), 1 << 20, ttl=60), replica_lag=0.2)
+    reader = ReadCache(FileCache(str(tmp_path), 1 << 20, ttl=60), replica_lag=0.2)
+    response = CachedResponse('"e"', None, b'{}')
+    writer.invalidate([1])
+    slot = reader.slot('receipt:1', 'body')
+    reader.set(slot, response, replica=True)
+    assert reader.get(slot) is None
+    # What the primary read is stored
+    reader.set(slot, response)
+    assert reader.get(slot) is not None
+    # Once the replicas have caught up, so is what they read
+    time.sleep(0.25)
+    slot = reader.slot('receipt:1', 'other')
+    reader.set(slot, response, replica=True)
+    assert reader.get(slot) is not None
+
+
+def test_cache_is_off_by_default():
+    # A per-process cache would serve other workers' stale copies
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        db.session.add(Receipt(filename='a.png'))
+        db.session.commit()
+    client = app.test_client()
+    client.get('/receipts/1')
+    client.get('/receipts/1')
+    assert (
+        not app.extensions['read_cache'].enabled
+        and app.extensions['read_cache'].hits == 0
+    )
+
+
+@pytest.mark.benchmark
+def test_read_latency_benchmark(app):
+    """
+    p50/p99 latency of 5,000 reads of receipts (skewed towards a few hot
+    ones) and first listing pages over 5,000 receipts, with one receipt
+    updated every 100 reads; without and with the read cache.
+    """
+    rng = random.Random(0)
+    with app.app_context():
+        db.session.execute(
+            sa.insert(Receipt),
+            [
+                {
+                    'filename': f'b{i}.png',
+                    'merchant': f'Shop {i % 80}',
+                    'total': float(i % 250),
+                    'status': 'done',
+                    'created_at': datetime(2025, 1, 1) + timedelta(minutes=i),
+                }
+                for i in range(5000)
+            ],
+        )
+        db.session.commit()
+        for receipt in Receipt.query.filter(Receipt.id % 3 == 0):
+            receipt.tags = 'food,travel'
+        db.session.commit()
+    hot = list(range(1, 5001))
+    weights = [1 / rank for rank in range(1, len(hot) + 1)]
+    urls = [f'/receipts/{rid}' for rid in rng.choices(hot, weights, k=4000)]
+    urls += rng.choices(
+        [
+            '/receipts?cursor=&per_page=50',
+            '/receipts?per_page=20&sort=-total',
+            '/receipts?cursor=&fields=id,total,date',
+        ],
+        k=1000,
+    )
+    rng.shuffle(urls)
+    client = app.test_client()
+
+    def run(cache):
+        app.extensions['read_cache'] = cache
+        edits = random.Random(1)
+        timings = []
+        for i, url in enumerate(urls):
+            if i % 100 == 99:
+                with app.app_context():
+                    db.session.get(Receipt, edits.choice(hot)).notes = f'edit {i}'
+                    db.session.commit()
+            start = time.perf_counter()
+            assert client.get(url).status_code == 200
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        return (
+            timings[len(timings) // 2] * 1000,
+            timings[int(len(timings) * 0.99)] * 1000,
+            cache.stats(),
+        )
+
+    off_p50, off_p99, _ = run(ReadCache(LRUCache(0, sizeof=len)))
+    on_p50, on_p99, stats = run(
+        ReadCache(LRUCache(64 * 1024 * 1024, ttl=60, sizeof=len))
+    )
+    print(
+        f"\nno cache: p50 {off_p50:.2f}ms, p99 {off_p99:.2f}ms"
+        f"\nread cache: p50 {on_p50:.2f}ms, p99 {on_p99:.2f}ms, hit ratio "
+        f"{stats['hit_ratio']:.2f}, "
+        f"{stats['bytes'] / 1024:.0f} KiB"
+    )
+    assert on_p50 < off_p50 / 2
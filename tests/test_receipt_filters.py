@@ -0,0 +1,270 @@
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import pytest
+import sqlalchemy as sa
+from werkzeug.datastructures import MultiDict
+from app import create_app, db
+from app.config import TestConfig
+from app.models import Receipt
+from app.routes import _filtered_receipts, _sort_order
+
+PG_URL = os.getenv('TEST_POSTGRES_URL')
+# 1M rows takes ~40s to seed; the default keeps the suite quick
+BENCH_ROWS = int(os.getenv('FILTER_BENCH_ROWS', 200_000))
+FILTER_INDEXES = (
+    'ix_receipts_date_id',
+    'ix_receipts_total_id',
+    'ix_receipts_merchant_lower',
+    'ix_receipts_created_at_id',
+)
+
+SAMPLE = [
+    ('Mega Mart', date(2025, 1, 5), 54.10, 'groceries,weekly'),
+    ('mega mart', date(2025, 2, 1), 12.00, 'groceries'),
+    ('Megabytes', date(2025, 2, 14), 899.99, 'electronics'),
+    ('Corner Cafe', date(2025, 3, 1), 4.50, 'coffee,breakfast'),
+    ('Corner Cafe', None, None, 'coffee'),
+    ('Taxi Co', date(2025, 3, 9), 23.40, None),
+]
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+        for i, (merchant, day, total, tags) in enumerate(SAMPLE):
+            db.session.add(
+                Receipt(
+                    filename=f'r{i}.png',
+                    merchant=merchant,
+                    date=day,
+                    total=total,
+                    tags=tags,
+                    created_at=datetime(2025, 4, 1) + timedelta(minutes=i),
+                )
+            )
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def merchants(client, query):
+    resp = client.get(f'/receipts?{query}')
+    assert resp.status_code == 200, resp.get_json()
+    return [(r['merchant'], r['total']) for r in resp.get_json()['receipts']]
+
+
+@pytest.mark.parametrize(
+    'query, expected',
+    [
+        ('merchant=MEGA%20MART&sort=total', [('mega mart', 12.0), ('Mega Mart', 54.1)]),
+        (
+            'merchant_prefix=mega&sort=-total',
+            [('Megabytes', 899.99), ('Mega Mart', 54.1), ('mega mart', 12.0)],
+        ),
+        (
+            'date_from=2025-02-01&date_to=2025-03-01&sort=date',
+            [('mega mart', 12.0), ('Megabytes', 899.99), ('Corner Cafe', 4.5)],
+        ),
+        (
+            'min_total=10&max_total=60&sort=total',
+            [('mega mart', 12.0), ('Taxi Co', 23.4), ('Mega Mart', 54.1)],
+        ),
+        ('tag=coffee', [('Corner Cafe', None), ('Corner Cafe', 4.5)]),
+        ('tag=groceries&tag=weekly', [('Mega Mart', 54.1)]),
+        ('tag=week', []),
+        (
+            'sort=total',
+            [
+                ('Corner Cafe', 4.5),
+                ('mega mart', 12.0),
+                ('Taxi Co', 23.4),
+                ('Mega Mart', 54.1),
+                ('Megabytes', 899.99),
+            ],
+        ),
+    ],
+)
+def test_filters_and_sort(client, query, expected):
+    assert merchants(client, query) == expected
+    # Cursor mode returns the same rows, one page at a time
+    rows, cursor = [], ''
+    while cursor is not None:
+        body = client.get(f'/receipts?{query}&cursor={cursor}&per_page=2').get_json()
+        rows.extend((r['merchant'], r['total']) for r in body['receipts'])
+        cursor = body['next_cursor']
+    assert rows == expected
+
+
+@pytest.mark.parametrize(
+    'query',
+    ['date_from=yesterday', 'min_total=cheap', 'sort=merchant', 'sort=total&cursor=x'],
+)
+def test_invalid_filters(client, query):
+    assert client.get(f'/receipts?{query}').status_code == 400
+
+
+def test_cursor_is_tied_to_sort_key(client):
+    body = client.get('/receipts?sort=total&cursor=&per_page=1').get_json()
+    resp = client.get(f"/receipts?sort=date&cursor={body['next_cursor']}")
+    assert resp.status_code == 400
+
+
+def test_filtered_count_is_exact(client):
+    body = client.get(
+        '/receipts?merchant_prefix=corner&cursor=&count=estimate'
+    ).get_json()
+    assert body['total'] == 2 and not body['total_is_estimate']
+
+
+# (query args, index the plan must use)
+PLAN_CASES = [
+    ({'merchant': 'Mega Mart'}, 'ix_receipts_merchant_lower'),
+    ({'merchant_prefix': 'meg'}, 'ix_receipts_merchant_lower'),
+    (
+        {'date_from': '2025-02-01', 'date_to': '2025-02-28', 'sort': 'date'},
+        'ix_receipts_date_id',
+    ),
+    ({'min_total': '100', 'sort': '-total'}, 'ix_receipts_total_id'),
+    ({'sort': '-created_at'}, 'ix_receipts_created_at_id'),
+]
+
+
+def _listing_sql(args):
+    args = MultiDict(args)
+    q = _filtered_receipts(args)
+    column, descending = _sort_order(args)
+    if column is not Receipt.created_at:
+        q = q.filter(column.isnot(None))
+    q = q.order_by(column.desc() if descending else column.asc()).limit(10)
+    return str(q.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+
+
+@pytest.mark.parametrize('args, index', PLAN_CASES)
+def test_sqlite_query_plan_uses_index(app, args, index):
+    with app.app_context():
+        plan = ' '.join(
+            str(r)
+            for r in db.session.execute(
+                sa.text(f'EXPLAIN QUERY PLAN {_listing_sql(args)}')
+            )
+        )
+    assert index in plan, plan
+
+
+@pytest.mark.skipif(
+    not PG_URL, reason='set TEST_POSTGRES_URL to run Postgres plan tests'
+)
+@pytest.mark.parametrize('args, index', PLAN_CASES)
+def test_postgres_query_plan_uses_index(monkeypatch, args, index):
+    monkeypatch.setattr(TestConfig, 'SQLALCHEMY_DATABASE_URI', PG_URL)
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        try:
+            # Tiny test tables always favour a seq scan; ask whether the index is usable
+            db.session.execute(sa.text('SET enable_seqscan = off'))
+            plan = ' '.join(
+                r[0]
+                for r in db.session.execute(sa.text(f'EXPLAIN {_listing_sql(args)}'))
+            )
+        finally:
+            db.session.rollback()
+            db.drop_all()
+    assert index in plan, plan
+
+
+def _seed_bulk(engine, rows):
+    rng = random.Random(0)
+    names = [
+        f'{w} {i}'
+        for i, w in enumerate(['Mart', 'Cafe', 'Books', 'Fuel', 'Diner'] * 200)
+    ]
+    start = datetime(2023, 1, 1)
+    with engine.begin() as conn:
+        for offset in range(0, rows, 50_000):
+            conn.execute(
+                sa.insert(Receipt),
+                [
+                    {
+                        'filename': f'r{i}.png',
+                        'status': 'done',
+                        'merchant': rng.choice(names),
+                        'date': (start + timedelta(days=rng.randrange(1000))).date(),
+                        'total': round(rng.uniform(1, 500), 2),
+                        'created_at': start + timedelta(seconds=i * 90),
+                    }
+                    for i in range(offset, min(offset + 50_000, rows))
+                ],
+            )
+        conn.execute(sa.text('ANALYZE'))
+
+
+@pytest.mark.benchmark
+def test_filter_benchmark(tmp_path, monkeypatch):
+    """
+    Filtered listings over FILTER_BENCH_ROWS receipts (default 200k) with the
+    filter indexes, then with them dropped. Prints each query's plan.
+    """
+    monkeypatch.setattr(
+        TestConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/bench.db'
+    )
+    app = create_app('testing')
+    queries = {
+        'merchant': {'merchant': 'Mart 500'},
+        'merchant_prefix': {'merchant_prefix': 'books 9'},
+        'date range': {
+            'date_from': '2024-03-01',
+            'date_to': '2024-03-07',
+            'sort': 'date',
+        },
+        'total range': {'min_total': '499.5', 'sort': '-total'},
+        'newest': {'sort': '-created_at'},
+    }
+
+    def run_all():
+        timings = {}
+        for name, args in queries.items():
+            sql = _listing_sql(args)
+            db.session.execute(sa.text(sql)).fetchall()  # warm the page cache
+            start = time.perf_counter()
+            for _ in range(5):
+                db.session.execute(sa.text(sql)).fetchall()
+            plan = ' | '.join(
+                r[-1] for r in db.session.execute(sa.text(f'EXPLAIN QUERY PLAN {sql}'))
+            )
+            timings[name] = ((time.perf_counter() - start) / 5, plan)
+        return timings
+
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        _seed_bulk(db.engine, BENCH_ROWS)
+        seeded = time.perf_counter() - start
+        indexed = run_all()
+        for name in FILTER_INDEXES:
+            db.session.execute(sa.text(f'DROP INDEX {name}'))
+        db.session.commit()
+        scanned = run_all()
+    print(f"\n{BENCH_ROWS} rows seeded in {seeded:.1f}s")
+    for name in queries:
+        (t_idx, plan), (t_scan, _) = indexed[name], scanned[name]
+        print(
+            f"{name:>15}: {t_idx * 1000:7.2f}ms indexed vs {t_scan * 1000:7.1f}ms scan "
+            f" [{plan}]"
+        )
+    for name in queries:
+        assert (
+            'USING INDEX' in indexed[name][1]
+            or 'USING COVERING INDEX' in indexed[name][1]
+        )
+        assert indexed[name][0] < scanned[name][0]
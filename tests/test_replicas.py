@@ -0,0 +1,180 @@
+import io
+import sqlite3
+import tempfile
+import threading
+import time
+import pytest
+import sqlalchemy as sa
+import app.ocr as ocr_module
+from app import create_app, db
+from app.config import ProdConfig, TestConfig
+from app.database import STICKY_COOKIE, TimedQueuePool, engine_options
+from app.models import Receipt
+
+
+@pytest.fixture
+def replicate(tmp_path):
+    """
+    Copies the primary SQLite file over the replica, which otherwise lags
+    behind it forever.
+    """
+
+    def copy():
+        src, dst = sqlite3.connect(tmp_path / 'primary.db'), sqlite3.connect(
+            tmp_path / 'replica.db'
+        )
+        src.backup(dst)
+        src.close()
+        dst.close()
+
+    return copy
+
+
+@pytest.fixture
+def make_app(monkeypatch, tmp_path, replicate):
+    monkeypatch.setattr(
+        ocr_module, 'ocr_extract', lambda path: 'Corner Cafe\n2025-04-24\nTotal: 4.50'
+    )
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda text: {})
+
+    def make(**config):
+        monkeypatch.setattr(
+            TestConfig,
+            'SQLALCHEMY_DATABASE_URI',
+            f"sqlite:///{tmp_path / 'primary.db'}",
+        )
+        monkeypatch.setattr(
+            TestConfig,
+            'DATABASE_REPLICA_URLS',
+            [f"sqlite:///{tmp_path / 'replica.db'}"],
+        )
+        monkeypatch.setattr(TestConfig, 'REPLICA_MAX_LAG', 60)
+        for name, value in config.items():
+            monkeypatch.setattr(TestConfig, name, value, raising=False)
+        app = create_app('testing')
+        app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        with app.app_context():
+            db.create_all()
+        replicate()
+        return app
+
+    return make
+
+
+def _upload(client, name='a.png'):
+    data = {'file': (io.BytesIO(name.encode()), name)}
+    return client.post('/upload', data=data, content_type='multipart/form-data')
+
+
+def test_reads_go_to_replica(make_app, replicate):
+    app = make_app()
+    resp = _upload(app.test_client())
+    assert resp.status_code == 201
+    receipt_id = resp.get_json()['id']
+    # Another client reads the replica, which has not caught up
+    client = app.test_client()
+    assert client.get('/receipts').get_json()['total'] == 0
+    assert client.get(f'/receipts/{receipt_id}').status_code == 404
+    replicate()
+    # Nothing read from the lagging replica was cached
+    assert client.get('/receipts').get_json()['total'] == 1
+    assert client.get(f'/receipts/{receipt_id}').status_code == 200
+    assert client.get('/receipts/export').data.count(b'Corner Cafe') == 1
+    stats = client.get('/metrics').get_json()['replicas']
+    assert (
+        stats['replicas'] == 1
+        and stats['replica_reads'] == 6
+        and stats['sticky_reads'] == 0
+    )
+
+
+def test_read_your_writes(make_app):
+    app = make_app()
+    client = app.test_client()
+    resp = _upload(client)
+    receipt_id = resp.get_json()['id']
+    assert client.get_cookie(STICKY_COOKIE) is not None
+    # The uploader reads the primary until the replica has had time to catch up
+    assert client.get(f'/receipts/{receipt_id}').get_json()['merchant'] == 'Corner Cafe'
+    assert client.get('/receipts').get_json()['total'] == 1
+    assert client.get('/metrics').get_json()['replicas']['sticky_reads'] == 3
+    # A stamp further out than the lag window is not honoured
+    client.set_cookie(STICKY_COOKIE, str(time.time() + 3600))
+    client.get('/receipts')
+    assert client.get('/metrics').get_json()['replicas']['replica_reads'] == 2
+    # Reads set no cookie
+    fresh = app.test_client()
+    fresh.get('/receipts')
+    assert fresh.get_cookie(STICKY_COOKIE) is None
+
+
+def test_writes_in_replica_routed_session_go_to_primary(make_app):
+    app = make_app()
+    with app.test_request_context():
+        db.session.info['replica'] = app.extensions['replica_router'].engines[
+            'replica-0'
+        ]
+        db.session.add(Receipt(filename='a.png'))
+        db.session.commit()
+        assert Receipt.query.count() == 0
+        db.session.execute(sa.update(Receipt).values(merchant='Mega Mart'))
+        db.session.commit()
+        db.session.info.pop('replica')
+        assert Receipt.query.one().merchant == 'Mega Mart'
+
+
+def test_snapshot_reloads_once_replica_settles(make_app, replicate):
+    app = make_app(REPLICA_MAX_LAG=0.5)
+    _upload(app.test_client())
+    client = app.test_client()
+    assert client.get('/analytics/snapshot').get_json()['rows'] == 0
+    replicate()
+    time.sleep(0.6)
+    assert client.get('/analytics/snapshot').get_json()['rows'] == 1
+
+
+def test_pool_options():
+    config = {
+        name: getattr(ProdConfig, name) for name in dir(ProdConfig) if name.isupper()
+    }
+    options = engine_options(config, 'postgresql://db/receipts')
+    assert options['poolclass'] is TimedQueuePool
+    assert (options['pool_size'], options['max_overflow'], options['pool_timeout']) == (
+        10,
+        20,
+        5,
+    )
+    assert options['connect_args'] == {'options': '-c statement_timeout=30000'}
+    assert 'connect_args' not in engine_options(config, 'sqlite:///receipts.db')
+    assert engine_options(config, 'sqlite:///:memory:') == {}
+
+
+def test_pool_settings_per_engine(make_app):
+    app = make_app(DB_POOL_SIZE=3, SQLALCHEMY_ENGINE_OPTIONS={'pool_recycle': 60})
+    with app.app_context():
+        primary, replica = (
+            db.engine.pool,
+            app.extensions['replica_router'].engines['replica-0'].pool,
+        )
+        assert isinstance(primary, TimedQueuePool) and isinstance(
+            replica, TimedQueuePool
+        )
+        assert primary.size() == replica.size() == 3
+        # Explicit engine options win over the DB_POOL_* settings
+        assert primary._recycle == 60 and replica._recycle == TestConfig.DB_POOL_RECYCLE
+
+
+def test_pool_wait_metric(make_app):
+    app = make_app(DB_POOL_SIZE=1, DB_MAX_OVERFLOW=0, DB_POOL_TIMEOUT=0.1)
+    with app.app_context():
+        held = db.engine.connect()
+        with pytest.raises(sa.exc.TimeoutError):
+            db.engine.connect()
+        threading.Timer(0.2, held.close).start()
+        # Waits for the held connection, within a longer timeout
+        db.engine.pool._timeout = 5
+        db.engine.connect().close()
+    stats = app.test_client().get('/metrics').get_json()['db_pools']
+    assert set(stats) == {'primary', 'replica-0'}
+    assert stats['primary']['timeouts'] == 1 and stats['primary']['wait_ms_max'] >= 150
+    assert stats['primary']['size'] == 1 and stats['primary']['checked_out'] == 0
@@ -0,0 +1,163 @@
+import io
+import random
+import tempfile
+import time
+import pytest
+import sqlalchemy as sa
+import app.ocr as ocr_module
+from app import create_app, db
+from app.models import Receipt
+from app.search import snippet
+
+TEXTS = {
+    'mart.png': 'Mega Mart\n2025-05-01\nOat milk 2.34\nSourdough bread 4.10\nTotal: '
+    '6.44',
+    'cafe.png': 'Corner Cafe\n2025-05-02\nFlat white 3.20\nMilk jug deposit 1.00\nMilk '
+    'refill 0.50\nTotal: 4.70',
+    'fuel.png': 'Fuel Stop\n2025-05-03\nDiesel 40.00\nTotal: 40.00',
+}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # OCR returns canned text keyed by the uploaded file's content
+    monkeypatch.setattr(
+        ocr_module, 'ocr_extract', lambda path: TEXTS[open(path).read()]
+    )
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda text: {})
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    for name in TEXTS:
+        resp = app.test_client().post(
+            '/upload',
+            data={'file': (io.BytesIO(name.encode()), name)},
+            content_type='multipart/form-data',
+        )
+        assert resp.status_code == 201
+    return app.test_client()
+
+
+def merchants(client, query):
+    resp = client.get(f'/receipts/search?{query}')
+    assert resp.status_code == 200, resp.get_json()
+    return [r['receipt']['merchant'] for r in resp.get_json()['results']]
+
+
+def test_text_is_stored_compressed(app, client):
+    with app.app_context():
+        receipt = Receipt.query.filter_by(filename='cafe.png').one()
+        assert receipt.ocr_text == TEXTS['cafe.png']
+        assert receipt.raw_text != TEXTS['cafe.png'].encode()
+    assert 'raw_text' not in client.get(f'/receipts/{receipt.id}').get_json()
+
+
+def test_search_ranks_and_requires_every_word(client):
+    # Two mentions of "milk" outrank one
+    assert merchants(client, 'q=milk') == ['Corner Cafe', 'Mega Mart']
+    assert merchants(client, 'q=MILK+bread') == ['Mega Mart']
+    assert merchants(client, 'q=milkshake') == []
+
+
+def test_search_snippet_highlights(client):
+    result = client.get('/receipts/search?q=diesel').get_json()['results'][0]
+    start, end = result['highlights'][0]
+    assert result['snippet'][start:end] == 'Diesel'
+    assert '\n' not in result['snippet']
+
+
+def test_search_cursor_walk(client):
+    body = client.get('/receipts/search?q=total&per_page=2').get_json()
+    assert len(body['results']) == 2 and body['next_cursor']
+    rest = client.get(
+        f"/receipts/search?q=total&per_page=2&cursor={body['next_cursor']}"
+    ).get_json()
+    assert len(rest['results']) == 1 and rest['next_cursor'] is None
+    seen = [r['receipt']['id'] for r in body['results'] + rest['results']]
+    assert sorted(seen) == sorted(set(seen)) and len(seen) == 3
+
+
+@pytest.mark.parametrize(
+    'query', ['q=', 'q=%21%21', 'q=milk&cursor=bogus', 'q=milk&per_page=0']
+)
+def test_search_invalid(client, query):
+    assert client.get(f'/receipts/search?{query}').status_code == 400
+
+
+def test_index_follows_updates_and_deletes(app, client):
+    with app.app_context():
+        receipt = Receipt.query.filter_by(filename='fuel.png').one()
+        receipt.ocr_text = 'Fuel Stop\nUnleaded 35.00'
+        db.session.commit()
+        assert merchants(client, 'q=diesel') == []
+        assert merchants(client, 'q=unleaded') == ['Fuel Stop']
+        db.session.delete(receipt)
+        db.session.commit()
+    assert merchants(client, 'q=unleaded') == []
+
+
+def test_snippet_window():
+    text = (
+        ' '.join(f'word{i}' for i in range(100))
+        + ' needle '
+        + ' '.join(f'tail{i}' for i in range(100))
+    )
+    out, hits = snippet(text, ['needle'], width=60)
+    assert out.startswith('…') and out.endswith('…') and len(out) <= 62
+    assert [out[s:e] for s, e in hits] == ['needle']
+
+
+@pytest.mark.benchmark
+def test_search_benchmark(app):
+    """
+    One rare word over 100k stored receipt texts: the FTS index vs a LIKE
+    scan of the same text.
+    """
+    rows = 100_000
+    rng = random.Random(0)
+    items = [f'item{i}' for i in range(20_000)]
+    with app.app_context():
+        texts = [' '.join(rng.sample(items, 8)) for _ in range(rows)]
+        db.session.execute(
+            sa.insert(Receipt.__table__),
+            [
+                {'id': i + 1, 'filename': f'r{i}.png', 'status': 'done'}
+                for i in range(rows)
+            ],
+        )
+        db.session.execute(
+            sa.text('CREATE TABLE plain_text (id INTEGER PRIMARY KEY, body TEXT)')
+        )
+        db.session.execute(
+            sa.text('INSERT INTO plain_text VALUES (:id, :body)'),
+            [{'id': i + 1, 'body': t} for i, t in enumerate(texts)],
+        )
+        db.session.execute(
+            sa.text('INSERT INTO receipts_fts (rowid, body) VALUES (:id, :body)'),
+            [{'id': i + 1, 'body': t} for i, t in enumerate(texts)],
+        )
+        db.session.commit()
+        client = app.test_client()
+
+        start = time.perf_counter()
+        body = client.get('/receipts/search?q=item4242&per_page=100').get_json()
+        t_fts = time.perf_counter() - start
+        start = time.perf_counter()
+        like = db.session.execute(
+            sa.text(
+                "SELECT id FROM plain_text WHERE ' ' || body || ' ' LIKE '% item4242 %'"
+            )
+        ).all()
+        t_like = time.perf_counter() - start
+    assert len(body['results']) == len(like) > 0
+    print(
+        f"\nsearch over {rows} texts: FTS endpoint {t_fts * 1000:.1f}ms, LIKE scan "
+        f"{t_like * 1000:.1f}ms"
+    )
+    assert t_fts < t_like
@@ -0,0 +1,167 @@
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import pytest
+import sqlalchemy as sa
+from app import create_app, db
+from app.models import Receipt
+from app.schemas import ReceiptSchema
+from app.serializers import RECEIPT_FIELDS, receipt_serializer
+
+BENCH_ROWS = int(os.getenv('SERIALIZER_BENCH_ROWS', 20_000))
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(
+            [
+                Receipt(
+                    filename='a.png',
+                    merchant='Mega Mart',
+                    date=date(2025, 1, 5),
+                    total=54.1,
+                    notes='Weekly',
+                    tags='groceries,weekly',
+                    field_sources={'total': 'regex'},
+                    sha256='a' * 64,
+                    created_at=datetime(2025, 4, 1, 9, 30, 0, 250),
+                ),
+                Receipt(
+                    filename='b.png', tags='coffee', created_at=datetime(2025, 4, 2)
+                ),
+                Receipt(
+                    filename='c.png',
+                    merchant='Taxi Co',
+                    total=12,
+                    status='failed',
+                    error='OCR failed',
+                    created_at=datetime(2025, 4, 3),
+                ),
+            ]
+        )
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_matches_receipt_schema(app, client):
+    with app.app_context():
+        expected = ReceiptSchema(many=True).dump(
+            Receipt.query.order_by(Receipt.created_at.desc()).all()
+        )
+    assert client.get('/receipts').get_json()['receipts'] == expected
+    assert client.get('/receipts?cursor=').get_json()['receipts'] == expected
+    for receipt in expected:
+        assert client.get(f"/receipts/{receipt['id']}").get_json() == receipt
+
+
+@pytest.mark.parametrize(
+    'fields, expected',
+    [
+        ('id,total,date', {'id', 'total', 'date'}),
+        ('tags', {'tags'}),
+        (' merchant , merchant,', {'merchant'}),
+        ('', set(RECEIPT_FIELDS)),
+    ],
+)
+def test_sparse_fieldsets(client, fields, expected):
+    for query in (
+        f'fields={fields}&sort=total',
+        f'fields={fields}&sort=total&cursor=&per_page=1',
+    ):
+        body = client.get(f'/receipts?{query}').get_json()
+        assert {key for receipt in body['receipts'] for key in receipt} == expected
+    assert set(client.get(f'/receipts/1?fields={fields}').get_json()) == expected
+
+
+def test_sparse_cursor_walk(client):
+    # The cursor needs the sort key and id even when they are not returned
+    totals, cursor = [], ''
+    while cursor is not None:
+        body = client.get(
+            f'/receipts?fields=merchant&sort=-total&per_page=1&cursor={cursor}'
+        ).get_json()
+        totals.extend(r['merchant'] for r in body['receipts'])
+        cursor = body['next_cursor']
+    assert totals == ['Mega Mart', 'Taxi Co']
+
+
+@pytest.mark.parametrize(
+    'url',
+    ['/receipts?fields=id,secret', '/receipts?fields=raw_text', '/receipts/1?fields=x'],
+)
+def test_unknown_fields(client, url):
+    resp = client.get(url)
+    assert resp.status_code == 400 and 'error' in resp.get_json()
+
+
+def test_missing_receipt(client):
+    assert client.get('/receipts/999').status_code == 404
+
+
+def test_serializers_are_shared():
+    assert receipt_serializer('id,total') is receipt_serializer('id, total')
+    assert receipt_serializer(None) is receipt_serializer('')
+
+
+@pytest.mark.benchmark
+def test_serializer_benchmark(app):
+    """
+    Per-row cost of serializing SERIALIZER_BENCH_ROWS receipts (default 20k),
+    query included: ReceiptSchema over ORM objects vs ReceiptSerializer over
+    rows, with all fields and with a sparse field set.
+    """
+    rng = random.Random(0)
+    with app.app_context():
+        db.session.execute(
+            sa.insert(Receipt),
+            [
+                {
+                    'filename': f'r{i}.png',
+                    'status': 'done',
+                    'merchant': f'Shop {rng.randrange(100)}',
+                    'date': date(2025, 1, 1) + timedelta(days=rng.randrange(365)),
+                    'total': round(rng.uniform(1, 500), 2),
+                    'created_at': datetime(2025, 1, 1) + timedelta(minutes=i),
+                }
+                for i in range(BENCH_ROWS)
+            ],
+        )
+        db.session.commit()
+        # Give every receipt tags through the ORM so both paths read them
+        for receipt in Receipt.query.all():
+            receipt.tags = rng.choice(['food', 'food,travel', 'office'])
+        db.session.commit()
+        db.session.expire_all()
+
+        def timed(dump):
+            best = float('inf')
+            for _ in range(3):
+                db.session.expunge_all()
+                start = time.perf_counter()
+                result = dump()
+                best = min(best, time.perf_counter() - start)
+            return best / len(result) * 1e6, result
+
+        query = Receipt.query.order_by(Receipt.id)
+        schema_us, dumped = timed(lambda: ReceiptSchema(many=True).dump(query.all()))
+        full = receipt_serializer()
+        full_us, rows = timed(lambda: full.dump(full.select(query).all()))
+        sparse = receipt_serializer('id,total,date')
+        sparse_us, _ = timed(lambda: sparse.dump(sparse.select(query).all()))
+    assert rows == dumped
+    print(
+        f"\n{len(rows)} receipts, per row: ReceiptSchema {schema_us:.1f}us, "
+        f"serializer {full_us:.1f}us, serializer id,total,date {sparse_us:.1f}us"
+    )
+    assert full_us < schema_us / 2
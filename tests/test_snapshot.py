@@ -0,0 +1,208 @@
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+import numpy as np
+import pytest
+import sqlalchemy as sa
+from app import analytics, create_app, db
+from app.analytics import Snapshot, get_snapshot
+from app.models import Receipt
+
+# 1M rows takes ~30s to seed; the default keeps the suite quick
+BENCH_ROWS = int(os.getenv('ANALYTICS_BENCH_ROWS', 200_000))
+
+CAFE = [4.5, 4.8, 5.0, 4.6, 4.9, 5.1, 4.7, 86.0]
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+        for i, total in enumerate(CAFE):
+            db.session.add(
+                Receipt(
+                    filename=f'c{i}.png',
+                    merchant='Corner Cafe',
+                    total=total,
+                    date=date(2025, 4, 1) + timedelta(days=i),
+                )
+            )
+        db.session.add_all(
+            [
+                Receipt(
+                    filename='t1.png',
+                    merchant='Taxi Co',
+                    total=23.40,
+                    date=date(2025, 4, 3),
+                ),
+                Receipt(
+                    filename='t2.png',
+                    merchant='Taxi Co',
+                    total=23.40,
+                    date=date(2025, 4, 4),
+                ),
+                Receipt(
+                    filename='t3.png',
+                    merchant='Taxi Co',
+                    total=23.40,
+                    date=date(2025, 4, 9),
+                ),
+                Receipt(filename='x.png', merchant=None, total=10.00, date=None),
+                Receipt(filename='failed.png', merchant='Nope', total=None),
+            ]
+        )
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_load_streams_in_chunks(app):
+    with app.app_context():
+        snap = Snapshot.load(db.session, chunk_size=3)
+    assert len(snap) == 12  # receipts without a total are left out
+    assert snap.cents.dtype == np.int64 and snap.days.dtype == np.dtype('datetime64[D]')
+    assert snap.cents.sum() == round(sum(CAFE) * 100) + 3 * 2340 + 1000
+    assert snap.merchants == ['Corner Cafe', 'Taxi Co']
+    assert np.isnat(snap.days).sum() == 1 and (snap.merchant_codes == -1).sum() == 1
+    assert snap.stats()['bytes_per_row'] == 28.0
+
+
+def test_snapshot_invalidated_on_commit(app, monkeypatch):
+    monkeypatch.setattr(analytics, 'SNAPSHOT_TTL', 3600)
+    with app.app_context():
+        first = get_snapshot()
+        assert get_snapshot() is first
+        db.session.add(Receipt(filename='n.png', merchant='Taxi Co', total=1.0))
+        db.session.rollback()
+        assert get_snapshot() is first
+        db.session.add(Receipt(filename='n.png', merchant='Taxi Co', total=1.0))
+        db.session.commit()
+        assert len(get_snapshot()) == len(first) + 1
+
+
+def test_percentiles(client):
+    body = client.get('/analytics/percentiles?p=0,50,100&date_to=2025-04-05').get_json()
+    assert body['percentiles'] == {'0': 4.5, '50': 4.9, '100': 23.4}
+    assert client.get('/analytics/percentiles?p=150').status_code == 400
+
+
+def test_moving_average(client):
+    body = client.get(
+        '/analytics/moving-average?window=2&date_from=2025-04-08&date_to=2025-04-10'
+    ).get_json()
+    assert body['days'] == [
+        {'date': '2025-04-08', 'total': 86.0, 'average': 86.0},
+        {'date': '2025-04-09', 'total': 23.4, 'average': 54.7},
+        {'date': '2025-04-10', 'total': 0.0, 'average': 11.7},
+    ]
+
+
+def test_outliers(client):
+    outliers = client.get('/analytics/outliers?threshold=2').get_json()['outliers']
+    assert [(o['merchant'], o['total']) for o in outliers] == [('Corner Cafe', 86.0)]
+    # Taxi Co has too few receipts, and no spread
+    assert client.get('/analytics/outliers?min_count=100').get_json()['outliers'] == []
+
+
+def test_duplicates(client):
+    groups = client.get('/analytics/duplicates?window_days=1').get_json()['duplicates']
+    assert [(g['merchant'], g['total'], g['dates']) for g in groups] == [
+        ('Taxi Co', 23.4, ['2025-04-03', '2025-04-04'])
+    ]
+    groups = client.get('/analytics/duplicates?window_days=5').get_json()['duplicates']
+    assert len(groups[0]['ids']) == 3
+    assert client.get('/analytics/duplicates?window_days=-1').status_code == 400
+
+
+def test_empty_database():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    for path in ('snapshot', 'percentiles', 'moving-average', 'outliers', 'duplicates'):
+        assert client.get(f'/analytics/{path}').status_code == 200, path
+
+
+@pytest.mark.benchmark
+def test_snapshot_benchmark(app):
+    """
+    Load ANALYTICS_BENCH_ROWS receipts (default 200k) into a snapshot and
+    time the statistics on it, against per-merchant z-scores computed row
+    by row through Receipt.to_dict() on a 20k-row sample.
+    """
+    rng = random.Random(0)
+    names = [f'Shop {i}' for i in range(2000)]
+    start = date(2022, 1, 1)
+    with app.app_context():
+        for offset in range(0, BENCH_ROWS, 50_000):
+            db.session.execute(
+                sa.insert(Receipt.__table__),
+                [
+                    {
+                        'filename': 'b.png',
+                        'status': 'done',
+                        'merchant': rng.choice(names),
+                        'total': round(rng.lognormvariate(3, 1), 2),
+                        'date': start + timedelta(days=rng.randrange(1000)),
+                    }
+                    for _ in range(min(50_000, BENCH_ROWS - offset))
+                ],
+            )
+        db.session.commit()
+
+        t = time.perf_counter()
+        snap = Snapshot.load(db.session)
+        t_load = time.perf_counter() - t
+        timings = {}
+        for name, fn in [
+            ('percentiles', lambda: snap.percentiles([50, 90, 99])),
+            ('moving_average', lambda: snap.moving_average(30)),
+            ('outliers', lambda: snap.merchant_outliers()),
+            ('duplicates', lambda: snap.duplicate_amounts(window_days=3)),
+        ]:
+            t = time.perf_counter()
+            fn()
+            timings[name] = time.perf_counter() - t
+
+        sample = 20_000
+        t = time.perf_counter()
+        rows = [
+            r.to_dict()
+            for r in Receipt.query.filter(Receipt.total.isnot(None)).limit(sample)
+        ]
+        by_merchant = {}
+        for r in rows:
+            by_merchant.setdefault(r['merchant'], []).append(r['total'])
+        stats = {
+            m: (
+                sum(v) / len(v),
+                (sum(x * x for x in v) / len(v) - (sum(v) / len(v)) ** 2) ** 0.5,
+            )
+            for m, v in by_merchant.items()
+        }
+        [
+            r
+            for r in rows
+            if stats[r['merchant']][1]
+            and abs(r['total'] - stats[r['merchant']][0]) / stats[r['merchant']][1] >= 3
+        ]
+        t_rows = time.perf_counter() - t
+    stats = snap.stats()
+    print(
+        f"\n{stats['rows']} receipts: snapshot {stats['bytes'] / 2**20:.1f} MiB "
+        f"({stats['bytes_per_row']} B/row), loaded in {t_load:.2f}s"
+    )
+    print('  ' + ', '.join(f'{k} {v * 1000:.1f}ms' for k, v in timings.items()))
+    print(
+        f"  to_dict z-scores over {sample} rows: {t_rows * 1000:.0f}ms "
+        f"(~{t_rows * stats['rows'] / sample:.1f}s extrapolated)"
+    )
+    assert timings['outliers'] < t_rows
@@ -0,0 +1,208 @@
+import datetime
+import hashlib
+import io
+import os
+import tempfile
+import pytest
+import app.ocr as ocr_module
+from app import create_app, db, storage
+from app.models import Receipt
+from app.storage import LocalStorage, MemoryStorage, content_key, make_storage
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # The fake image holds the receipt's text
+    monkeypatch.setattr(ocr_module, 'ocr_extract', lambda path: open(path).read())
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda text: {})
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def _upload(client, content, name, query=''):
+    return client.post(
+        '/upload' + query,
+        data={'file': (io.BytesIO(content), name)},
+        content_type='multipart/form-data',
+    )
+
+
+def _text(merchant):
+    return f'{merchant}\n2025-04-24\nTotal: 4.50'.encode()
+
+
+def test_content_key():
+    digest = hashlib.sha256(b'x').hexdigest()
+    assert (
+        content_key(digest, 'IMG_0001.JPG')
+        == f'{digest[:2]}/{digest[2:4]}/{digest}.jpg'
+    )
+
+
+def test_same_name_different_receipts(app):
+    client = app.test_client()
+    first = _upload(client, _text('Mega Mart'), 'IMG_0001.jpg').get_json()
+    second = _upload(client, _text('Corner Cafe'), 'IMG_0001.jpg').get_json()
+    assert (first['merchant'], second['merchant']) == ('Mega Mart', 'Corner Cafe')
+    assert first['filename'] == second['filename'] == 'IMG_0001.jpg'
+    with app.app_context():
+        for receipt_id, merchant in (
+            (first['id'], 'Mega Mart'),
+            (second['id'], 'Corner Cafe'),
+        ):
+            receipt = db.session.get(Receipt, receipt_id)
+            assert receipt.storage_key == content_key(receipt.sha256, 'x.jpg')
+            with storage.receipt_file(receipt) as path:
+                assert open(path, 'rb').read() == _text(merchant)
+    # Only shard directories at the top; no temp files left behind
+    folder = app.config['UPLOAD_FOLDER']
+    assert all(
+        len(name) == 2 and os.path.isdir(os.path.join(folder, name))
+        for name in os.listdir(folder)
+    )
+
+
+def test_client_path_is_not_kept(app):
+    receipt = _upload(
+        app.test_client(), _text('Mega Mart'), 'C:\\Users\\me\\scan.png'
+    ).get_json()
+    assert receipt['filename'] == 'scan.png'
+
+
+def test_local_put(tmp_path):
+    backend = LocalStorage(str(tmp_path))
+    src = tmp_path / 'src.png'
+    src.write_bytes(b'data')
+    backend.put('ab/cd/abcd.png', str(src), move=False)
+    assert (
+        src.exists()
+        and backend.exists('ab/cd/abcd.png')
+        and backend.size('ab/cd/abcd.png') == 4
+    )
+    backend.put('ab/cd/abcd.png', str(src))
+    assert not src.exists() and backend.open('ab/cd/abcd.png').read() == b'data'
+    assert sorted(os.listdir(tmp_path)) == ['ab']
+    backend.delete('ab/cd/abcd.png')
+    assert not backend.exists('ab/cd/abcd.png')
+
+
+@pytest.mark.parametrize('backend', ['memory', 'app.storage:MemoryStorage'])
+def test_object_store_backend(app, backend):
+    app.config['STORAGE_BACKEND'] = backend
+    client = app.test_client()
+    receipt = _upload(client, _text('Mega Mart'), 'a.png').get_json()
+    assert receipt['merchant'] == 'Mega Mart'
+    # Async jobs read the file back through the backend too
+    job = _upload(client, _text('Corner Cafe'), 'b.png', '?async=1').get_json()
+    assert app.extensions['job_queue'].run_pending() == 1
+    assert client.get(job['status_url']).get_json()['status'] == 'done'
+    objects = app.extensions['storage'].objects
+    assert isinstance(app.extensions['storage'], MemoryStorage) and len(objects) == 2
+    assert os.listdir(app.config['UPLOAD_FOLDER']) == []
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        make_storage({'STORAGE_BACKEND': 'nowhere:Storage'})
+
+
+def _legacy(app, files, rows):
+    folder = app.config['UPLOAD_FOLDER']
+    for name, content in files.items():
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(content)
+    stamp = datetime.datetime(2024, 1, 1)
+    with app.app_context():
+        db.session.add_all(Receipt(filename=name, updated_at=stamp) for name in rows)
+        db.session.commit()
+
+
+def test_rehome(app):
+    files = {f'r{i}.png': _text(f'Shop {i}') for i in range(5)}
+    # Two receipts that shared a name, and so a file; one file is gone
+    _legacy(app, files, [*files, 'r0.png', 'gone.png'])
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=['storage', 'rehome', '--workers', '3', '--batch-size', '2']
+    )
+    assert result.exit_code == 0
+    assert (
+        'for 6 receipts, 1 missing' in result.output
+        and 'missing: gone.png' in result.output
+    )
+    with app.app_context():
+        for receipt in Receipt.query.filter(Receipt.filename != 'gone.png'):
+            assert receipt.sha256 == hashlib.sha256(files[receipt.filename]).hexdigest()
+            assert receipt.storage_key == content_key(receipt.sha256, receipt.filename)
+            assert receipt.updated_at == datetime.datetime(2024, 1, 1)
+            with storage.receipt_file(receipt) as path:
+                assert open(path, 'rb').read() == files[receipt.filename]
+    assert not any(
+        name.endswith('.png') for name in os.listdir(app.config['UPLOAD_FOLDER'])
+    )
+    result = runner.invoke(args=['storage', 'rehome'])
+    assert 'Moved 0 files (0 bytes) for 0 receipts, 1 missing' in result.output
+
+
+def test_rehome_stays_in_the_folder(app, tmp_path):
+    outside = tmp_path / 'outside.png'
+    outside.write_bytes(_text('Elsewhere'))
+    folder = app.config['UPLOAD_FOLDER']
+    os.symlink(outside, os.path.join(folder, 'link.png'))
+    os.mkdir(os.path.join(folder, 'dir.png'))
+    _legacy(
+        app,
+        {'r0.png': _text('Shop 0')},
+        ['r0.png', '', str(outside), '../outside.png', 'link.png', 'dir.png'],
+    )
+    result = app.test_cli_runner().invoke(args=['storage', 'rehome'])
+    assert result.exit_code == 0 and 'for 1 receipts, 4 missing' in result.output
+    assert outside.exists() and os.path.islink(os.path.join(folder, 'link.png'))
+    with app.app_context():
+        for receipt in Receipt.query.filter(Receipt.storage_key.is_(None)):
+            with pytest.raises(FileNotFoundError), storage.receipt_file(receipt):
+                pass
+
+
+def test_job_without_a_file_fails(app):
+    with app.app_context():
+        receipt = Receipt(filename='../outside.png', status='queued')
+        db.session.add(receipt)
+        db.session.commit()
+        app.extensions['job_queue'].submit(receipt.id)
+    assert app.extensions['job_queue'].run_pending() == 1
+    body = app.test_client().get(f'/jobs/{receipt.id}').get_json()
+    assert body['status'] == 'failed' and 'File not found' in body['error']
+
+
+def test_rehome_resumes(app, monkeypatch):
+    files = {f'r{i}.png': _text(f'Shop {i}') for i in range(4)}
+    _legacy(app, files, files)
+    rehome_file = storage._rehome_file
+
+    def crash_on_r2(backend, folder, filename):
+        if filename == 'r2.png':
+            raise OSError('disk went away')
+        return rehome_file(backend, folder, filename)
+
+    monkeypatch.setattr(storage, '_rehome_file', crash_on_r2)
+    with app.app_context(), pytest.raises(OSError):
+        storage.rehome(workers=2, batch_size=2)
+    with app.app_context():
+        # The first batch is committed and its originals removed; the rest
+        # is still readable where it was
+        moved = {
+            r.filename for r in Receipt.query.filter(Receipt.storage_key.isnot(None))
+        }
+        assert moved == {'r0.png', 'r1.png'}
+        for receipt in Receipt.query:
+            with storage.receipt_file(receipt) as path:
+                assert open(path, 'rb').read() == files[receipt.filename]
+    monkeypatch.setattr(storage, '_rehome_file', rehome_file)
+    with app.app_context():
+        report = storage.rehome(workers=2, batch_size=2)
+        assert (report.files, report.receipts) == (2, 2)
+        assert Receipt.query.filter(Receipt.storage_key.is_(None)).count() == 0
@@ -0,0 +1,215 @@
+import importlib.util
+import io
+import pathlib
+import random
+import tempfile
+import time
+import pytest
+import sqlalchemy as sa
+from app import create_app, db
+from app.models import Receipt, ReceiptTag, Tag, split_tags
+from app.schemas import ReceiptSchema
+
+MIGRATION = next(
+    pathlib.Path(__file__)
+    .parents[1]
+    .glob('migrations/versions/*_normalize_receipt_tags_*.py')
+)
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def upload(client, name, tags):
+    data = {'file': (io.BytesIO(name.encode()), name), 'tags': tags}
+    resp = client.post('/upload', data=data, content_type='multipart/form-data')
+    assert resp.status_code == 201
+    return resp.get_json()
+
+
+def test_split_tags():
+    assert split_tags(' food, drink,,food ,') == ['food', 'drink']
+    assert split_tags(['b', ' a', '', 'b']) == ['b', 'a']
+    assert split_tags(None) == []
+
+
+def test_upload_links_tags_in_order(app, client):
+    first = upload(client, 'a.png', 'travel, food,travel')
+    second = upload(client, 'b.png', 'food')
+    assert first['tags'] == ['travel', 'food']
+    with app.app_context():
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(Tag)) == 2
+        receipt = db.session.get(Receipt, first['id'])
+        assert receipt.tags == 'travel,food'
+        assert receipt.tag_names == ['travel', 'food']
+        assert db.session.get(Receipt, second['id']).tag_names == ['food']
+
+
+def test_retagging_relinks(app):
+    with app.app_context():
+        receipt = Receipt(filename='a.png', tags='a,b')
+        db.session.add(receipt)
+        db.session.commit()
+        receipt.tags = ['b', 'c']
+        db.session.commit()
+        assert receipt.tag_names == ['b', 'c']
+        assert receipt.tags == 'b,c'
+        assert (
+            db.session.scalar(sa.select(sa.func.count()).select_from(ReceiptTag)) == 2
+        )
+
+
+def test_dump_does_not_touch_the_row(app):
+    with app.app_context():
+        receipt = Receipt(filename='a.png', tags='x,y')
+        db.session.add(receipt)
+        db.session.commit()
+        assert ReceiptSchema().dump(receipt)['tags'] == ['x', 'y']
+        assert receipt.tags == 'x,y'
+        assert not db.session.dirty
+
+
+def test_tag_counts(client):
+    upload(client, 'a.png', 'food,travel')
+    upload(client, 'b.png', 'food')
+    upload(client, 'c.png', 'misc')
+    body = client.get('/tags').get_json()
+    assert body['tags'] == [
+        {'name': 'food', 'count': 2},
+        {'name': 'misc', 'count': 1},
+        {'name': 'travel', 'count': 1},
+    ]
+
+
+def test_tag_filter_uses_index(app):
+    from werkzeug.datastructures import MultiDict
+    from app.routes import _filtered_receipts
+
+    with app.app_context():
+        q = (
+            _filtered_receipts(MultiDict([('tag', 'food')]))
+            .order_by(Receipt.created_at.desc())
+            .limit(10)
+        )
+        sql = str(
+            q.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        )
+        plan = ' '.join(
+            str(r) for r in db.session.execute(sa.text(f'EXPLAIN QUERY PLAN {sql}'))
+        )
+    assert 'ix_receipt_tags_tag_id_receipt_id' in plan, plan
+
+
+def _load_migration():
+    spec = importlib.util.spec_from_file_location('tags_migration', MIGRATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_backfill_from_legacy_column(app):
+    migration = _load_migration()
+    with app.app_context():
+        # Core inserts bypass the ORM, like rows written before this change
+        db.session.execute(
+            sa.insert(Receipt.__table__),
+            [
+                {'id': 1, 'filename': 'a.png', 'status': 'done', 'tags': 'food, drink'},
+                {
+                    'id': 2,
+                    'filename': 'b.png',
+                    'status': 'done',
+                    'tags': 'drink,,drink',
+                },
+                {'id': 3, 'filename': 'c.png', 'status': 'done', 'tags': None},
+            ],
+        )
+        conn = db.session.connection()
+        rows = conn.execute(
+            sa.select(Receipt.id, Receipt.tags).where(Receipt.tags.isnot(None))
+        ).all()
+        for _ in range(2):  # a rerun converges on the same links
+            migration._backfill_batch(conn, rows)
+        assert db.session.get(Receipt, 1).tag_names == ['food', 'drink']
+        assert db.session.get(Receipt, 2).tag_names == ['drink']
+        assert db.session.get(Receipt, 3).tag_names == []
+
+
+@pytest.mark.benchmark
+def test_tag_filter_benchmark(app):
+    """
+    "Receipts tagged X" over 50k receipts with 3 tags each from a pool of
+    500: LIKE over the comma-separated column vs the tag index.
+    """
+    rows = 50_000
+    rng = random.Random(0)
+    pool = [f'tag{i}' for i in range(500)]
+    with app.app_context():
+        tag_rows = [{'id': i + 1, 'name': name} for i, name in enumerate(pool)]
+        receipts, links = [], []
+        for rid in range(1, rows + 1):
+            picked = rng.sample(range(len(pool)), 3)
+            receipts.append(
+                {
+                    'id': rid,
+                    'filename': f'r{rid}.png',
+                    'status': 'done',
+                    'tags': ','.join(pool[i] for i in picked),
+                }
+            )
+            links.extend(
+                {'receipt_id': rid, 'tag_id': i + 1, 'position': p}
+                for p, i in enumerate(picked)
+            )
+        db.session.execute(sa.insert(Tag.__table__), tag_rows)
+        db.session.execute(sa.insert(Receipt.__table__), receipts)
+        db.session.execute(sa.insert(ReceiptTag.__table__), links)
+        db.session.execute(sa.text('ANALYZE'))
+        db.session.commit()
+
+        tagged = (
+            sa.select(ReceiptTag.receipt_id)
+            .join(Tag, Tag.id == ReceiptTag.tag_id)
+            .where(Tag.name == 'tag7')
+        )
+        indexed = (
+            sa.select(sa.func.count())
+            .select_from(Receipt)
+            .where(Receipt.id.in_(tagged))
+        )
+        like = (
+            sa.select(sa.func.count())
+            .select_from(Receipt)
+            .where((',' + Receipt.tags + ',').like('%,tag7,%'))
+        )
+        counts = sa.select(ReceiptTag.tag_id, sa.func.count()).group_by(
+            ReceiptTag.tag_id
+        )
+
+        def timed(stmt, repeat=5):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = db.session.execute(stmt).all()
+            return (time.perf_counter() - start) / repeat, result
+
+        t_index, by_index = timed(indexed)
+        t_like, by_like = timed(like)
+        t_counts, _ = timed(counts)
+    assert by_index == by_like
+    print(
+        f"\ntag filter over {rows} receipts: LIKE {t_like * 1000:.1f}ms, index "
+        f"{t_index * 1000:.2f}ms; "
+        f"counts for {len(pool)} tags {t_counts * 1000:.1f}ms"
+    )
+    assert t_index < t_like
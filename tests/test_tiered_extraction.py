@@ -0,0 +1,156 @@
+import io
+import json
+import os
+import tempfile
+import pytest
+import app.ocr as ocr_module
+from app import create_app, db, pipeline
+from app.models import Receipt
+from app.parser import parse_with_confidence
+
+with open(
+    os.path.join(os.path.dirname(__file__), 'data', 'labeled_receipts.json'),
+    encoding='utf-8',
+) as f:
+    LABELED = json.load(f)
+LABELS = {s['text']: {k: s[k] for k in ('merchant', 'date', 'total')} for s in LABELED}
+
+
+class OracleLLM:
+    """
+    LLM stand-in that returns the labeled answer and counts calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return dict(LABELS.get(text, {}))
+
+    def many(self, texts):
+        return [self(t) for t in texts]
+
+
+@pytest.fixture
+def oracle(monkeypatch):
+    llm = OracleLLM()
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', llm)
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields_many', llm.many)
+    return llm
+
+
+def _correct(field, got, expected):
+    if got is None:
+        return False
+    if field == 'total':
+        return abs(float(got) - float(expected)) < 0.005
+    return got == expected
+
+
+def test_confidence_scores():
+    fields, conf = parse_with_confidence("Corner Cafe\n2025/04/24\nTotal: $4.50")
+    assert fields == {'merchant': 'Corner Cafe', 'date': '2025-04-24', 'total': '4.50'}
+    assert min(conf.values()) >= pipeline.CONFIDENCE_THRESHOLD
+    fields, conf = parse_with_confidence("*** WELCOME ***\n2025-13-01\nnothing")
+    assert fields['date'] is None
+    assert max(conf.values()) < pipeline.CONFIDENCE_THRESHOLD
+
+
+def test_confident_regex_skips_llm(oracle):
+    parsed = pipeline.parse_text("Corner Cafe\nDate: 2025-04-24\nTotal: $4.50")
+    assert oracle.calls == 0
+    assert parsed['sources'] == {'merchant': 'regex', 'date': 'regex', 'total': 'regex'}
+
+
+def test_low_confidence_fields_go_to_llm(oracle):
+    text = "*** WELCOME ***\nRiver Diner\n04/12/2025\nBurger 9.00\nAMOUNT DUE 9.00"
+    parsed = pipeline.parse_text(text)
+    assert oracle.calls == 1
+    assert parsed['merchant'] == 'River Diner'
+    assert parsed['sources']['merchant'] == 'llm'
+
+
+def test_malformed_llm_values_keep_regex_fields(monkeypatch):
+    text = "*** WELCOME ***\nRiver Diner\n04/12/2025\nAMOUNT DUE 9.00"
+    regexed, needed = pipeline.regex_tier(text)
+    answer = {'merchant': 'River Diner', 'date': '24/04/2025', 'total': '4,50'}
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields', lambda t: answer)
+    parsed = pipeline.parse_text(text)
+    assert parsed['merchant'] == 'River Diner'
+    assert parsed['sources']['merchant'] == 'llm'
+    for field in ('date', 'total'):
+        assert parsed[field] == regexed[field]
+        assert parsed['sources'].get(field) != 'llm'
+    receipt = Receipt()
+    assert pipeline.apply_result(receipt, parsed) and receipt.status == 'done'
+    assert receipt.total == 9.0
+
+
+def test_failed_llm_batch_keeps_regex_fields(monkeypatch, tmp_path):
+    def down(texts):
+        raise ConnectionError('LLM unreachable')
+
+    texts = {
+        'a.png': "*** WELCOME ***\nRiver Diner\n04/12/2025\nAMOUNT DUE 9.00",
+        'b.png': "Corner Cafe\nDate: 2025-04-24\nTotal: $4.50",
+    }
+    monkeypatch.setattr(ocr_module, 'ocr_extract', lambda p: texts[os.path.basename(p)])
+    monkeypatch.setattr(ocr_module, 'parse_receipt_fields_many', down)
+    paths = []
+    for name in texts:
+        (tmp_path / name).write_bytes(b'x')
+        paths.append(str(tmp_path / name))
+    results = pipeline.extract_many(paths, max_workers=1)
+    assert [error for _, error, _ in results] == [None, None]
+    (low, _, _), (confident, _, _) = results
+    assert 'llm' not in low['sources'].values() and low['text'] == texts['a.png']
+    assert confident['sources'] == {
+        'merchant': 'regex',
+        'date': 'regex',
+        'total': 'regex',
+    }
+
+
+def test_upload_records_field_sources(oracle, monkeypatch):
+    monkeypatch.setattr(ocr_module, 'ocr_extract', lambda p: LABELED[13]['text'])
+    app = create_app('testing')
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    resp = client.post(
+        '/upload',
+        data={'file': (io.BytesIO(b'x'), 'r.png')},
+        content_type='multipart/form-data',
+    )
+    body = resp.get_json()
+    assert body['field_sources'] == {
+        'merchant': 'llm',
+        'date': 'regex',
+        'total': 'regex',
+    }
+    assert body['merchant'] == 'Mega Mart'
+    assert body['date'] == '2025-03-03'
+
+
+def test_tiered_benchmark(oracle):
+    """
+    Accuracy of tiered extraction on the labeled set, and the share of LLM
+    calls avoided compared with calling the LLM for every receipt.
+    """
+    correct = {k: 0 for k in pipeline.FIELDS}
+    for sample in LABELED:
+        parsed = pipeline.parse_text(sample['text'])
+        for k in pipeline.FIELDS:
+            correct[k] += _correct(k, parsed[k], sample[k])
+    n = len(LABELED)
+    avoided = 1 - oracle.calls / n
+    accuracy = sum(correct.values()) / (3 * n)
+    per_field = ', '.join(f"{k} {v / n:.0%}" for k, v in correct.items())
+    print(
+        f"\n{n} receipts: accuracy {accuracy:.1%} ({per_field}), LLM calls avoided "
+        f"{avoided:.0%}"
+    )
+    assert avoided >= 0.4
+    assert accuracy >= 0.95